@@ -1,4 +1,5 @@
 from simworldbase import *
+from panda3d.core import PerspectiveLens
 
 worldModel = 'world'
 actorModel = 'ball'
@@ -10,29 +11,30 @@ actorModel = 'ball'
 
 class MouseWorld(SimWorldBase):
 	"""docstring for MouseWorld"""
-	def __init__(self, width, height, isFullscreen, title):
+	def __init__(self, width, height, isFullscreen, title, **kwargs):
 
-		SimWorldBase.__init__(self, width, height, isFullscreen, title)
+		SimWorldBase.__init__(self, width, height, isFullscreen, title, **kwargs)
 		
 		self.setupScene(worldModel)
 		self.addActor(actorModel, position=(0,0,10), collisionSphere=(0,0,0,0))
 		self.addLight('ambient', 'l', 'ambient')
 		self.actorOIMoveSpeed = 70
 		self.actorOITurnSpeed = 100
-		self.addCamera('camera', 'c', self.actorOINP, self.cam.node().getLens(), (0,0,0))
+		# Without a window (windowType 'none') there is no default camera.
+		lens = self.cam.node().getLens() if self.cam is not None else PerspectiveLens()
+		self.addCamera('camera', 'c', self.actorOINP, lens, (0,0,0))
 		self.cameraNP['camera'].lookAt(self.actorOINP)
 		self.activateCamera('camera')
 		self.activateActorOIControl(True)
 		
-		self.setTracing('myTraceFile')
+		# Position, heading, velocity and collision angle are traced by default.
+		self.addTraceChannel('speed', 'f4', lambda: self.actorOIVelocity.length())
+		self.setTracing('myTraceFile', backend='columnar')
 		
 	def myPositionUpdateFunction(self):
 		velocity_vector = np.r_[1,1] # calculated from some input on the device
 		return velocity_vector
 		
-	def traceUpdateFunc():
-		print "My actor is at [%f,%f] and is moving at %f speed, and collision angle is %f " % ( self.actorPosition[0], self.actorPosition[0], self.actorSpeed[0], self.collisionAngle[0] )
-		
 if __name__ == "__main__":
 	app = MouseWorld(width=1680, height=1050, isFullscreen=True, title='MouseWorld')
 	app.run()
\ No newline at end of file
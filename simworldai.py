@@ -0,0 +1,308 @@
+'''
+AI scheduling for SimWorldBase.
+
+AIScheduler updates the panda3d.ai characters and the vectorized population
+steering at a fixed rate decoupled from the render rate. Between two AI
+updates the rendered poses are interpolated from the last two AI states, so
+a low AI rate does not make the characters visibly jump. Only characters
+with an active steering behavior are interpolated; the others, and the
+character driven by the keyboard or step actions, keep the pose they are
+given between AI updates. The library
+characters move by a fixed step per AIWorld.update() call, which the fixed
+rate also makes independent of the frame rate.
+
+VectorSteering implements the simple seek, flee and wander behaviors for all
+actors of an ActorPopulation at once, with optional level of detail: actors
+far from a reference point are updated every few AI ticks only, with a
+correspondingly larger time step.
+'''
+
+import numpy as np
+
+
+NONE   = 0
+SEEK   = 1
+FLEE   = 2
+WANDER = 3
+
+_AI_BEHAVIORS = ('seek', 'flee', 'pursue', 'evade', 'arrival', 'wander',
+                 'flock', 'obstacle_avoidance', 'pathfollow')
+
+
+def _truncate(vectors, limits):
+    length = np.sqrt((vectors**2).sum(axis=1))
+    scale = np.where(length > limits, limits / np.maximum(length, 1e-12), 1.)
+    return vectors * scale[:,None]
+
+
+class VectorSteering(object):
+    '''
+    Steering state of the actors of a population: planar velocity, mass,
+    maximum force and speed, the behavior per actor and its target. Arrays
+    follow the population when actors are added to it.
+    '''
+
+    def __init__(self, population, mass=50., maxForce=30., maxSpeed=10.,
+                 panicDistance=10., wanderRadius=2., wanderDistance=4.,
+                 wanderJitter=1., seed=None):
+        self.population = population
+        self.defaults = {'mass': mass, 'maxForce': maxForce,
+                         'maxSpeed': maxSpeed}
+        self.panicDistance = panicDistance
+        self.wanderRadius = wanderRadius
+        self.wanderDistance = wanderDistance
+        self.wanderJitter = wanderJitter
+        self.random = np.random.RandomState(seed)
+
+        self.lodDistances = []
+        '''Ascending distances beyond which actors update less often.'''
+
+        self.lodDivisors = []
+        '''Update every n-th tick beyond the matching lodDistances entry.'''
+
+        self.tick = 0
+
+        self.velocity = np.zeros((0, 2))
+        self.mass = np.zeros(0)
+        self.maxForce = np.zeros(0)
+        self.maxSpeed = np.zeros(0)
+        self.behavior = np.zeros(0, dtype=np.int8)
+        self.target = np.zeros((0, 2))
+        self.wanderAngle = np.zeros(0)
+        self._sync()
+
+    def _sync(self):
+        n = len(self.population)
+        m = len(self.mass)
+        if n == m:
+            return
+        self.velocity = np.concatenate((self.velocity, np.zeros((n - m, 2))))
+        self.mass = np.append(self.mass, np.full(n - m,
+                                                 self.defaults['mass']))
+        self.maxForce = np.append(self.maxForce,
+                                  np.full(n - m, self.defaults['maxForce']))
+        self.maxSpeed = np.append(self.maxSpeed,
+                                  np.full(n - m, self.defaults['maxSpeed']))
+        self.behavior = np.append(self.behavior,
+                                  np.zeros(n - m, dtype=np.int8))
+        self.target = np.concatenate((self.target, np.zeros((n - m, 2))))
+        self.wanderAngle = np.append(self.wanderAngle,
+                                     self.random.uniform(0, 2*np.pi, n - m))
+
+    def setBehavior(self, indices, behavior, target=None):
+        self._sync()
+        self.behavior[indices] = behavior
+        if target is not None:
+            self.target[indices] = np.asarray(target, dtype=np.float64)[..., :2]
+
+    def seek(self, indices, target):
+        self.setBehavior(indices, SEEK, target)
+
+    def flee(self, indices, target):
+        self.setBehavior(indices, FLEE, target)
+
+    def wander(self, indices):
+        self.setBehavior(indices, WANDER)
+
+    def getLODMask(self, reference):
+        '''Actors due for an update this tick and their update divisors.'''
+        divisor = np.ones(len(self.mass), dtype=np.int64)
+        if reference is not None and self.lodDistances:
+            offset = self.population.position[:,:2] - np.asarray(reference)[:2]
+            distance = np.sqrt((offset**2).sum(axis=1))
+            level = np.searchsorted(self.lodDistances, distance)
+            divisor = np.concatenate(([1], self.lodDivisors))[level]
+        # Stagger the actors of a level over the ticks.
+        due = (self.tick + np.arange(len(divisor))) % divisor == 0
+        return due, divisor
+
+    def update(self, dt, reference=None):
+        self._sync()
+        due, divisor = self.getLODMask(reference)
+        self.tick += 1
+        active = due & (self.behavior != NONE)
+        if not active.any():
+            return
+
+        rows = np.nonzero(active)[0]
+        step = dt * divisor[rows]
+        position = self.population.position[rows, :2]
+        velocity = self.velocity[rows]
+        max_speed = self.maxSpeed[rows]
+        behavior = self.behavior[rows]
+        desired = np.zeros_like(velocity)
+
+        # Seek: full speed towards the target.
+        offset = self.target[rows] - position
+        distance = np.sqrt((offset**2).sum(axis=1))
+        toward = offset / np.maximum(distance, 1e-12)[:,None]
+        seek = behavior == SEEK
+        desired[seek] = toward[seek] * max_speed[seek, None]
+
+        # Flee: full speed away from the target while within panic distance.
+        flee = (behavior == FLEE) & (distance < self.panicDistance)
+        desired[flee] = -toward[flee] * max_speed[flee, None]
+
+        # Wander: steer towards a point jittering on a circle ahead.
+        wander = behavior == WANDER
+        if wander.any():
+            angle = self.wanderAngle[rows[wander]]
+            angle += self.random.uniform(-1, 1, len(angle)) * self.wanderJitter
+            self.wanderAngle[rows[wander]] = angle
+            heading = np.radians(self.population.heading[rows[wander]])
+            forward = np.column_stack((-np.sin(heading), np.cos(heading)))
+            circle = forward * self.wanderDistance + self.wanderRadius * \
+                np.column_stack((np.cos(angle), np.sin(angle)))
+            length = np.sqrt((circle**2).sum(axis=1))
+            desired[wander] = (circle / np.maximum(length, 1e-12)[:,None] *
+                               max_speed[wander, None])
+
+        force = _truncate(desired - velocity, self.maxForce[rows])
+        velocity = velocity + force / self.mass[rows, None] * step[:,None]
+        velocity = _truncate(velocity, max_speed)
+        self.velocity[rows] = velocity
+        self.population.position[rows, :2] = position + velocity * \
+            step[:,None]
+
+        moving = (velocity**2).sum(axis=1) > 1e-12
+        self.population.heading[rows[moving]] = np.degrees(
+            np.arctan2(-velocity[moving, 0], velocity[moving, 1]))
+
+
+class AIScheduler(object):
+    '''
+    Runs AI updates at rate updates per second (every frame when rate is
+    None) and interpolates the rendered poses in between when interpolate is
+    set. steering is an optional VectorSteering updated along with the
+    library characters; reference is a callable returning the point used for
+    its level of detail. controlled is a callable returning the name of the
+    character moved by other means, whose pose is never written.
+    '''
+
+    def __init__(self, AIWorld, AICharacters, rate=None, interpolate=True,
+                 steering=None, reference=None, maxStepsPerFrame=4,
+                 controlled=None):
+        self.AIWorld = AIWorld
+        self.AICharacters = AICharacters
+        self.rate = rate
+        self.interpolate = interpolate and rate is not None
+        self.steering = steering
+        self.reference = reference
+        self.maxStepsPerFrame = maxStepsPerFrame
+        self.controlled = controlled
+        self.accumulator = 0.
+        self.updateCount = 0
+
+        self.names = []
+        '''Characters interpolated, those with an active behavior.'''
+
+        self.nodePaths = []
+        self.previous = self.current = None
+        self._behaviors = {}
+
+    def _readState(self):
+        # Poses (x, y, z, h, p, r) of the library characters, then the
+        # population. The scalar getters are the cheapest way out of Panda.
+        poses = np.array([(node_path.getX(), node_path.getY(),
+                           node_path.getZ(), node_path.getH(),
+                           node_path.getP(), node_path.getR())
+                          for node_path in self.nodePaths]).reshape(-1, 6)
+        if self.steering is None:
+            return poses, None, None
+        population = self.steering.population
+        return poses, population.position.copy(), population.heading.copy()
+
+    def _writePoses(self, poses):
+        for node_path, pose in zip(self.nodePaths, poses.tolist()):
+            node_path.setPosHpr(*pose)
+
+    def _writeState(self, state):
+        poses, position, heading = state
+        self._writePoses(poses)
+        if self.steering is not None:
+            self.steering.population.push(position, heading)
+
+    def _updateNames(self):
+        names = self._getSteeringNames()
+        if names != self.names:
+            self.names = names
+            self.nodePaths = [self.AICharacters[name].getNodePath()
+                              for name in names]
+            self.previous = self.current = None
+
+    def _getSteeringNames(self):
+        controlled = self.controlled() if self.controlled else None
+        names = []
+        for name, character in self.AICharacters.items():
+            if name == controlled:
+                continue
+            behaviors = character.getAiBehaviors()
+            # Most characters keep their behavior, ask about it first.
+            behavior = self._behaviors.get(name)
+            if (behavior is None or
+                behaviors.behaviorStatus(behavior) != 'active'):
+                behavior = next((b for b in _AI_BEHAVIORS
+                                 if behaviors.behaviorStatus(b) == 'active'),
+                                None)
+                self._behaviors[name] = behavior
+            if behavior is not None:
+                names.append(name)
+        return names
+
+    def _lerpAngle(self, a, b, alpha):
+        return a + alpha * ((b - a + 180.) % 360. - 180.)
+
+    def _lerpState(self, a, b, alpha):
+        if any(x is not None and x.shape != y.shape for x, y in zip(a, b)):
+            return b
+        poses = b[0].copy()
+        poses[:,:3] = (1 - alpha) * a[0][:,:3] + alpha * b[0][:,:3]
+        poses[:,3] = self._lerpAngle(a[0][:,3], b[0][:,3], alpha)
+        if self.steering is None:
+            return poses, None, None
+        return (poses, (1 - alpha) * a[1] + alpha * b[1],
+                self._lerpAngle(a[2], b[2], alpha))
+
+    def _step(self, dt):
+        self.AIWorld.update()
+        if self.steering is not None:
+            reference = self.reference() if self.reference else None
+            self.steering.update(dt, reference)
+        self.updateCount += 1
+
+    def update(self, dt):
+        if self.rate is None:
+            self._step(dt)
+            if self.steering is not None:
+                self.steering.population.push()
+            return
+
+        # Frames without an AI update only write the interpolated poses.
+        period = 1. / self.rate
+        self.accumulator += dt
+        steps = 0
+        while self.accumulator >= period and steps < self.maxStepsPerFrame:
+            if self.interpolate:
+                if steps == 0 and self.current is not None:
+                    # The AI updates from the true poses, not the
+                    # interpolated ones.
+                    self._writePoses(self.current[0])
+                # Behaviors only take effect at an update, so the set of
+                # steering characters is looked at no more often.
+                self._updateNames()
+                self.previous = self.current or self._readState()
+            self._step(period)
+            if self.interpolate:
+                self.current = self._readState()
+            self.accumulator -= period
+            steps += 1
+        if steps == self.maxStepsPerFrame:
+            # Drop the backlog instead of spiralling after a long stall.
+            self.accumulator = min(self.accumulator, period)
+
+        if self.interpolate and self.previous is not None:
+            alpha = self.accumulator / period
+            self._writeState(self._lerpState(self.previous, self.current,
+                                             alpha))
+        elif self.steering is not None:
+            self.steering.population.push()
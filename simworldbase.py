@@ -10,8 +10,11 @@ import sys
 import io
 import os
 import atexit
+import fnmatch
 from textwrap import dedent
 
+import numpy as np
+
 from direct.task import Task
 from direct.actor.Actor import Actor
 from direct.gui.OnscreenText import OnscreenText
@@ -25,8 +28,8 @@ from panda3d.core import Camera
 from panda3d.core import CollisionNode
 from panda3d.core import CollisionSphere
 from panda3d.core import CollisionTraverser
-from panda3d.core import CollisionHandlerEvent
 from panda3d.core import CollisionHandlerPusher
+from panda3d.core import ClockObject
 from panda3d.core import ConfigVariableBool
 from panda3d.core import ConfigVariableInt
 from panda3d.core import ConfigVariableString
@@ -34,33 +37,81 @@ from panda3d.core import DirectionalLight
 from panda3d.core import PointLight
 from panda3d.core import Fog
 from panda3d.core import NodePath
+from panda3d.core import NodePathCollection
 from panda3d.core import TextNode
 from panda3d.core import WindowProperties
 from panda3d.core import Point3
+from panda3d.core import Vec3
 from panda3d.core import Vec3D
 from panda3d.core import Filename
+from panda3d.core import loadPrcFileData
 from panda3d.physics import ActorNode
 from panda3d.physics import PhysicsCollisionHandler
 from panda3d.ai import *            
 
+from simworldai import AIScheduler
+from simworldai import VectorSteering
+from simworldcapture import FrameCapture
+from simworldcollision import CollisionBatcher
+from simworldcollision import COLLISION_EVENT_DTYPE
+from simworldcolumnar import ColumnarTraceWriter
+from simworldcontrol import ControlLoop
+from simworldhistory import ActorHistory
+from simworldmaps import WorldMaps
+from simworldmodels import ModelCache
+from simworldpaging import splitIntoTiles
+from simworldpaging import WorldPager
+from simworldpopulation import ActorPopulation
+from simworldprofile import FrameProfiler
+from simworldpublish import TracePublisher
+from simworldreplay import SessionRecorder
+from simworldrig import CameraRig
+from simworldscene import optimizeScene
+from simworldschema import TraceSchema
+from simworldspatial import SpatialIndex
+from simworldspatial import SOLID
+from simworldspatial import GOAL
+from simworldtrace import TraceWriter
+from simworldtrace import TRACE_EVENT_ENTER
+from simworldtrace import TRACE_EVENT_EXIT
+
 
 class SimWorldBase(ShowBase):
  
-    def __init__(self, width, height, isFullscreen, title):
+    def __init__(self, width, height, isFullscreen, title, 
+                 windowType='onscreen', fixedDt=None, threadingModel=None):
         
+        self.isHeadless = windowType != 'onscreen'
+        '''
+        True when running without an onscreen window. The window type is 
+        either 'offscreen', which renders into a buffer only when asked, or 
+        'none', which opens no graphics output at all.
+        '''
+
+        if self.isHeadless:
+            loadPrcFileData('', 'window-type {0}'.format(windowType))
+            loadPrcFileData('', 'win-size {0} {1}'.format(width, height))
+            loadPrcFileData('', 'audio-library-name null')
+
+        # E.g. 'Cull/Draw' culls the display regions of a frame in one thread
+        # while drawing them in another.
+        if threadingModel is not None:
+            loadPrcFileData('', 'threading-model {0}'.format(threadingModel))
+
         ShowBase.__init__(self)
 
         #=======================================================================
         # Set window properties.
         #=======================================================================
-        win_props = WindowProperties(self.win.getProperties())
-        win_props.setTitle(title)
-        win_props.setFullscreen(isFullscreen)
-        win_props.setSize(width, height)
-        self.win.requestProperties(win_props)
+        if not self.isHeadless:
+            win_props = WindowProperties(self.win.getProperties())
+            win_props.setTitle(title)
+            win_props.setFullscreen(isFullscreen)
+            win_props.setSize(width, height)
+            self.win.requestProperties(win_props)
         
-        # Apply the property changes.
-        self.graphicsEngine.openWindows()
+            # Apply the property changes.
+            self.graphicsEngine.openWindows()
 
         #=======================================================================
         # Scene related fields.
@@ -70,6 +121,49 @@ class SimWorldBase(ShowBase):
         Main scene node path. There can be only one scene at any given time.
         '''
 
+        self.sceneReport = None
+        '''Node and Geom counts of the scene before and after optimization.'''
+
+        self.worldPager = None
+        '''
+        Pager of the scene tiles around the actor of interest when the scene
+        was set up with setupPagedScene.
+        '''
+
+        self.objectIndex = {}
+        '''
+        Dictionary of lists of node paths keyed with the node name. Filled by
+        setupScene, addActor and addPopulation; call indexObject for nodes 
+        attached to the scene graph by other means.
+        '''
+
+        self.objectMasks = []
+        '''
+        (name, bit, flag) of the setObjectSolid, setObjectGoal and 
+        clearObjectGoals calls still in effect, in call order, name None for
+        the whole scene. Replayed by applyObjectMasks on objects loaded 
+        later, e.g. paged in tiles, which come with the model's masks.
+        '''
+
+        self.spatialIndex = None
+        '''
+        2D index of the solid and goal geometry of the scene, built on request
+        with buildSpatialIndex.
+        '''
+
+        self.worldMaps = None
+        '''
+        Occupancy, distance and region maps of the solid and goal geometry of
+        the scene, built on request with buildWorldMaps.
+        '''
+
+        model_dir = os.path.join(os.path.dirname(__file__), 'models')
+        self.modelCache = ModelCache(self.loader, model_dir)
+        '''
+        Loads models from the models directory through converted .bam files
+        and shares the models of actors with the same name.
+        '''
+
         #=======================================================================
         # Actor related fields.
         #=======================================================================
@@ -123,6 +217,35 @@ class SimWorldBase(ShowBase):
         Actor of interest's velocity vector after the last frame.
         '''
 
+        self.actorHistory = None
+        '''
+        Dictionary of ActorHistory keyed with the actor name when the history
+        is on, see setHistory. Appended to before actorOIStateUpdateFunc.
+        '''
+
+        self._historyOptions = None
+        self._historyFrame = None
+
+        self.motionSensor = None
+        '''
+        Motion sensor driving the actor of interest instead of the keyboard
+        when set, see setMotionSensor.
+        '''
+
+        self.controlLoop = None
+        '''
+        Thread moving the actor of interest at a fixed rate instead of the
+        actorControl task when set, see startControlLoop.
+        '''
+
+        self._controlPos = None
+
+        self.population = ActorPopulation()
+        '''
+        Kinematic state of the simulated actors added with addPopulation. 
+        These are integrated together in one vectorized step per frame.
+        '''
+
         #=======================================================================
         # Camera related fields.
         #=======================================================================
@@ -134,6 +257,13 @@ class SimWorldBase(ShowBase):
         # Add the showbase camera as 'default'.
         self.cameraNP['default'] = self.cam
 
+        self.cameraRig = {}
+        '''
+        Dictionary of multi-view camera rigs keyed with the rig name. The 
+        cameras and display regions of a rig are also listed in cameraNP and
+        displayRegion as '<rig name>.<view name>'.
+        '''
+
         #=======================================================================
         # Illumination related fields
         #=======================================================================
@@ -167,14 +297,20 @@ class SimWorldBase(ShowBase):
         regions will be applied to the current display region of interest.
         '''
 
+        self.frameCapture = None
+        '''Offscreen capture of a display region's camera, see setCapture.'''
+
         # Add the display region associated with the default showbase camera.
-        self.displayRegion['default'] = self.camNode.getDisplayRegion(0)
-        self.displayRegion['default'].setSort(1) 
-        self.accept('control-`', self.setDisplayRegionOfInterest, ['default'])
+        # Without a graphics output there is no camera and no display region.
+        if self.camNode is not None:
+            self.displayRegion['default'] = self.camNode.getDisplayRegion(0)
+            self.displayRegion['default'].setSort(1) 
+            self.accept('control-`', self.setDisplayRegionOfInterest, 
+                        ['default'])
         
-        # Current display region of interest is the 'default' one.
-        self.displayRegionOI = self.displayRegion['default']
-        self.displayRegionOIName = 'default'
+            # Current display region of interest is the 'default' one.
+            self.displayRegionOI = self.displayRegion['default']
+            self.displayRegionOIName = 'default'
 
         #=======================================================================
         # AI related fields.
@@ -182,6 +318,14 @@ class SimWorldBase(ShowBase):
         self.AIWorld = AIWorld(self.render)
         self.AICharacter = {}
 
+        self.populationSteering = VectorSteering(self.population)
+        '''
+        Seek, flee and wander steering of the population actors, updated
+        with the AI characters once startAITask is called.
+        '''
+
+        self.AIScheduler = None
+
         #=======================================================================
         # Trace file related fields.
         #=======================================================================
@@ -191,14 +335,64 @@ class SimWorldBase(ShowBase):
         self.traceMessage = ''
         '''Message to be written to the trace file.'''
 
+        self.traceWriter = None
+        '''Binary trace writer, used instead of the trace file when tracing 
+        with the binary backend.'''
+
+        self.tracePublisher = None
+        '''
+        Publisher streaming the trace records to local subscribers, see 
+        setPublishing. Independent of the trace file.
+        '''
+
+        self.traceEvents = 0
+        '''Collision event flags accumulated since the last trace record.'''
+
+        self.traceCollisionAngle = float('nan')
+        '''Angle in degrees between the actor heading and the surface normal
+        of the most recent collision since the last trace record.'''
+
+        self.traceSchema = TraceSchema()
+        '''
+        Channels of the binary, columnar and published trace records. Holds
+        the fields of TRACE_DTYPE; add channels with addTraceChannel.
+        '''
+        self._addDefaultTraceChannels()
+
         self.onScreenHelpNP = None
         '''Text node path holding the on screen help information.'''
 
+        self.sessionRecorder = None
+        '''Records inputs, frame dt and events for replay, see setRecording.'''
+
+        #=======================================================================
+        # Profiling related fields.
+        #=======================================================================
+        self.profiler = None
+        '''Frame-time and task-level profiler, see setProfiling.'''
+
+        self.onScreenProfileNP = None
+        '''Text node path holding the on screen profile information.'''
+
+        self.onScreenProfileTime = 0
+        '''Real time of the last on screen profile update.'''
+
         #=======================================================================
         # Other fields.
         #=======================================================================
         self.clock = globalClock
         '''Exposes Panda3D's GlobalClock.'''
+
+        self.fixedDt = fixedDt
+        '''
+        Seconds that elapse on the clock between two frames regardless of the
+        wall clock, or None to run in real time. A fixed step makes movement
+        deterministic and lets headless sessions run faster than real time.
+        '''
+
+        if fixedDt is not None:
+            self.clock.setMode(ClockObject.MNonRealTime)
+            self.clock.setDt(fixedDt)
         
         self.userDialog = OnscreenText(text='', bg=(0,0,0,.6), fg=(.8,0,0,1),
                                        mayChange=True)
@@ -211,13 +405,35 @@ class SimWorldBase(ShowBase):
         self.disableMouse()
         
         # We do not need the default camera.
-        self.cam.node().setActive(False)
+        if self.cam is not None:
+            self.cam.node().setActive(False)
 
         # Make sure a clean exit from the application when requested.
-        atexit.register(self.exitfunc)
+        atexit.register(self.destroy)
         
         # Default collision traverser.
         self.cTrav = CollisionTraverser()
+
+        self.collisionBatcher = CollisionBatcher(self.cTrav, self.render)
+        '''
+        Collects the contacts of the actor event colliders after each 
+        traversal into one batch of enter and exit events per frame.
+        '''
+
+        self.isActorEventCallbacks = True
+        '''
+        Call onActorEnterEventFunc and onActorExitEventFunc once per event in 
+        addition to onCollisionBatchFunc. Turn off with many actors.
+        '''
+
+        self.contactWriter = None
+        '''Binary writer of the collision events, see setContactTracing.'''
+
+        self.lastCollisionEvents = np.zeros(0, dtype=COLLISION_EVENT_DTYPE)
+        '''Collision events of the current frame.'''
+
+        # The default collision traversal runs in the task with sort 30.
+        self.taskMgr.add(self.collisionEventTask, 'collisionEvents', sort=31)
         
         #=======================================================================
         # On screen help setup.
@@ -235,6 +451,17 @@ class SimWorldBase(ShowBase):
         self.onScreenHelpNP.reparentTo(self.a2dTopLeft)
         self.onScreenHelpNP.hide()
 
+        self.onScreenProfileNP = OnscreenText(text='',
+                                              font=text_font,
+                                              style=1, 
+                                              fg=(1,1,1,1),
+                                              bg=(0,0,0,.6), 
+                                              align=TextNode.ARight,
+                                              scale=.05,
+                                              mayChange=True)
+        self.onScreenProfileNP.reparentTo(self.a2dTopRight)
+        self.onScreenProfileNP.hide()
+
         #=======================================================================
         # Keyboard control related fields and default settings.
         #=======================================================================
@@ -248,66 +475,407 @@ class SimWorldBase(ShowBase):
 
         self.addHotKey('t', 'toggle pip', self.toggleDisplayRegion, [])
         self.addHotKey('f1', 'help', self.toggleOnScreenHelp, [])
+        self.addHotKey('f2', 'profile', self.toggleOnScreenProfile, [])
         self.addHotKey('escape', 'quit', self.shutDown, [])
 
-    def setTracing(self, fileName, flag=True):
-        if flag and self.traceFile is None:
-            self.traceFile = open(fileName, 'w')
+    def setTracing(self, fileName, flag=True, backend='text', **options):
+        '''
+        Starts writing a trace record per frame. backend is 'binary' (.npy
+        file), 'columnar' (compressed columns, options are passed on to 
+        simworldcolumnar.ColumnarTraceWriter), 'text' (traceMessage lines) 
+        or a writer object.
+        '''
+        if flag and not self.getTracing():
+            dtype = self.traceSchema.getDtype()
+            if backend == 'binary':
+                self.traceWriter = TraceWriter(fileName, dtype)
+            elif backend == 'columnar':
+                self.traceWriter = ColumnarTraceWriter(fileName, dtype, 
+                                                       **options)
+            elif backend == 'text':
+                self.traceFile = open(fileName, 'w')
+            else:
+                # Any object with append(record) and close() methods.
+                self.traceWriter = backend
+            self._updateTraceTask()
+        elif not flag:
+            if self.traceFile is not None:
+                self.traceFile.close()
+                self.traceFile = None
+            if self.traceWriter is not None:
+                self.traceWriter.close()
+                self.traceWriter = None
+            self._updateTraceTask()
+
+    def getTracing(self):
+        return self.traceFile is not None or self.traceWriter is not None
+
+    def addTraceChannel(self, name, dtype, getter, shape=()):
+        '''
+        Adds a channel to the trace records, sampled every frame by calling
+        getter(), e.g. addTraceChannel('speed', 'f4', lambda: self.speed).
+        Channels are fixed while tracing or publishing.
+        '''
+        if self.getTracing() or self.getPublishing():
+            raise ValueError('Trace channels cannot change while tracing.')
+        self.traceSchema.addChannel(name, dtype, getter, shape)
+
+    def _addDefaultTraceChannels(self):
+        # The fields of TRACE_DTYPE, grouped to save getter calls.
+        schema = self.traceSchema
+        schema.addChannels([('time', '<f8'), ('frame', '<i8')],
+                           lambda: (self.clock.getFrameTime(), 
+                                    self.clock.getFrameCount()))
+        schema.addChannels([('x', '<f4'), ('y', '<f4'), ('z', '<f4')],
+                           lambda: self.actorOILocation)
+        schema.addChannel('heading', '<f4', lambda: 
+                          self.actorOINP.getH() if self.actorOINP else 0)
+        schema.addChannels([('vx', '<f4'), ('vy', '<f4'), ('vz', '<f4')],
+                           lambda: self.actorOIVelocity)
+        schema.addChannels([('moveDir', '<i1'), ('turnDir', '<i1'),
+                            ('events', '<u1'), ('collisionAngle', '<f4')],
+                           lambda: (self.actorOIMoveDir, self.actorOITurnDir,
+                                    self.traceEvents, 
+                                    self.traceCollisionAngle))
+
+    def setContactTracing(self, fileName, flag=True):
+        '''Writes the collision events to a binary .npy trace file.'''
+        if flag and self.contactWriter is None:
+            self.contactWriter = TraceWriter(fileName, COLLISION_EVENT_DTYPE,
+                                             capacity=4096, flushSize=256)
+        elif not flag and self.contactWriter is not None:
+            self.contactWriter.close()
+            self.contactWriter = None
+
+    def getContactTracing(self):
+        return self.contactWriter is not None
+
+    def setPublishing(self, address, flag=True, queueSize=1024):
+        '''
+        Streams the binary trace records to the TraceSubscribers of the Unix
+        datagram socket at address, with or without a trace file.
+        '''
+        if flag and self.tracePublisher is None:
+            self.tracePublisher = TracePublisher(
+                address, self.traceSchema.getDtype(), queueSize=queueSize)
+        elif not flag and self.tracePublisher is not None:
+            self.tracePublisher.close()
+            self.tracePublisher = None
+        self._updateTraceTask()
+
+    def getPublishing(self):
+        return self.tracePublisher is not None
+
+    def _updateTraceTask(self):
+        # One task serves the trace file and the publisher.
+        is_needed = self.getTracing() or self.getPublishing()
+        if is_needed and not self.taskMgr.hasTaskNamed('traceUpdate'):
             self.taskMgr.add(self.traceUpdateTask, 'traceUpdate', sort=100)
-        else:
+        elif not is_needed:
             self.taskMgr.remove('traceUpdate')
-            self.traceFile.close()
-            self.traceFile = None
 
-    def getTracing(self):
-        return self.taskMgr.hasTaskNamed('traceUpdate')
+    def setRecording(self, fileName, flag=True):
+        if flag and self.controlLoop is not None:
+            raise ValueError('Sessions are recorded from the per-frame '
+                             'control task, stop the control loop first.')
+        if flag and self.sessionRecorder is None:
+            self.sessionRecorder = SessionRecorder(fileName)
+        elif not flag and self.sessionRecorder is not None:
+            self.sessionRecorder.close()
+            self.sessionRecorder = None
+
+    def getRecording(self):
+        return self.sessionRecorder is not None
+
+    def setCapture(self, directory, flag=True, displayRegion=None, 
+                   decimation=1, size=None, workers=2):
+        if flag and self.frameCapture is None:
+            if self.win is None:
+                raise ValueError("Frame capture needs a graphics output, "
+                                 "create the world with windowType "
+                                 "'offscreen' to capture headless.")
+            if displayRegion is None:
+                displayRegion = self.displayRegionOIName
+            dr = self.displayRegion[displayRegion]
+            if size is None:
+                size = (dr.getPixelWidth(), dr.getPixelHeight())
+            self.frameCapture = FrameCapture(self, dr.getCamera(), directory,
+                                             size, decimation, workers)
+            # The render loop task 'igLoop' runs with sort 50.
+            self.taskMgr.add(self.frameCapture.preRenderTask, 'capturePre',
+                             sort=49)
+            self.taskMgr.add(self.frameCapture.postRenderTask, 'capturePost',
+                             sort=51)
+        elif not flag and self.frameCapture is not None:
+            self.taskMgr.remove('capturePre')
+            self.taskMgr.remove('capturePost')
+            self.frameCapture.close()
+            self.frameCapture = None
+
+    def getCapture(self):
+        return self.frameCapture is not None
+
+    def setHistory(self, flag=True, regions=None, chunkSize=4096):
+        '''
+        Starts keeping the state history of every actor in memory, see
+        simworldhistory. regions is a dictionary of (left, right, bottom,
+        top) rectangles keyed with the region name. Turning the history on
+        again starts a new one.
+        '''
+        if flag:
+            self._historyOptions = (regions, chunkSize)
+            self._historyFrame = None
+            self.actorHistory = dict(
+                (name, ActorHistory(regions, chunkSize)) 
+                for name in self.actorNP)
+        else:
+            self.actorHistory = None
+
+    def getHistory(self, name=None):
+        if self.actorHistory is None:
+            return None
+        return self.actorHistory.get(name or self.actorOIName)
+
+    def _updateHistory(self):
+        time = self.clock.getFrameTime()
+        frame = self.clock.getFrameCount()
+        # One record per actor and frame, whoever calls.
+        if frame == self._historyFrame:
+            return
+        self._historyFrame = frame
+        for name, actor_np in self.actorNP.items():
+            history = self.actorHistory.get(name)
+            if history is None:
+                # Added after the history was turned on.
+                history = self.actorHistory[name] = ActorHistory(
+                    *self._historyOptions)
+            history.append(time, frame, actor_np.getPos(), actor_np.getH())
+
+    def setProfiling(self, flag=True, frameRate=None):
+        if flag and not self.getProfiling():
+            if frameRate is None:
+                frameRate = 1. / self.fixedDt if self.fixedDt else 60.
+            self.profiler = FrameProfiler(self.taskMgr, self.clock, frameRate)
+            # Runs after every other task of the frame, rendering included.
+            self.taskMgr.add(self.profileUpdateTask, 'profileUpdate', 
+                             sort=1000)
+        elif not flag:
+            self.taskMgr.remove('profileUpdate')
+
+    def getProfiling(self):
+        return self.taskMgr.hasTaskNamed('profileUpdate')
+
+    def dumpProfile(self, fileName):
+        self.profiler.dump(fileName)
 
     def setupScene(self, modelName, position=(0,0,0), orientation=(0,0,0), 
-                   scale=(1,1,1)):
-        base_path  = os.path.dirname(__file__)
-        model_path = os.path.join(base_path, 'models', modelName)
-        model_path = Filename.fromOsSpecific(model_path)
-        self.sceneNP = self.loader.loadModel(model_path)
+                   scale=(1,1,1), optimize=None):
+        '''
+        Loads the scene model. optimize is True or a dictionary of options
+        of simworldscene.optimizeScene, e.g. {'preserve': ['start_point']}
+        to keep the nodes looked up with getObject. Returns the node and 
+        Geom counts before and after the optimization, if any.
+        '''
+        self.removeScene()
+        self.sceneNP = self.modelCache.load(modelName, instance=False)
+        self.sceneReport = None
+        if optimize:
+            options = {} if optimize is True else optimize
+            self.sceneReport = optimizeScene(self.sceneNP, **options)
         self.sceneNP.setPosHprScale(position, orientation, scale)
         self.sceneNP.reparentTo(self.render)
+        # Index after optimizing, flattening removes nodes.
+        self.indexObject(self.sceneNP)
 
         base.setBackgroundColor((.1, .1, .1, 0))
+        return self.sceneReport
 
-    def getObject(self, name):
-        return self.render.findAllMatches('**/'+name)
+    def setupPagedScene(self, modelName, position=(0,0,0), 
+                        orientation=(0,0,0), scale=(1,1,1), tileSize=50., 
+                        loadRadius=100., unloadRadius=None, 
+                        memoryBudget=None):
+        '''
+        Sets up the scene model as tiles of tileSize scene units paged in
+        and out around the actor of interest, see simworldpaging. The model
+        is split once and the tiles are kept in the model cache directory.
+        memoryBudget is in bytes of tile files, None for no bound.
+        '''
+        bam_name = os.path.basename(self.modelCache.getBamPath(modelName))
+        tile_dir = os.path.join(self.modelCache.cacheDir, '{0}-tiles{1:g}'
+                                .format(os.path.splitext(bam_name)[0], 
+                                        tileSize))
+        # The index is written last, so a split cut short is redone.
+        if not os.path.isfile(os.path.join(tile_dir, 'index.json')):
+            model_np = self.modelCache.load(modelName, instance=False)
+            splitIntoTiles(model_np, tileSize, tile_dir)
+            model_np.removeNode()
+
+        self.removeScene()
+        self.sceneNP = NodePath(modelName)
+        self.sceneNP.setPosHprScale(position, orientation, scale)
+        self.sceneNP.reparentTo(self.render)
+        self.sceneReport = None
+        self.worldPager = WorldPager(self, tile_dir, self.sceneNP, 
+                                     loadRadius, unloadRadius, memoryBudget)
+        self.taskMgr.add(self.worldPagerTask, 'worldPager', sort=40)
 
-    def setObjectSolid(self, name, flag):
-        if flag:
-            self.getObject(name).setCollideMask(BitMask32(0x001),
-                                                BitMask32(0x001))
-        else:
-            self.getObject(name).setCollideMask(BitMask32.allOff(),
-                                                BitMask32(0x001))
+        base.setBackgroundColor((.1, .1, .1, 0))
 
-    def setObjectGoal(self, name, flag):
+    def buildSpatialIndex(self, cellSize=None):
+        # Collide masks are read at build time, so call this after the solid 
+        # and goal objects have been set.
+        self.spatialIndex = SpatialIndex.fromScene(self.render, cellSize)
+
+    def buildWorldMaps(self, cellSize=.25, regions=None):
+        '''
+        Builds or loads from the model cache the raster maps of the scene,
+        see simworldmaps. regions is a dictionary keyed with the region name
+        of (left, right, bottom, top) rectangles or of object names, whose 
+        bounding boxes are used. Like buildSpatialIndex, call it after the solid and
+        goal objects have been set.
+        '''
+        rectangles = {}
+        for name, region in (regions or {}).items():
+            if isinstance(region, str):
+                # Bounding volumes, CollisionNodes have no tight bounds.
+                corners = []
+                for node_np in self.getObject(region):
+                    bounds = node_np.getBounds().makeCopy()
+                    if bounds.isEmpty() or bounds.isInfinite():
+                        continue
+                    bounds.xform(node_np.getMat(self.render))
+                    corners.extend((bounds.getMin(), bounds.getMax()))
+                if not corners:
+                    raise ValueError('Region [{0}] matches no geometry.'
+                                     .format(name))
+                low, high = np.min(corners, axis=0), np.max(corners, axis=0)
+                region = (low[0], high[0], low[1], high[1])
+            rectangles[name] = tuple(float(v) for v in region)
+        self.worldMaps = WorldMaps.fromScene(self.render, 
+                                             self.modelCache.cacheDir, 
+                                             cellSize, rectangles)
+
+    def getPopulationContacts(self, radius, categories=SOLID|GOAL):
+        return self.spatialIndex.querySpheres(self.population.position, radius,
+                                              self.population.heading, 
+                                              categories)
+
+    def indexObject(self, nodePath):
+        for node_np in nodePath.findAllMatches('**'):
+            self.objectIndex.setdefault(node_np.getName(), []).append(node_np)
+
+    def unindexObject(self, nodePath):
+        for node_np in nodePath.findAllMatches('**'):
+            node_nps = self.objectIndex.get(node_np.getName(), [])
+            if node_np in node_nps:
+                node_nps.remove(node_np)
+                if not node_nps:
+                    del self.objectIndex[node_np.getName()]
+
+    def getObject(self, name):
+        # A list of names or glob patterns is looked up in one call.
+        if not isinstance(name, str):
+            objects = NodePathCollection()
+            for n in name:
+                objects.addPathsFrom(self.getObject(n))
+            return objects
+
+        # Type and tag queries and paths still walk the scene graph.
+        if name.startswith(('+', '=', '@@')) or '/' in name:
+            return self.render.findAllMatches('**/'+name)
+
+        if any(c in name for c in '*?['):
+            names = fnmatch.filter(self.objectIndex, name)
+        else:
+            names = [name]
+
+        objects = NodePathCollection()
+        for n in names:
+            for node_np in self.objectIndex.get(n, ()):
+                # Skip removed nodes and nodes reparented out of the scene.
+                if not node_np.isEmpty() and node_np.getTop() == self.render:
+                    objects.addPath(node_np)
+        if objects.isEmpty():
+            # Nodes made outside addActor, setupScene and the like are not
+            # indexed, look for them the slow way.
+            return self.render.findAllMatches('**/'+name)
+        return objects
+
+    def setObjectSolid(self, name, flag, objects=None):
+        '''objects is getObject(name) when the caller looked it up already.'''
+        self._setObjectMask(name, SOLID, flag)
+        if objects is None:
+            objects = self.getObject(name)
+        self._applyObjectMask(objects, SOLID, flag)
+
+    def setObjectGoal(self, name, flag, objects=None):
+        '''objects is getObject(name) when the caller looked it up already.'''
+        self._setObjectMask(name, GOAL, flag)
+        if objects is None:
+            objects = self.getObject(name)
+        self._applyObjectMask(objects, GOAL, flag)
+
+    def clearObjectGoals(self):
+        '''
+        Makes no object of the scene a goal, most are by the model's default
+        masks.
+        '''
+        self._setObjectMask(None, GOAL, False)
+        self._applyObjectMask(self.sceneNP, GOAL, False)
+
+    def applyObjectMasks(self, nodePath):
+        '''Applies objectMasks to the objects under nodePath.'''
+        for name, bit, flag in self.objectMasks:
+            if name is None:
+                self._applyObjectMask(nodePath, bit, flag)
+                continue
+            for n in ([name] if isinstance(name, str) else name):
+                self._applyObjectMask(nodePath.findAllMatches('**/'+n), bit, 
+                                      flag)
+
+    def _setObjectMask(self, name, bit, flag):
+        if name is not None and not isinstance(name, str):
+            name = tuple(name)
+        # A later call on the same objects, or on the whole scene, replaces
+        # the earlier ones.
+        self.objectMasks = [m for m in self.objectMasks 
+                            if m[1] != bit or (name is not None and 
+                                               m[0] != name)]
+        self.objectMasks.append((name, bit, flag))
+
+    def _applyObjectMask(self, objects, bit, flag):
+        # objects is a NodePath or a NodePathCollection.
         if flag:
-            self.getObject(name).setCollideMask(BitMask32(0x002),
-                                                     BitMask32(0x002))
+            objects.setCollideMask(BitMask32(bit), BitMask32(bit))
         else:
-            self.getObject(name).setCollideMask(BitMask32.allOff(),
-                                                     BitMask32(0x002))
+            objects.setCollideMask(BitMask32.allOff(), BitMask32(bit))
     
     def addHotKey(self, hotkey, action, callback, args):
         self.keyMap[action] = hotkey
         self.accept(hotkey, callback, args)
     
+    def removeScene(self):
+        '''Removes the scene set up last, and its objects from the index.'''
+        if self.worldPager is not None:
+            self.taskMgr.remove('worldPager')
+            self.worldPager.close()
+            self.worldPager = None
+        if self.sceneNP is not None:
+            self.unindexObject(self.sceneNP)
+            self.sceneNP.removeNode()
+            self.sceneNP = None
+        self.objectMasks = []
+
     def addActor(self, name, position=(0,0,0), orientation=(0,0,0), 
-                 scale=(1,1,1), collisionSphere=None):
-        # Create the scene node path.
+                 scale=(1,1,1), collisionSphere=None, model=None):
+        # Create the scene node path. The actor is named after its model
+        # unless model is given, so that several actors may share a model.
         actor_np = NodePath(ActorNode(name))
         actor_np.setPosHpr(position, orientation)
         actor_np.reparentTo(self.render)
 
         # Attach model to the node path.
-        base_path  = os.path.dirname(__file__)
-        model_path = os.path.join(base_path, 'models', name)
-        model_path = Filename.fromOsSpecific(model_path)
-        model_np   = self.loader.loadModel(model_path)
+        model_np = self.modelCache.load(model or name)
         model_np.setScale(scale)
         model_np.reparentTo(actor_np)
 
@@ -338,40 +906,148 @@ class SimWorldBase(ShowBase):
         #=======================================================================
         # Make actor events collidible.
         #=======================================================================
-        # Attach collision solid to the node path. 
+        # Attach collision solid to the node path. Events are reported for
+        # both solid and goal objects, see collisionEventTask.
         cn = CollisionNode(name+'EventCollisionNode')
         cn.setIntoCollideMask(BitMask32.allOff())
-        cn.setFromCollideMask(BitMask32.bit(1))
+        cn.setFromCollideMask(BitMask32(SOLID|GOAL))
         cs = CollisionSphere(collisionSphere[0:3], collisionSphere[3])
         cn.addSolid(cs)
         actor_cnp = actor_np.attachNewNode(cn)
         actor_cnp.show()
         
         # Add actor to the collision event detection system.
-        handler = CollisionHandlerEvent()
-        handler.addInPattern('%fn-enters')
-        handler.addOutPattern('%fn-exits')
-        self.cTrav.addCollider(actor_cnp, handler)
-        self.accept(name+'EventCollisionNode'+'-enters', self.onActorEnterEventFunc)
-        self.accept(name+'EventCollisionNode'+'-exits', self.onActorExitEventFunc)
+        self.collisionBatcher.addActor(name, actor_np, actor_cnp)
 
         self.actorNP[name] = actor_np
+        self.indexObject(actor_np)
         
         # The most recently added actor becomes actor of interest.
         self.setActorOfInterest(name)
 
-        self.taskMgr.add(self.actorOIStateUpdateTask,'actorStateUpdate',sort=50)
+        # One state update per frame, however many actors there are.
+        if not self.taskMgr.hasTaskNamed('actorStateUpdate'):
+            self.taskMgr.add(self.actorOIStateUpdateTask, 'actorStateUpdate',
+                             sort=50)
     
-    def activateActorOIControl(self, flag):
+    def addPopulation(self, name, count, positions=None, headings=None,
+                      moveSpeed=3, turnSpeed=30, scale=(1,1,1)):
+        if positions is None:
+            positions = np.zeros((count, 3))
+        if headings is None:
+            headings = np.zeros(count)
+
+        # Actors share a single copy of the model through instancing. Without
+        # a graphics output the population lives in its arrays only.
+        model_np = None
+        if self.win is not None:
+            model_np = self.modelCache.load(name)
+            model_np.setScale(scale)
+
+        for i in range(count):
+            actor_name = '{0}{1}'.format(name, i)
+            actor_np = None
+            if model_np is not None:
+                actor_np = self.render.attachNewNode(actor_name)
+                model_np.instanceTo(actor_np)
+            self.population.add(actor_name, positions[i], headings[i], 
+                                moveSpeed, turnSpeed, actor_np)
+            if actor_np is not None:
+                self.indexObject(actor_np)
+
+        self.population.push()
+
+    def activatePopulationControl(self, flag):
         if flag:
+            self.taskMgr.add(self.populationControlTask, 'populationControl',
+                             sort=10)
+        else:
+            self.taskMgr.remove('populationControl')
+
+    def activateActorOIControl(self, flag):
+        if self.controlLoop is not None:
+            self.controlLoop.isActive = flag
+        elif flag:
             self.taskMgr.add(self.actorOIControlTask,'actorControl',sort=10)
         else:
             self.taskMgr.remove('actorControl')
 
+    def startControlLoop(self, rate=1000., traceFileName=None):
+        '''
+        Moves the actor of interest from a thread ticking rate times per 
+        second instead of once per frame, see simworldcontrol. With 
+        traceFileName, every tick is sampled into a binary trace of its own.
+        A session recording cannot run at the same time, its frames come 
+        from the per-frame control task.
+        '''
+        if self.sessionRecorder is not None:
+            raise ValueError('The control loop bypasses session recording, '
+                             'stop the recording first.')
+        self.stopControlLoop()
+        writer = None
+        if traceFileName is not None:
+            writer = TraceWriter(traceFileName, 
+                                 self.traceSchema.getDtype())
+        is_active = self.taskMgr.hasTaskNamed('actorControl')
+        self.taskMgr.remove('actorControl')
+        self.controlLoop = ControlLoop(self, rate, writer)
+        self.controlLoop.isActive = is_active
+        self.controlLoop.start()
+        # Placed before the collision traversal, pushes read back after it.
+        self.taskMgr.add(self.controlApplyTask, 'controlApply', sort=10)
+        self.taskMgr.add(self.controlCorrectTask, 'controlCorrect', sort=35)
+
+    def stopControlLoop(self):
+        if self.controlLoop is None:
+            return
+        self.taskMgr.remove('controlApply')
+        self.taskMgr.remove('controlCorrect')
+        self.controlLoop.stop()
+        is_active = self.controlLoop.isActive
+        self.controlLoop = None
+        self.activateActorOIControl(is_active)
+
+    def setMotionSensor(self, sensor):
+        if self.motionSensor is not None:
+            self.motionSensor.stop()
+        self.motionSensor = sensor
+        if sensor is not None:
+            sensor.start()
+
     def setActorOfInterest(self, name):
         self.actorOINP = self.actorNP[name]
         self.actorOIName = name
-        self.actorOILocation = self.actorOINP.getPos()
+        self.actorOILocation = Vec3D(*self.actorOINP.getPos())
+        self.actorOIVelocity = Vec3D.zero()
+        if self.controlLoop is not None:
+            self.controlLoop.setPose()
+
+    def resetActorOI(self, position=None, orientation=None):
+        '''
+        Moves the actor of interest to position and orientation (those not
+        None) as a new start: it stands still, and contacts of its previous
+        pose are entered again if they are still there.
+        '''
+        if position is not None:
+            self.actorOINP.setPos(position)
+        if orientation is not None:
+            self.actorOINP.setHpr(orientation)
+        # Restart the state update from the new pose, without a velocity jump.
+        self.setActorOfInterest(self.actorOIName)
+        self.actorOIMoveDir = self.actorOITurnDir = 0
+        self.collisionBatcher.clearContacts()
+
+    def getActorOIEvents(self, kind=TRACE_EVENT_ENTER):
+        '''
+        Returns the collision events of the last frame of the given kind
+        whose actor is the actor of interest.
+        '''
+        events = self.lastCollisionEvents
+        if len(events) == 0:
+            return events
+        actor_ids = self.collisionBatcher.getActorIds(self.actorOINP)
+        return events[(events['kind'] == kind) &
+                      np.isin(events['actor'], actor_ids)]
 
     def setActorOIActionKey(self, action, key):
         self.keyMap[action] = key
@@ -414,6 +1090,7 @@ class SimWorldBase(ShowBase):
         self.accept(hotkey, self.toggleLight, [name])
         
         self.lightNP[name] = self.render.attachNewNode(light_np)
+        self.indexObject(self.lightNP[name])
 
     def toggleLight(self, name):
         light_np = self.lightNP[name]
@@ -442,9 +1119,14 @@ class SimWorldBase(ShowBase):
         self.accept(hotkey, self.activateCamera, [name])
         
         self.cameraNP[name] = camera_np
+        self.indexObject(camera_np)
 
     def activateCamera(self, name):
         dr = self.displayRegionOI
+        if dr is None:
+            self.cameraNP[name].node().setActive(True)
+            return
+
         ar = float(dr.getPixelWidth()) / dr.getPixelHeight()
         self.cameraNP[name].node().getLens().setAspectRatio(ar)
         
@@ -454,6 +1136,29 @@ class SimWorldBase(ShowBase):
         msg = '''Camera [{0}] active on display region [{1}].'''
         self.notifyUser(msg.format(name, self.displayRegionOIName), 2)
 
+    def addCameraRig(self, name, hotkey, parent, views, wideBuffer=False, 
+                     size=None):
+        rig = CameraRig(self, name, parent, views, wideBuffer, size)
+        for view_name in rig.cameraNP:
+            key = '{0}.{1}'.format(name, view_name)
+            self.cameraNP[key] = rig.cameraNP[view_name]
+            self.displayRegion[key] = rig.displayRegion[view_name]
+
+        self.keyMap[name] = hotkey
+        self.accept(hotkey, self.toggleCameraRig, [name])
+
+        self.cameraRig[name] = rig
+
+    def activateCameraRig(self, name, flag=True):
+        self.cameraRig[name].activate(flag)
+
+    def toggleCameraRig(self, name):
+        rig = self.cameraRig[name]
+        rig.activate(not rig.isActive)
+
+        msg = '''Camera rig [{0}] turned {1}.'''
+        self.notifyUser(msg.format(name, 'on' if rig.isActive else 'off'), 2)
+
     def addDisplayRegion(self, name, hotkey, lrbt):
         dr = self.win.makeDisplayRegion(lrbt[0],lrbt[1],lrbt[2],lrbt[3])
         dr.setSort(99)
@@ -482,25 +1187,75 @@ class SimWorldBase(ShowBase):
             dr =  self.displayRegionOI 
         dr.setActive(not dr.isActive())
 
-    def startAITask(self):
+    def startAITask(self, rate=None, interpolate=True):
+        '''
+        Starts updating the AI characters and the population steering, 
+        every frame when rate is None and else rate times per second with
+        the poses interpolated in between when interpolate is set.
+        '''
+        reference = lambda: self.actorOILocation
+        self.AIScheduler = AIScheduler(self.AIWorld, self.AICharacter, rate, 
+                                       interpolate, self.populationSteering,
+                                       reference, 
+                                       controlled=lambda: self.actorOIName)
         taskMgr.add(self.AIUpdateTask, "AIUpdate")
 
     def stopAITask(self):
         taskMgr.remove("AIUpdate")
+        self.AIScheduler = None
+
+    def step(self, n=1, actions=None, render=False):
+        '''
+        Advances the simulation by n frames. actions is either a single 
+        (moveDir, turnDir) pair applied to the actor of interest for all 
+        frames or a sequence of n such pairs, one per frame. Frames are not 
+        drawn unless render is True.
+        '''
+        if actions is not None and np.ndim(actions) == 1:
+            actions = [actions] * n
+
+        is_active = self.win is not None and self.win.isActive()
+        if self.win is not None:
+            self.win.setActive(render)
+
+        for i in range(n):
+            if actions is not None:
+                self.actorOIMoveDir, self.actorOITurnDir = actions[i]
+            self.taskMgr.step()
+
+        if self.win is not None:
+            self.win.setActive(is_active)
 
     def shutDown(self):
-        if self.traceFile: self.traceFile.close()
+        self.setTracing(None, False)
+        self.setPublishing(None, False)
+        self.setContactTracing(None, False)
+        self.setCapture(None, False)
+        self.setRecording(None, False)
+        self.stopControlLoop()
+        self.setMotionSensor(None)
+        if self.worldPager is not None:
+            self.worldPager.close()
         sys.exit()
     
     def toggleOnScreenHelp(self):
         str = '\n'.join([n.title().ljust(10)+' : '+k.title() 
-                         for n,k in self.keyMap.iteritems()])
+                         for n,k in self.keyMap.items()])
         self.onScreenHelpNP.setText('\n'+str)
         if self.onScreenHelpNP.isHidden():
             self.onScreenHelpNP.show()
         else:
             self.onScreenHelpNP.hide()
     
+    def toggleOnScreenProfile(self):
+        if self.onScreenProfileNP.isHidden():
+            self.setProfiling(True)
+            self.onScreenProfileNP.setText(self.profiler.formatProfile())
+            self.onScreenProfileNP.show()
+        else:
+            self.onScreenProfileNP.hide()
+            self.setProfiling(False)
+
     def notifyUser(self, msg, delay):
         if self.isNotifyUser:
             self.userDialog.setText(msg)
@@ -512,19 +1267,105 @@ class SimWorldBase(ShowBase):
                                                              extraArgs=[])
     
     def AIUpdateTask(self, task):
-        self.AIWorld.update()
+        self.AIScheduler.update(self.clock.getDt())
         return task.cont        
 
+    def worldPagerTask(self, task):
+        if self.actorOINP is not None:
+            point = self.sceneNP.getRelativePoint(self.actorOINP.getParent(),
+                                                  Point3(*self.actorOILocation))
+            self.worldPager.update(point[0], point[1])
+        return task.cont
+
+    def profileUpdateTask(self, task):
+        self.profiler.sample()
+
+        # Refreshing the overlay text twice a second is plenty.
+        now = self.clock.getRealTime()
+        if (not self.onScreenProfileNP.isHidden() and 
+            now - self.onScreenProfileTime > .5):
+            self.onScreenProfileNP.setText(self.profiler.formatProfile())
+            self.onScreenProfileTime = now
+        return task.cont
+
     def traceUpdateFunc(self):
         pass
 
+    def getTraceRecord(self):
+        return self.traceSchema.sample()
+
     def traceUpdateTask(self, task):
         self.traceUpdateFunc()
-        message = 'timestamp:{0:.4f},{1}\n'.format(self.clock.getFrameTime(),
-                                                   self.traceMessage)
-        self.traceFile.write(message)
+        if self.traceWriter is not None or self.tracePublisher is not None:
+            record = self.getTraceRecord()
+            if self.traceWriter is not None:
+                self.traceWriter.append(record)
+            if self.tracePublisher is not None:
+                self.tracePublisher.append(record)
+        if self.traceFile is not None:
+            message = 'timestamp:{0:.4f},{1}\n'.format(self.clock.getFrameTime(),
+                                                       self.traceMessage)
+            self.traceFile.write(message)
+        self.traceEvents = 0
+        self.traceCollisionAngle = float('nan')
+        return task.cont
+
+    def collisionEventTask(self, task):
+        events, entries = self.collisionBatcher.update(
+            self.clock.getFrameCount())
+        self.lastCollisionEvents = events
+        if len(events) == 0:
+            return task.cont
+
+        self.traceCollisionEvents(events)
+        if self.contactWriter is not None:
+            for event in events.tolist():
+                self.contactWriter.append(event)
+        self.onCollisionBatchFunc(events)
+
+        # Entries are only looked at event by event when asked for.
+        if self.isActorEventCallbacks or self.sessionRecorder is not None:
+            for kind, category, entry in zip(events['kind'].tolist(),
+                                             events['category'].tolist(),
+                                             entries):
+                if kind == TRACE_EVENT_ENTER:
+                    self.actorEnterEvent(entry, category)
+                else:
+                    self.actorExitEvent(entry, category)
         return task.cont
 
+    def traceCollisionEvents(self, events):
+        self.traceEvents |= int(np.bitwise_or.reduce(events['kind']))
+        enters = events[(events['kind'] == TRACE_EVENT_ENTER) &
+                        events['normal'].any(axis=1)]
+        if len(enters):
+            event = enters[-1]
+            actor_np = self.collisionBatcher.actorNPs[event['actor']]
+            heading  = self.render.getRelativeVector(actor_np, Vec3.forward())
+            normal   = Vec3(*event['normal'].tolist())
+            self.traceCollisionAngle = heading.angleDeg(-normal)
+
+    def actorEnterEvent(self, collisionEntry, category=GOAL):
+        if self.sessionRecorder is not None:
+            self.sessionRecorder.recordEvent(TRACE_EVENT_ENTER, collisionEntry)
+        # The callbacks only hear of goals, walls are in the batch events.
+        if self.isActorEventCallbacks and category & GOAL:
+            self.onActorEnterEventFunc(collisionEntry)
+
+    def actorExitEvent(self, collisionEntry, category=GOAL):
+        if self.sessionRecorder is not None:
+            self.sessionRecorder.recordEvent(TRACE_EVENT_EXIT, collisionEntry)
+        if self.isActorEventCallbacks and category & GOAL:
+            self.onActorExitEventFunc(collisionEntry)
+
+    def onCollisionBatchFunc(self, events):
+        '''
+        Called once per frame with the COLLISION_EVENT_DTYPE array of the 
+        frame's collision events, if any. See collisionBatcher for the actor
+        and object names of the ids.
+        '''
+        pass
+
     def onActorEnterEventFunc(self, collisionEntry):
         pass
 
@@ -532,20 +1373,60 @@ class SimWorldBase(ShowBase):
         pass
 
     def actorOIControlTask(self, task):
-        dt = self.clock.getDt()
-		
-        rotation = self.actorOITurnSpeed * self.actorOITurnDir * dt
+        if self.motionSensor is not None:
+            # The sensor reports displacement integrated since last frame.
+            translation, rotation = self.motionSensor.consume()
+        else:
+            dt = self.clock.getDt()
+            rotation = self.actorOITurnSpeed * self.actorOITurnDir * dt
+            translation = self.actorOIMoveSpeed * self.actorOIMoveDir * dt
+
         self.actorOINP.setH(self.actorOINP, rotation)
-        
-        translation = self.actorOIMoveSpeed * self.actorOIMoveDir * dt
         self.actorOINP.setY(self.actorOINP, translation)
+
+        if self.sessionRecorder is not None:
+            self.sessionRecorder.recordFrame(self.clock.getDt(), 
+                                             self.actorOIMoveDir,
+                                             self.actorOITurnDir,
+                                             translation, rotation)
         
         return task.cont
 
+    def controlApplyTask(self, task):
+        if self.controlLoop.isPosePending():
+            # Keep the pose set from outside until the loop has taken it.
+            self._controlPos = self.actorOINP.getPos()
+            return task.cont
+        state, sequence = self.controlLoop.state.read()
+        self._controlPos = Point3(state['x'], state['y'], state['z'])
+        self.actorOINP.setPos(self._controlPos)
+        self.actorOINP.setH(state['heading'])
+        return task.cont
+
+    def controlCorrectTask(self, task):
+        # Hand the pusher's displacement back to the control thread.
+        delta = self.actorOINP.getPos() - self._controlPos
+        if delta.lengthSquared() > 0:
+            self.controlLoop.correct(delta[0], delta[1], delta[2])
+        return task.cont
+
+    def populationControlTask(self, task):
+        self.population.integrate(self.clock.getDt())
+        self.population.push()
+        return task.cont
+
     def actorOIStateUpdateFunc(self):
         pass
 
     def actorOIStateUpdateTask(self, task):
+        dt = self.clock.getDt()
+        location = Vec3D(*self.actorOINP.getPos())
+        if dt > 0:
+            self.actorOIVelocity = (location - self.actorOILocation) / dt
+        self.actorOILocation = location
+
+        if self.actorHistory is not None:
+            self._updateHistory()
         self.actorOIStateUpdateFunc()
         return task.cont
 
@@ -0,0 +1,237 @@
+'''
+Benchmarks of the SimWorldBase hot paths.
+
+Each scenario builds a headless world in a fresh process (Panda3D allows one
+ShowBase per process), runs warm-up frames and then times every frame with
+the real time clock. The report holds, per scenario, the start-up and scene
+load times, frames per second, per-frame latency percentiles, the time per
+task from the task manager and the peak resident memory. Results are written
+as JSON so two commits can be compared:
+
+    python simworldbench.py --output before.json
+    python simworldbench.py --output after.json --compare before.json
+'''
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+
+SCENARIOS = {
+    'load':          {'frames': 0, 'coldLoad': True},
+    'idle':          {'actors': 0},
+    'actors1':       {'actors': 1},
+    'actors10':      {'actors': 10},
+    'actors100':     {'actors': 100},
+    'control':       {'actors': 1, 'control': True},
+    'collisions':    {'actors': 10, 'control': True, 'solid': True},
+    'tracingText':   {'actors': 1, 'control': True, 'tracing': 'text'},
+    'tracingBinary': {'actors': 1, 'control': True, 'tracing': 'binary'},
+    'ai':            {'actors': 10, 'ai': True},
+}
+'''
+Benchmark scenarios keyed with their name. Keys: actors (number of addActor
+calls), control (actor of interest driven by a random walk), solid (scene
+collision geometry made solid), tracing ('text' or 'binary'), ai (AI update
+with wandering characters), render (draw into an offscreen buffer), frames
+and warmup (frame counts), coldLoad (also time a load without BAM cache).
+'''
+
+SOLID_OBJECTS = ['terrain', 'trees_piece_*', 'rock_*', 'hedge_piece_*']
+
+
+def _getMemory():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024. if sys.platform != 'darwin' else rss / 1024.**2
+
+
+def runScenario(name, scenario, frames=1000, warmup=100, seed=0):
+    '''Runs one scenario in the calling process and returns its results.'''
+    from panda3d.core import loadPrcFileData
+    loadPrcFileData('', 'notify-level error')
+    from simworldbase import SimWorldBase
+    from simworldmodels import ModelCache
+    from simworldprofile import FrameProfiler
+
+    frames = scenario.get('frames', frames)
+    warmup = scenario.get('warmup', warmup)
+    random_state = np.random.RandomState(seed)
+    result = {'scenario': dict(scenario)}
+
+    start = time.perf_counter()
+    world = SimWorldBase(320, 240, False, 'benchmark',
+                         windowType='offscreen' if scenario.get('render')
+                         else 'none', fixedDt=1/60.)
+    result['startup'] = time.perf_counter() - start
+
+    if scenario.get('coldLoad'):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            cache = ModelCache(world.loader, world.modelCache.modelDir,
+                               cache_dir)
+            start = time.perf_counter()
+            cache.load('world', instance=False).removeNode()
+            result['coldLoad'] = time.perf_counter() - start
+        finally:
+            shutil.rmtree(cache_dir)
+
+    start = time.perf_counter()
+    world.setupScene('world')
+    result['sceneLoad'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(scenario.get('actors', 0)):
+        position = random_state.uniform(-50, 50, 3) * (1, 1, 0) + (0, 0, 10)
+        world.addActor('ball{0}'.format(i), position=tuple(position),
+                       collisionSphere=(0,0,0,1), model='ball')
+    result['actorSetup'] = time.perf_counter() - start
+
+    if scenario.get('solid'):
+        world.setObjectSolid(SOLID_OBJECTS, True)
+    if scenario.get('control'):
+        world.activateActorOIControl(True)
+    if scenario.get('ai'):
+        for character in world.AICharacter.values():
+            character.getAiBehaviors().wander(5, 0, 10, 1.)
+        world.startAITask()
+
+    trace_dir = tempfile.mkdtemp()
+    try:
+        if scenario.get('tracing'):
+            world.setTracing(os.path.join(trace_dir, 'trace'),
+                             backend=scenario['tracing'])
+
+        actions = random_state.randint(-1, 2, size=(warmup + frames, 2))
+        render = bool(scenario.get('render'))
+        world.step(warmup, actions[:warmup], render)
+
+        profiler = FrameProfiler(world.taskMgr, world.clock)
+        times = np.zeros(frames)
+        start = time.perf_counter()
+        for i in range(frames):
+            frame_start = time.perf_counter()
+            world.step(1, actions[warmup + i], render)
+            profiler.sample()
+            times[i] = time.perf_counter() - frame_start
+        elapsed = time.perf_counter() - start
+
+        if scenario.get('tracing'):
+            world.setTracing(None, False)
+    finally:
+        shutil.rmtree(trace_dir)
+
+    result['frames'] = frames
+    if frames:
+        result['fps'] = frames / elapsed
+        result['latency'] = dict(('p{0}'.format(q),
+                                  float(np.percentile(times, q)))
+                                 for q in (50, 90, 99))
+        result['latency'].update(mean=float(times.mean()),
+                                 max=float(times.max()))
+        result['tasks'] = profiler.getProfile()['tasks']
+    result['peakMemoryMB'] = _getMemory()
+    return result
+
+
+def _runJob(job):
+    return runScenario(*job)
+
+
+def getMetadata():
+    directory = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                         cwd=directory,
+                                         stderr=subprocess.DEVNULL)
+        commit = commit.decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    try:
+        from panda3d.core import PandaSystem
+        panda_version = PandaSystem.getVersionString()
+    except ImportError:
+        panda_version = None
+    return {'commit':  commit,
+            'time':    time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python':  platform.python_version(),
+            'panda3d': panda_version,
+            'machine': platform.platform()}
+
+
+def runBenchmarks(names=None, frames=1000, warmup=100, seed=0):
+    '''
+    Runs the named scenarios (all by default) one after the other, each in
+    a fresh process so that they do not disturb each other's timing.
+    '''
+    names = names or list(SCENARIOS)
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for name in names:
+        pool = context.Pool(1)
+        try:
+            results[name] = pool.apply(_runJob, ((name, SCENARIOS[name],
+                                                  frames, warmup, seed),))
+        finally:
+            pool.close()
+            pool.join()
+    return {'meta': getMetadata(), 'scenarios': results}
+
+
+def formatReport(report, baseline=None):
+    lines = ['{0:<14} {1:>9} {2:>9} {3:>9} {4:>9} {5:>8}'.format(
+                 'scenario', 'fps', 'p50 ms', 'p99 ms', 'load s', 'mem MB')]
+    for name, result in report['scenarios'].items():
+        latency = result.get('latency', {})
+        line = '{0:<14} {1:9.1f} {2:9.3f} {3:9.3f} {4:9.3f} {5:8.1f}'.format(
+            name, result.get('fps', 0.), latency.get('p50', 0.) * 1e3,
+            latency.get('p99', 0.) * 1e3, result['sceneLoad'],
+            result['peakMemoryMB'])
+        reference = (baseline or {}).get('scenarios', {}).get(name)
+        if reference and reference.get('fps') and result.get('fps'):
+            line += '  fps {0:+6.1f}%'.format(
+                100. * (result['fps'] / reference['fps'] - 1))
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('scenarios', nargs='*',
+                        help='scenarios to run, all by default: ' +
+                        ', '.join(SCENARIOS))
+    parser.add_argument('--frames', type=int, default=1000)
+    parser.add_argument('--warmup', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='JSON file to write the report to')
+    parser.add_argument('--compare', help='JSON report to compare against')
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error('unknown scenarios: ' + ', '.join(sorted(unknown)))
+
+    report = runBenchmarks(args.scenarios, args.frames, args.warmup,
+                           args.seed)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print(formatReport(report, baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+'''
+Offscreen frame capture for SimWorldBase.
+
+The camera of a display region is rendered into an offscreen buffer whose
+texture is copied to RAM only on the frames being captured. The render
+thread just takes a copy of the RAM image; PNG encoding and disk I/O happen
+in a pool of worker threads (zlib releases the GIL while compressing).
+This works with the software renderer as well, e.g. with
+"load-display p3tinydisplay" on a machine without a GPU.
+'''
+
+import os
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from panda3d.core import GraphicsOutput
+from panda3d.core import Texture
+
+from simworldprofile import Histogram
+
+
+def writePNG(fileName, image, level=6):
+    '''Writes an (h, w, 3) uint8 RGB array as a PNG file.'''
+    height, width = image.shape[:2]
+    # Each scanline is prefixed with filter type 0 (none).
+    rows = np.empty((height, width * 3 + 1), dtype=np.uint8)
+    rows[:,0] = 0
+    rows[:,1:] = image.reshape(height, width * 3)
+
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data +
+                struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    with open(fileName, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', header))
+        f.write(chunk(b'IDAT', zlib.compress(rows.tobytes(), level)))
+        f.write(chunk(b'IEND', b''))
+
+
+def getBufferSize(output, size):
+    '''
+    Size of an offscreen buffer of output to render size (width, height)
+    into. Renderers without non power of two textures (e.g. the software
+    renderer) get the next power of two sizes, of which the lower left part
+    is used.
+    '''
+    gsg = output.getGsg()
+    if gsg is not None and not gsg.getSupportsTexNonPow2():
+        return tuple(1 << (int(n) - 1).bit_length() for n in size)
+    return tuple(size)
+
+
+class FrameCapture(object):
+    '''
+    Captures every decimation-th frame seen by cameraNP into numbered PNG
+    files in directory. At most maxPending frames wait for the workers;
+    frames beyond that are dropped and counted rather than stalling the
+    render loop.
+    '''
+
+    def __init__(self, world, cameraNP, directory, size, decimation=1,
+                 workers=2, maxPending=16, level=6):
+        self.world = world
+        self.directory = directory
+        self.decimation = decimation
+        self.maxPending = maxPending
+        self.level = level
+
+        self.frameCount = 0
+        '''Number of frames seen since the capture started.'''
+
+        self.capturedCount = 0
+        '''Number of frames handed to the workers.'''
+
+        self.droppedCount = 0
+        '''Number of frames dropped because the workers fell behind.'''
+
+        self.captureTime = Histogram()
+        '''Seconds spent on the render thread per captured frame.'''
+
+        self.renderTime = {True: Histogram(), False: Histogram()}
+        '''Render task time of frames with and without a capture.'''
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.size = tuple(size)
+        '''Width and height of the captured frames.'''
+
+        # The frame is cropped from a larger buffer when encoding.
+        buffer_size = getBufferSize(world.win, self.size)
+
+        self.texture = Texture('capture')
+        self.buffer = world.win.makeTextureBuffer('capture', buffer_size[0],
+                                                  buffer_size[1])
+        self.buffer.addRenderTexture(self.texture,
+                                     GraphicsOutput.RTMTriggeredCopyRam)
+        self.buffer.setSort(-100)
+        self.buffer.setClearColor(world.win.getClearColor())
+        self.displayRegion = self.buffer.makeDisplayRegion(
+            0, float(size[0]) / buffer_size[0],
+            0, float(size[1]) / buffer_size[1])
+        self.displayRegion.setCamera(cameraNP)
+
+        self.executor = ThreadPoolExecutor(workers)
+        self.pending = []
+        self.isCapturing = False
+
+    def preRenderTask(self, task):
+        # Render the buffer only on the frames that are captured.
+        self.isCapturing = self.frameCount % self.decimation == 0
+        self.frameCount += 1
+        self.pending = [f for f in self.pending if not f.done()]
+        if self.isCapturing and len(self.pending) >= self.maxPending:
+            self.droppedCount += 1
+            self.isCapturing = False
+        self.buffer.setActive(self.isCapturing)
+        if self.isCapturing:
+            self.buffer.triggerCopy()
+        return task.cont
+
+    def postRenderTask(self, task):
+        render_task = self.world.taskMgr.getTasksNamed('igLoop')
+        if render_task:
+            self.renderTime[self.isCapturing].add(render_task[0].getDt())
+        if not self.isCapturing:
+            return task.cont
+
+        start = self.world.clock.getRealTime()
+        image = self.texture.getRamImageAs('RGB')
+        if image:
+            height = self.texture.getYSize()
+            width = self.texture.getXSize()
+            array = np.frombuffer(image, dtype=np.uint8).copy()
+            file_name = os.path.join(self.directory, 'frame{0:08d}.png'.format(
+                self.frameCount - 1))
+            self.pending.append(self.executor.submit(self._encode, file_name,
+                                                     array, width, height))
+            self.capturedCount += 1
+        self.captureTime.add(self.world.clock.getRealTime() - start)
+        return task.cont
+
+    def _encode(self, fileName, array, width, height):
+        # Panda stores images bottom-up, starting at the lower left corner.
+        image = array.reshape(height, width, 3)
+        image = image[:self.size[1], :self.size[0]][::-1]
+        writePNG(fileName, image, self.level)
+
+    def getOverhead(self):
+        '''
+        Summarizes the capture cost. renderOverhead is the difference of the
+        mean render task time between frames with and without a capture.
+        '''
+        with_capture = self.renderTime[True].summary()
+        without_capture = self.renderTime[False].summary()
+        overhead = 0.
+        if with_capture['count'] and without_capture['count']:
+            overhead = with_capture['mean'] - without_capture['mean']
+        return {'frames':         self.frameCount,
+                'captured':       self.capturedCount,
+                'dropped':        self.droppedCount,
+                'captureTime':    self.captureTime.summary(),
+                'renderOverhead': overhead}
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.world.graphicsEngine.removeWindow(self.buffer)
+        self.buffer = None
@@ -0,0 +1,139 @@
+'''
+Batched collision events for SimWorldBase.
+
+The event colliders of all actors share one CollisionHandlerQueue. After
+each traversal the current contacts are compared with those of the previous
+frame, and the contacts that started or ended become one structured array
+of events, instead of one messenger event per contact. Actors and the
+objects they touch are identified by small integer ids; the object category
+(solid or goal) is read from the into collide mask set by setObjectSolid and
+setObjectGoal. Contacts of an actor with collision nodes of its own model
+are not contacts with the world and are left out.
+'''
+
+import numpy as np
+
+from panda3d.core import CollisionHandlerQueue
+
+from simworldspatial import GOAL
+from simworldspatial import SOLID
+from simworldtrace import TRACE_EVENT_ENTER
+from simworldtrace import TRACE_EVENT_EXIT
+
+
+COLLISION_EVENT_DTYPE = np.dtype([('frame',    '<i8'),
+                                  ('actor',    '<i4'),
+                                  ('object',   '<i4'),
+                                  ('kind',     '<u1'),
+                                  ('category', '<u1'),
+                                  ('point',    '<f4', (3,)),
+                                  ('normal',   '<f4', (3,))])
+'''
+Record layout of a collision event. kind is TRACE_EVENT_ENTER or
+TRACE_EVENT_EXIT, category a combination of SOLID and GOAL, and point and
+normal the contact in scene coordinates (the last one seen for an exit).
+'''
+
+
+class CollisionBatcher(object):
+
+    def __init__(self, traverser, root):
+        self.traverser = traverser
+        self.root = root
+        self.handler = CollisionHandlerQueue()
+
+        self.actorNames = []
+        '''Actor names indexed with the actor id.'''
+
+        self.actorNPs = []
+        '''Actor node paths indexed with the actor id.'''
+
+        self.objectNames = []
+        '''Collision object names indexed with the object id.'''
+
+        self.objectNPs = []
+        '''Collision object node paths indexed with the object id.'''
+
+        self.contacts = {}
+        '''
+        Collision entries of the current contacts keyed with the actor and
+        object id pair.
+        '''
+
+        self._actorIds = {}
+        self._objectIds = {}
+        self._isOwnObject = {}
+
+    def addActor(self, name, actorNP, colliderNP):
+        '''Adds the collider of an actor and returns the actor id.'''
+        actor_id = len(self.actorNames)
+        self.actorNames.append(name)
+        self.actorNPs.append(actorNP)
+        self._actorIds[colliderNP.getKey()] = actor_id
+        self.traverser.addCollider(colliderNP, self.handler)
+        return actor_id
+
+    def getActorIds(self, actorNP):
+        '''Returns the ids of the colliders added for actorNP.'''
+        return [i for i, actor_np in enumerate(self.actorNPs)
+                if actor_np == actorNP]
+
+    def clearContacts(self):
+        '''
+        Forgets the current contacts, so that contacts still there after the
+        next traversal are entered again.
+        '''
+        self.contacts = {}
+
+    def getObjectId(self, nodePath):
+        key = nodePath.getKey()
+        object_id = self._objectIds.get(key)
+        if object_id is None:
+            object_id = self._objectIds[key] = len(self.objectNames)
+            self.objectNames.append(nodePath.getName())
+            self.objectNPs.append(nodePath)
+        return object_id
+
+    def update(self, frame):
+        '''
+        Collects the contacts of the last traversal. Returns the events of
+        this frame as a COLLISION_EVENT_DTYPE array and the matching
+        collision entries.
+        '''
+        contacts = {}
+        for entry in self.handler.getEntries():
+            actor_id = self._actorIds[entry.getFromNodePath().getKey()]
+            object_id = self.getObjectId(entry.getIntoNodePath())
+            key = (actor_id, object_id)
+            is_own = self._isOwnObject.get(key)
+            if is_own is None:
+                is_own = self._isOwnObject[key] = \
+                    self.actorNPs[actor_id].isAncestorOf(
+                        entry.getIntoNodePath())
+            if not is_own:
+                contacts[key] = entry
+
+        entered = [k for k in contacts if k not in self.contacts]
+        exited = [k for k in self.contacts if k not in contacts]
+        keys = entered + exited
+        entries = ([contacts[k] for k in entered] +
+                   [self.contacts[k] for k in exited])
+        self.contacts = contacts
+
+        events = np.zeros(len(keys), dtype=COLLISION_EVENT_DTYPE)
+        if not keys:
+            return events, entries
+        events['frame'] = frame
+        ids = np.array(keys)
+        events['actor'] = ids[:,0]
+        events['object'] = ids[:,1]
+        events['kind'][:len(entered)] = TRACE_EVENT_ENTER
+        events['kind'][len(entered):] = TRACE_EVENT_EXIT
+        for i, entry in enumerate(entries):
+            into_mask = entry.getIntoNode().getIntoCollideMask().getWord()
+            events['category'][i] = into_mask & (SOLID | GOAL)
+            if entry.hasSurfacePoint():
+                events['point'][i] = entry.getSurfacePoint(self.root)
+            if entry.hasSurfaceNormal():
+                events['normal'][i] = entry.getSurfaceNormal(self.root)
+        return events, entries
@@ -0,0 +1,252 @@
+'''
+Compressed columnar trace backend for SimWorldBase.
+
+Records are collected into chunks of chunkSize rows on the render thread.
+Full chunks are split into columns and compressed on a background thread,
+each column with its own codec, so a reader decompresses only the columns
+(and the chunks) it asks for. Codecs come from the standard library: 'zlib',
+'bz2', 'lzma' or None. Numeric columns are byte shuffled before compression
+by default (the bytes of all values are grouped by significance, as in the
+HDF5 shuffle filter), which helps a lot on slowly varying floats.
+
+The file starts with MAGIC, a 4 byte length and a JSON header holding the
+NumPy descr of the records. Each chunk follows as a 4 byte length, a JSON
+chunk header (row count and, per column, codec, shuffle flag and size) and
+the column blobs in header order. Chunks are self-describing, so the file of
+a session that did not shut down cleanly is readable up to its last complete
+chunk.
+'''
+
+import ast
+import bz2
+import json
+import lzma
+import os
+import queue
+import struct
+import threading
+import zlib
+
+import numpy as np
+
+from simworldtrace import TRACE_DTYPE
+
+
+MAGIC = b'SWTC\x01'
+
+CODECS = {None:   (lambda data, level: data, lambda data: data),
+          'zlib': (zlib.compress, zlib.decompress),
+          'bz2':  (lambda data, level: bz2.compress(data, level or 9),
+                   bz2.decompress),
+          'lzma': (lambda data, level: lzma.compress(data, preset=level),
+                   lzma.decompress)}
+'''Compression and decompression functions keyed with the codec name.'''
+
+
+def _shuffle(data, itemsize):
+    return np.frombuffer(data, np.uint8).reshape(-1, itemsize).T.tobytes()
+
+
+def _unshuffle(data, itemsize):
+    return np.frombuffer(data, np.uint8).reshape(itemsize, -1).T.tobytes()
+
+
+def _packHeader(header):
+    text = json.dumps(header).encode('utf-8')
+    return struct.pack('<I', len(text)) + text
+
+
+def _readHeader(f):
+    size = f.read(4)
+    if len(size) < 4:
+        return None
+    text = f.read(struct.unpack('<I', size)[0])
+    try:
+        return json.loads(text.decode('utf-8'))
+    except ValueError:
+        return None
+
+
+class ColumnarTraceWriter(object):
+    '''
+    Writes trace records as compressed column chunks. codec and level apply
+    to every column unless columnCodecs, a dictionary of codec names (or
+    None) keyed with the column name, says otherwise.
+    '''
+
+    def __init__(self, fileName, dtype=TRACE_DTYPE, chunkSize=4096,
+                 codec='zlib', level=6, columnCodecs=None, shuffle=True):
+        self.fileName = fileName
+        self.dtype = np.dtype(dtype)
+        self.chunkSize = chunkSize
+        self.level = level
+        self.shuffle = shuffle
+        self.codecs = dict((name, codec) for name in self.dtype.names)
+        self.codecs.update(columnCodecs or {})
+        for name, column_codec in self.codecs.items():
+            if column_codec not in CODECS:
+                raise ValueError('Unknown codec [{0}] for column [{1}].'
+                                 .format(column_codec, name))
+
+        self.stallCount = 0
+        '''Number of appends that had to wait for the compression thread.'''
+
+        self.rawSize = 0
+        self.compressedSize = 0
+
+        self._count = 0
+        self._row = 0
+        # Two chunks are enough for the render thread to fill one while the
+        # other is compressed.
+        self._free = queue.Queue()
+        self._free.put(np.zeros(chunkSize, dtype=self.dtype))
+        self._full = queue.Queue()
+        self._chunk = np.zeros(chunkSize, dtype=self.dtype)
+
+        self._file = open(fileName, 'wb')
+        descr = repr(np.lib.format.dtype_to_descr(self.dtype))
+        self._file.write(MAGIC + _packHeader({'descr': descr}))
+
+        self._thread = threading.Thread(target=self._compressLoop,
+                                        name='ColumnarTraceWriter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __len__(self):
+        return self._count
+
+    def append(self, record):
+        self._chunk[self._row] = record
+        self._row += 1
+        self._count += 1
+        if self._row == self.chunkSize:
+            self._submit()
+
+    def _submit(self):
+        self._full.put((self._chunk, self._row))
+        if self._free.empty():
+            self.stallCount += 1
+        self._chunk = self._free.get()
+        self._row = 0
+
+    def close(self):
+        if self._file is None:
+            return
+        if self._row:
+            self._submit()
+        self._full.put(None)
+        self._thread.join()
+        self._file.close()
+        self._file = None
+
+    def _compressLoop(self):
+        while True:
+            item = self._full.get()
+            if item is None:
+                break
+            chunk, count = item
+            self._writeChunk(chunk[:count])
+            self._free.put(chunk)
+
+    def _writeChunk(self, records):
+        columns = []
+        blobs = []
+        for name in self.dtype.names:
+            column = np.ascontiguousarray(records[name])
+            data = column.tobytes()
+            itemsize = column.dtype.itemsize
+            shuffled = (self.shuffle and itemsize > 1 and
+                        column.dtype.kind in 'iufc')
+            if shuffled:
+                data = _shuffle(data, itemsize)
+            codec = self.codecs[name]
+            blob = CODECS[codec][0](data, self.level)
+            self.rawSize += len(data)
+            self.compressedSize += len(blob)
+            columns.append({'name': name, 'codec': codec,
+                            'shuffle': shuffled, 'size': len(blob)})
+            blobs.append(blob)
+        self._file.write(_packHeader({'count': len(records),
+                                      'columns': columns}))
+        for blob in blobs:
+            self._file.write(blob)
+        self._file.flush()
+
+
+class ColumnarTraceReader(object):
+    '''
+    Reads a trace written by ColumnarTraceWriter. Only the chunk headers are
+    read when the file is opened; columns are decompressed on demand.
+    '''
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.chunks = []
+        '''(first row, row count, {column: (offset, size, codec, shuffle)}).'''
+
+        file_size = os.path.getsize(fileName)
+        with open(fileName, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise IOError('[{0}] is not a columnar trace.'
+                              .format(fileName))
+            header = _readHeader(f)
+            self.dtype = np.lib.format.descr_to_dtype(
+                ast.literal_eval(header['descr']))
+            row = 0
+            while True:
+                chunk = _readHeader(f)
+                if chunk is None:
+                    break
+                offset = f.tell()
+                columns = {}
+                for column in chunk['columns']:
+                    columns[column['name']] = (offset, column['size'],
+                                               column['codec'],
+                                               column['shuffle'])
+                    offset += column['size']
+                # A chunk cut short by a crash ends the trace.
+                if offset > file_size:
+                    break
+                f.seek(offset)
+                self.chunks.append((row, chunk['count'], columns))
+                row += chunk['count']
+        self.count = row
+
+    def __len__(self):
+        return self.count
+
+    def getColumns(self):
+        return list(self.dtype.names)
+
+    def read(self, columns=None, start=0, stop=None):
+        '''
+        Returns rows start to stop of the given columns (all by default) as
+        a structured array.
+        '''
+        names = list(columns or self.dtype.names)
+        dtype = np.dtype([(name, self.dtype.fields[name][0])
+                          for name in names])
+        stop = self.count if stop is None else min(stop, self.count)
+        result = np.zeros(max(stop - start, 0), dtype=dtype)
+        with open(self.fileName, 'rb') as f:
+            for first, count, chunk in self.chunks:
+                if first + count <= start or first >= stop:
+                    continue
+                lo, hi = max(start, first), min(stop, first + count)
+                for name in names:
+                    values = self._readColumn(f, chunk[name], name, count)
+                    result[name][lo - start:hi - start] = \
+                        values[lo - first:hi - first]
+        return result
+
+    def readColumn(self, name, start=0, stop=None):
+        return self.read([name], start, stop)[name]
+
+    def _readColumn(self, f, location, name, count):
+        offset, size, codec, shuffled = location
+        f.seek(offset)
+        data = CODECS[codec][1](f.read(size))
+        column_dtype = self.dtype.fields[name][0]
+        if shuffled:
+            data = _unshuffle(data, column_dtype.base.itemsize)
+        return np.frombuffer(data, dtype=column_dtype, count=count)
@@ -0,0 +1,212 @@
+'''
+High-rate control loop for SimWorldBase.
+
+ControlLoop moves the actor of interest on a thread of its own at a fixed
+rate (1 kHz by default), independently of the frame rate. Each tick consumes
+the motion sensor (or the moveDir/turnDir keys), integrates the pose, samples
+it into an optional trace writer and publishes it into a StateBuffer. The
+render loop only reads the latest published pose once per frame and places
+the actor node there, so a slow frame delays what is drawn but not the
+control timing.
+
+Collisions are still resolved by the render loop. When the pusher moved the
+actor after the traversal, the displacement is handed back to the control
+thread through a queue and applied on its next tick.
+'''
+
+import collections
+import math
+import threading
+import time
+
+import numpy as np
+
+from simworldprofile import Histogram
+from simworldtrace import TRACE_DTYPE
+
+
+CONTROL_STATE_DTYPE = np.dtype([('time',    '<f8'),
+                                ('tick',    '<i8'),
+                                ('x',       '<f8'),
+                                ('y',       '<f8'),
+                                ('z',       '<f8'),
+                                ('heading', '<f8'),
+                                ('moveDir', '<i1'),
+                                ('turnDir', '<i1')])
+'''Layout of the actor of interest state published by ControlLoop.'''
+
+
+class StateBuffer(object):
+    '''
+    Double buffer with a single writer and any number of readers, without
+    locks. The writer fills the back buffer and then publishes it by bumping
+    sequence; a reader retries when the writer came back to the buffer it
+    was copying from.
+    '''
+
+    def __init__(self, dtype):
+        self._buffers = np.zeros(2, dtype=dtype)
+
+        self.sequence = 0
+        '''Number of states written so far.'''
+
+    def write(self, state):
+        self._buffers[(self.sequence + 1) % 2] = state
+        self.sequence += 1
+
+    def read(self):
+        '''Returns a copy of the latest state and its sequence number.'''
+        while True:
+            sequence = self.sequence
+            state = self._buffers[sequence % 2].copy()
+            if self.sequence == sequence:
+                return state, sequence
+
+
+class ControlLoop(object):
+    '''
+    Controls the actor of interest of world at rate ticks per second. Records
+    in the layout of world.traceSchema are appended to writer on every tick
+    when one is given: the TRACE_DTYPE channels hold the tick's state, the
+    channels added with addTraceChannel are sampled from the control thread
+    at the tick. Ticks more than
+    maxLag periods late are counted in overrunCount and the schedule is
+    restarted from the current time instead of catching up.
+    '''
+
+    def __init__(self, world, rate=1000., writer=None, maxLag=10):
+        self.world = world
+        self.rate = rate
+        self.writer = writer
+        self.maxLag = maxLag
+
+        self.state = StateBuffer(CONTROL_STATE_DTYPE)
+        '''Latest state of the actor of interest.'''
+
+        self.isActive = True
+        '''The actor of interest only moves while set.'''
+
+        self.tickCount = 0
+        self.overrunCount = 0
+
+        self.jitter = Histogram()
+        '''Seconds from the scheduled to the actual start of each tick.'''
+
+        actor_np = world.actorOINP
+        self.x, self.y, self.z = actor_np.getPos()
+        self.heading = actor_np.getH()
+        # setY relative to the actor itself moves in scaled units.
+        self.scale = actor_np.getSy()
+
+        # Displacements (dx, dy, dz) and new poses (x, y, z, heading) for the
+        # control thread, in the order they were made.
+        self._corrections = collections.deque()
+        self._poseCount = 0
+        self._appliedPoseCount = 0
+        # Channels added to the default ones, see SimWorldBase.traceSchema.
+        self._extraChannels = len(world.traceSchema) - len(TRACE_DTYPE.names)
+        self._isRunning = False
+        self._thread = None
+        self._publish(world.clock.getRealTime())
+
+    def start(self):
+        self._isRunning = True
+        self._thread = threading.Thread(target=self._run, name='ControlLoop')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._isRunning = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def correct(self, dx, dy, dz):
+        '''Moves the pose by a displacement, from any thread.'''
+        self._corrections.append((dx, dy, dz))
+
+    def setPose(self):
+        '''
+        Restarts from the current pose of the actor of interest, after it was
+        moved or turned from outside the loop. Called from the render loop.
+        '''
+        actor_np = self.world.actorOINP
+        x, y, z = actor_np.getPos()
+        self.scale = actor_np.getSy()
+        self._poseCount += 1
+        self._corrections.append((x, y, z, actor_np.getH()))
+
+    def isPosePending(self):
+        '''True until the control thread took the pose of setPose.'''
+        return self._appliedPoseCount != self._poseCount
+
+    def tick(self, dt, now):
+        world = self.world
+        x, y, z = self.x, self.y, self.z
+        pose_count = 0
+        while self._corrections:
+            correction = self._corrections.popleft()
+            if len(correction) == 4:
+                self.x, self.y, self.z, self.heading = correction
+                # A new pose is no movement.
+                x, y, z = self.x, self.y, self.z
+                pose_count += 1
+                continue
+            dx, dy, dz = correction
+            self.x += dx
+            self.y += dy
+            self.z += dz
+
+        move_dir, turn_dir = world.actorOIMoveDir, world.actorOITurnDir
+        if world.motionSensor is not None:
+            translation, rotation = world.motionSensor.consume()
+        else:
+            rotation = world.actorOITurnSpeed * turn_dir * dt
+            translation = world.actorOIMoveSpeed * move_dir * dt
+        if self.isActive:
+            # Same order as SimWorldBase.actorOIControlTask: turn first, then
+            # move along the new heading.
+            self.heading += rotation
+            h = math.radians(self.heading)
+            self.x -= translation * self.scale * math.sin(h)
+            self.y += translation * self.scale * math.cos(h)
+
+        self.tickCount += 1
+        self._publish(now)
+        # Counted once published, see isPosePending.
+        self._appliedPoseCount += pose_count
+        if self.writer is not None and dt > 0:
+            # Collision events stay in the render loop's trace.
+            record = (now, self.tickCount, self.x, self.y, self.z,
+                      self.heading, (self.x - x) / dt, (self.y - y) / dt,
+                      (self.z - z) / dt, move_dir, turn_dir, 0, float('nan'))
+            if self._extraChannels:
+                record += world.traceSchema.sample()[-self._extraChannels:]
+            self.writer.append(record)
+
+    def _publish(self, now):
+        world = self.world
+        self.state.write((now, self.tickCount, self.x, self.y, self.z,
+                          self.heading, world.actorOIMoveDir,
+                          world.actorOITurnDir))
+
+    def _run(self):
+        clock = self.world.clock
+        period = 1. / self.rate
+        last = clock.getRealTime()
+        deadline = last + period
+        while self._isRunning:
+            delay = deadline - clock.getRealTime()
+            if delay > 0:
+                time.sleep(delay)
+            now = clock.getRealTime()
+            self.jitter.add(max(now - deadline, 0.))
+            self.tick(now - last, now)
+            last = now
+            deadline += period
+            if now - deadline > self.maxLag * period:
+                self.overrunCount += 1
+                deadline = now + period
@@ -0,0 +1,303 @@
+'''
+Reinforcement learning environments over SimWorldBase.
+
+SimWorldEnv wraps one world with the reset()/step() interface of gym: an
+action is an index into ACTIONS, a (moveDir, turnDir) pair applied to the
+actor of interest for one frame, and an observation is a dictionary with the
+actor's pose and, optionally, a low resolution view rendered from the
+actor into an offscreen buffer.
+
+VectorEnv steps many copies of an environment per call in one process. Only
+one world (and ShowBase) can exist per process, so the copies are not worlds:
+their actors live in the arrays of an ActorPopulation, are integrated
+together, and collide with the world's solid and goal geometry through the
+SpatialIndex. Instead of a rendered view, each copy may observe the
+distances along a fan of rays. Everything is batched in NumPy arrays, so
+the cost per step hardly depends on the number of copies.
+'''
+
+import numpy as np
+
+from panda3d.core import Camera
+from panda3d.core import GraphicsOutput
+from panda3d.core import PerspectiveLens
+from panda3d.core import Texture
+
+from simworldcapture import getBufferSize
+from simworldpopulation import ActorPopulation
+from simworldspatial import GOAL
+from simworldspatial import SOLID
+from simworldtrace import TRACE_EVENT_ENTER
+
+
+ACTIONS = np.array([( 0,  0),
+                    ( 1,  0),
+                    (-1,  0),
+                    ( 0,  1),
+                    ( 0, -1),
+                    ( 1,  1),
+                    ( 1, -1),
+                    (-1,  1),
+                    (-1, -1)], dtype=np.int8)
+'''(moveDir, turnDir) of each discrete action, no movement first.'''
+
+
+def configureWorld(world, solids=None, goals=None):
+    '''
+    Marks the named objects (names or glob patterns) as solid and as goals.
+    When goals are given, no other object of the scene stays a goal.
+    '''
+    if solids is not None:
+        world.setObjectSolid(solids, True)
+    if goals is not None:
+        world.clearObjectGoals()
+        world.setObjectGoal(goals, True)
+
+
+def _makeWorld(config, seed, isRendering):
+    from simworldrunner import makeWorld
+    config = dict(config or {})
+    config.setdefault('windowType', 'offscreen' if isRendering else 'none')
+    return makeWorld(config, seed)
+
+
+class SimWorldEnv(object):
+    '''
+    Single world environment. world is a ready SimWorldBase with an actor of
+    interest, or None to build a headless one with simworldrunner.makeWorld
+    from config. Episodes start at one of startPositions (the actor's
+    position by default) with a random heading, and end when the actor
+    enters a goal or after maxSteps steps. viewSize (width, height) adds an
+    RGB view of fov degrees from the actor to the observations; the world
+    then needs a graphics output (config windowType 'offscreen').
+    '''
+
+    def __init__(self, world=None, config=None, solids=None, goals=None,
+                 startPositions=None, maxSteps=1000, stepReward=0.,
+                 goalReward=1., collisionReward=0., viewSize=None, fov=90.,
+                 seed=None):
+        self.world = world or _makeWorld(config, seed, viewSize is not None)
+        configureWorld(self.world, solids, goals)
+        self.maxSteps = maxSteps
+        self.stepReward = stepReward
+        self.goalReward = goalReward
+        self.collisionReward = collisionReward
+        self.randomState = np.random.RandomState(seed)
+
+        actor_np = self.world.actorOINP
+        if startPositions is None:
+            startPositions = [tuple(actor_np.getPos())]
+        self.startPositions = np.asarray(startPositions, dtype=np.float64)
+
+        self.stepCount = 0
+        self.viewSize = viewSize
+        self.texture = None
+        if viewSize is not None:
+            self._makeView(viewSize, fov)
+
+    def _makeView(self, size, fov):
+        world = self.world
+        # The view is cropped from a larger buffer when read.
+        buffer_size = getBufferSize(world.win, size)
+        self.texture = Texture('view')
+        self.buffer = world.win.makeTextureBuffer('view', buffer_size[0],
+                                                  buffer_size[1])
+        self.buffer.addRenderTexture(self.texture,
+                                     GraphicsOutput.RTMCopyRam)
+        self.buffer.setSort(-100)
+        self.buffer.setClearColor(world.win.getClearColor())
+        lens = PerspectiveLens()
+        lens.setFov(fov, fov * size[1] / float(size[0]))
+        self.cameraNP = world.actorOINP.attachNewNode(Camera('view', lens))
+        display_region = self.buffer.makeDisplayRegion(
+            0, float(size[0]) / buffer_size[0],
+            0, float(size[1]) / buffer_size[1])
+        display_region.setCamera(self.cameraNP)
+
+    def getView(self):
+        image = self.texture.getRamImageAs('RGB')
+        width, height = self.viewSize
+        if not image:
+            return np.zeros((height, width, 3), dtype=np.uint8)
+        array = np.frombuffer(image, dtype=np.uint8).reshape(
+            self.texture.getYSize(), self.texture.getXSize(), 3)
+        # Panda stores images bottom-up.
+        return array[:height, :width][::-1]
+
+    def getObservation(self):
+        world = self.world
+        location = world.actorOILocation
+        observation = {'pose': np.array((location[0], location[1],
+                                         world.actorOINP.getH()),
+                                        dtype=np.float32)}
+        if self.texture is not None:
+            observation['view'] = self.getView()
+        return observation
+
+    def reset(self, seed=None):
+        if seed is not None:
+            self.randomState = np.random.RandomState(seed)
+        world = self.world
+        i = self.randomState.randint(len(self.startPositions))
+        world.resetActorOI(tuple(self.startPositions[i]),
+                           (self.randomState.uniform(0, 360), 0, 0))
+        self.stepCount = 0
+        world.step(1, (0, 0), self.texture is not None)
+        return self.getObservation()
+
+    def step(self, action):
+        '''
+        Applies action (an index into ACTIONS or a (moveDir, turnDir) pair)
+        for one frame and returns observation, reward, done and info.
+        '''
+        if np.ndim(action) == 0:
+            action = ACTIONS[action]
+        world = self.world
+        world.step(1, action, self.texture is not None)
+        self.stepCount += 1
+
+        goal, collision = self._getContacts()
+        reward = self.stepReward
+        if goal:
+            reward += self.goalReward
+        if collision:
+            reward += self.collisionReward
+        truncated = not goal and self.stepCount >= self.maxSteps
+        info = {'goal': goal, 'collision': collision, 'truncated': truncated,
+                'steps': self.stepCount}
+        return self.getObservation(), reward, goal or truncated, info
+
+    def _getContacts(self):
+        # Contacts entered by the actor of interest during the last frame.
+        entered = self.world.getActorOIEvents(TRACE_EVENT_ENTER)
+        return (bool(np.any(entered['category'] & GOAL)),
+                bool(np.any(entered['category'] & SOLID)))
+
+    def close(self):
+        if self.texture is not None:
+            self.world.graphicsEngine.removeWindow(self.buffer)
+            self.cameraNP.removeNode()
+            self.texture = None
+
+
+class VectorEnv(object):
+    '''
+    numEnvs copies of an environment over the geometry of one world, stepped
+    dt seconds per call. The copies' actors are circles of radius moving at
+    moveSpeed and turnSpeed; walls push them back and entering a goal ends
+    their episode. With numRays, observations hold the distance to the
+    nearest solid along numRays rays spread over fov degrees, up to
+    rayLength. Finished copies are reset automatically; their last pose is
+    reported in info['finalPose'].
+    '''
+
+    def __init__(self, numEnvs, world=None, config=None, solids=None,
+                 goals=None, startPositions=None, radius=1., moveSpeed=3.,
+                 turnSpeed=30., dt=1/60., maxSteps=1000, stepReward=0.,
+                 goalReward=1., collisionReward=0., numRays=0, fov=180.,
+                 rayLength=20., seed=None):
+        self.world = world or _makeWorld(config, seed, False)
+        configureWorld(self.world, solids, goals)
+        # Collide masks are read when the index is built.
+        self.world.buildSpatialIndex()
+        self.spatialIndex = self.world.spatialIndex
+
+        self.numEnvs = numEnvs
+        self.radius = radius
+        self.dt = dt
+        self.maxSteps = maxSteps
+        self.stepReward = stepReward
+        self.goalReward = goalReward
+        self.collisionReward = collisionReward
+        self.randomState = np.random.RandomState(seed)
+
+        if startPositions is None:
+            startPositions = [tuple(self.world.actorOINP.getPos())]
+        self.startPositions = np.asarray(startPositions, dtype=np.float64)
+
+        self.population = ActorPopulation(numEnvs)
+        for i in range(numEnvs):
+            self.population.add('env{0}'.format(i), moveSpeed=moveSpeed,
+                                turnSpeed=turnSpeed)
+        self.stepCount = np.zeros(numEnvs, dtype=np.int64)
+
+        self.numRays = numRays
+        self.rayLength = rayLength
+        self._rayOffsets = np.radians(np.linspace(-fov / 2., fov / 2.,
+                                                  numRays))
+
+    def _reset(self, envs):
+        population = self.population
+        i = self.randomState.randint(len(self.startPositions), size=len(envs))
+        population.position[envs] = self.startPositions[i]
+        population.heading[envs] = self.randomState.uniform(0, 360, len(envs))
+        self.stepCount[envs] = 0
+
+    def reset(self, seed=None):
+        if seed is not None:
+            self.randomState = np.random.RandomState(seed)
+        self._reset(np.arange(self.numEnvs))
+        return self.getObservation()
+
+    def getObservation(self):
+        population = self.population
+        pose = np.empty((self.numEnvs, 3), dtype=np.float32)
+        pose[:,:2] = population.position[:,:2]
+        pose[:,2] = population.heading
+        observation = {'pose': pose}
+        if self.numRays:
+            observation['rays'] = self.castRays()
+        return observation
+
+    def castRays(self):
+        population = self.population
+        angles = (np.radians(population.heading)[:,None] +
+                  self._rayOffsets[None,:]).reshape(-1)
+        directions = np.column_stack((-np.sin(angles), np.cos(angles)))
+        origins = np.repeat(population.position[:,:2], self.numRays, axis=0)
+        hits = self.spatialIndex.queryRays(origins, directions,
+                                           self.rayLength, SOLID)
+        distance = np.minimum(hits['distance'], self.rayLength)
+        return distance.reshape(self.numEnvs, self.numRays).astype(np.float32)
+
+    def step(self, actions):
+        '''
+        Applies one action per copy, indices into ACTIONS or an (n, 2) array
+        of (moveDir, turnDir), and returns batched observations, rewards,
+        dones and info arrays.
+        '''
+        actions = np.asarray(actions)
+        if actions.ndim == 1:
+            actions = ACTIONS[actions]
+        population = self.population
+        population.moveDir[:] = actions[:,0]
+        population.turnDir[:] = actions[:,1]
+        population.integrate(self.dt)
+        self.stepCount += 1
+
+        # Push the actors out of the walls along the contact normal.
+        walls = self.spatialIndex.querySpheres(population.position,
+                                               self.radius,
+                                               categories=SOLID)
+        collision = walls['hit']
+        depth = self.radius - walls['distance'][collision]
+        population.position[collision, 0] += walls['nx'][collision] * depth
+        population.position[collision, 1] += walls['ny'][collision] * depth
+
+        goal = self.spatialIndex.querySpheres(population.position,
+                                              self.radius,
+                                              categories=GOAL)['hit']
+        rewards = np.full(self.numEnvs, self.stepReward, dtype=np.float32)
+        rewards[goal] += self.goalReward
+        rewards[collision] += self.collisionReward
+        truncated = ~goal & (self.stepCount >= self.maxSteps)
+        dones = goal | truncated
+
+        info = {'goal': goal, 'collision': collision, 'truncated': truncated,
+                'steps': self.stepCount.copy()}
+        envs = np.nonzero(dones)[0]
+        if len(envs):
+            info['finalPose'] = np.column_stack((
+                population.position[envs, :2], population.heading[envs]))
+            self._reset(envs)
+        return self.getObservation(), rewards, dones, info
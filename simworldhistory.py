@@ -0,0 +1,156 @@
+'''
+In-memory state history of actors for SimWorldBase.
+
+Each actor's history is a list of fixed size NumPy chunks of HISTORY_DTYPE
+records: appending writes one row of the current chunk, and a full chunk is
+followed by a new one, so nothing is copied as the session grows. Besides
+the raw state a record holds running sums, the path length travelled and the
+time spent in each region of interest since the history started. Queries
+over a time span are then differences of two records found by binary search
+on time, independent of the span's length:
+
+    history.getPathLength(since=trialStart)
+    history.getTimeInRegion('goal_zone', since=trialStart)
+    history.getVelocity(window=1.)
+'''
+
+import bisect
+import math
+
+import numpy as np
+
+
+HISTORY_DTYPE = np.dtype([('time',       '<f8'),
+                          ('frame',      '<i8'),
+                          ('position',   '<f8', (3,)),
+                          ('heading',    '<f8'),
+                          ('velocity',   '<f8', (3,)),
+                          ('pathLength', '<f8')])
+'''
+Record layout of an actor history without regions. pathLength is the
+distance travelled since the first record.
+'''
+
+
+class ActorHistory(object):
+    '''
+    State history of one actor. regions is a dictionary of (left, right,
+    bottom, top) rectangles of the XY plane keyed with the region name; the
+    time spent in each is accumulated into the regionTime field.
+    '''
+
+    def __init__(self, regions=None, chunkSize=4096):
+        self.regionNames = list(regions or {})
+        self.regions = [tuple(regions[name]) for name in self.regionNames]
+        self.chunkSize = chunkSize
+
+        fields = HISTORY_DTYPE.descr
+        if self.regions:
+            fields = fields + [('regionTime', '<f8', (len(self.regions),))]
+        self.dtype = np.dtype(fields)
+
+        self.chunks = []
+        '''Record chunks in time order, all but the last one full.'''
+
+        self._chunkTimes = []
+        self._count = 0
+        self._last = None
+        self._pathLength = 0.
+        self._regionTime = [0.] * len(self.regions)
+
+    def __len__(self):
+        return self._count
+
+    def append(self, time, frame, position, heading):
+        '''
+        Appends the state of one frame. The velocity is derived from the
+        previous record.
+        '''
+        x, y, z = position
+        vx = vy = vz = 0.
+        if self._last is not None:
+            last_time, last_x, last_y, last_z = self._last
+            dt = time - last_time
+            dx, dy, dz = x - last_x, y - last_y, z - last_z
+            self._pathLength += math.sqrt(dx * dx + dy * dy + dz * dz)
+            if dt > 0:
+                vx, vy, vz = dx / dt, dy / dt, dz / dt
+            for i, (left, right, bottom, top) in enumerate(self.regions):
+                if left <= x <= right and bottom <= y <= top:
+                    self._regionTime[i] += dt
+        self._last = (time, x, y, z)
+
+        i = self._count % self.chunkSize
+        if i == 0:
+            self.chunks.append(np.zeros(self.chunkSize, dtype=self.dtype))
+            self._chunkTimes.append(time)
+        record = (time, frame, (x, y, z), heading, (vx, vy, vz),
+                  self._pathLength)
+        if self.regions:
+            record += (self._regionTime,)
+        self.chunks[-1][i] = record
+        self._count += 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('History index out of range.')
+        return self.chunks[index // self.chunkSize][index % self.chunkSize]
+
+    def getRecords(self, start=0, stop=None):
+        '''Returns a contiguous copy of the records from start to stop.'''
+        stop = self._count if stop is None else min(stop, self._count)
+        if start >= stop:
+            return np.zeros(0, dtype=self.dtype)
+        first, last = start // self.chunkSize, (stop - 1) // self.chunkSize
+        records = np.concatenate(self.chunks[first:last + 1])
+        offset = first * self.chunkSize
+        return records[start - offset:stop - offset]
+
+    def findTime(self, time):
+        '''Index of the last record at or before time, 0 if there is none.'''
+        chunk = max(bisect.bisect_right(self._chunkTimes, time) - 1, 0)
+        size = min(self._count - chunk * self.chunkSize, self.chunkSize)
+        times = self.chunks[chunk]['time'][:size]
+        i = max(int(np.searchsorted(times, time, side='right')) - 1, 0)
+        return chunk * self.chunkSize + i
+
+    def _getSpan(self, since):
+        if self._count == 0:
+            return None, None
+        start = 0 if since is None else self.findTime(since)
+        return self[start], self[self._count - 1]
+
+    def getPathLength(self, since=None):
+        start, end = self._getSpan(since)
+        if start is None:
+            return 0.
+        return float(end['pathLength'] - start['pathLength'])
+
+    def getTimeInRegion(self, name, since=None):
+        start, end = self._getSpan(since)
+        if start is None:
+            return 0.
+        i = self.regionNames.index(name)
+        return float(end['regionTime'][i] - start['regionTime'][i])
+
+    def getVelocity(self, window):
+        '''Mean velocity vector over the last window seconds.'''
+        if self._count == 0:
+            return np.zeros(3)
+        start, end = self._getSpan(self[self._count - 1]['time'] - window)
+        dt = end['time'] - start['time']
+        if dt <= 0:
+            return np.array(end['velocity'])
+        return (end['position'] - start['position']) / dt
+
+    def getSpeed(self, window):
+        '''Mean speed along the path over the last window seconds.'''
+        if self._count == 0:
+            return 0.
+        start, end = self._getSpan(self[self._count - 1]['time'] - window)
+        dt = end['time'] - start['time']
+        if dt <= 0:
+            return 0.
+        return float((end['pathLength'] - start['pathLength']) / dt)
@@ -0,0 +1,252 @@
+'''
+Asynchronous motion sensor input for SimWorldBase.
+
+A sensor reads samples from its device on a background thread and sums them
+up until the control task consumes the integrated displacement once per
+frame, so a slow or bursty device never blocks rendering. A sample is a
+(timestamp, forward, turn) triple: forward and turn are raw device
+displacements converted to distance units and degrees by the sensor's gain,
+and timestamp is the sender's time.time() or None when the device has no
+clock of its own.
+'''
+
+import io
+import os
+import select
+import socket
+import struct
+import threading
+import time
+
+from simworldprofile import Histogram
+
+
+SAMPLE_FORMAT = '<ddd'
+'''Binary layout of a (timestamp, forward, turn) sample sent over UDP.'''
+
+
+class MotionSensor(object):
+    '''
+    Base class of the motion sensors. Subclasses implement readSample, which
+    blocks until the next sample arrives and returns None when the device is
+    exhausted, and may override close to release the device. readSample
+    should raise socket.timeout every now and then while the device is idle,
+    so that stop does not wait for the next sample.
+    '''
+
+    def __init__(self, gain=(1., 1.)):
+        self.gain = gain
+        '''Forward (distance units) and turn (degrees) per device unit.'''
+
+        self.sampleCount = 0
+        '''Number of samples received so far.'''
+
+        self.transportLatency = Histogram()
+        '''Seconds from the device timestamp to the reception of a sample.'''
+
+        self.frameLatency = Histogram()
+        '''Seconds from the reception of a sample to its consumption.'''
+
+        self._forward = 0.
+        self._turn = 0.
+        self._pendingTimes = []
+        self._lock = threading.Lock()
+        self._isRunning = False
+        self._thread = None
+
+    def start(self):
+        self._isRunning = True
+        self._thread = threading.Thread(target=self._readLoop,
+                                        name=type(self).__name__)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._isRunning = False
+        # The device is closed once the reader is done with it, closing it
+        # under a blocked read may itself block.
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.close()
+
+    def isRunning(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def readSample(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def _readLoop(self):
+        while self._isRunning:
+            try:
+                sample = self.readSample()
+            except (socket.timeout, ValueError):
+                continue
+            except (IOError, OSError):
+                if self._isRunning:
+                    raise
+                break
+            if sample is None:
+                break
+
+            received = time.time()
+            timestamp, forward, turn = sample
+            with self._lock:
+                self._forward += forward * self.gain[0]
+                self._turn += turn * self.gain[1]
+                self._pendingTimes.append(received)
+                self.sampleCount += 1
+                if timestamp is not None:
+                    self.transportLatency.add(received - timestamp)
+
+    def consume(self):
+        '''
+        Returns the forward displacement and turn accumulated since the last
+        call and resets them. Meant to be called once per frame.
+        '''
+        now = time.time()
+        with self._lock:
+            forward, turn = self._forward, self._turn
+            self._forward = self._turn = 0.
+            pending_times, self._pendingTimes = self._pendingTimes, []
+            for received in pending_times:
+                self.frameLatency.add(now - received)
+        return forward, turn
+
+    def getLatency(self):
+        return {'transport': self.transportLatency.summary(),
+                'frame':     self.frameLatency.summary()}
+
+
+class UDPMotionSensor(MotionSensor):
+    '''Receives binary SAMPLE_FORMAT datagrams on a local UDP port.'''
+
+    def __init__(self, port, host='127.0.0.1', gain=(1., 1.)):
+        MotionSensor.__init__(self, gain)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((host, port))
+        self.socket.settimeout(.1)
+        self.address = self.socket.getsockname()
+
+    def readSample(self):
+        data = self.socket.recv(struct.calcsize(SAMPLE_FORMAT))
+        timestamp, forward, turn = struct.unpack(SAMPLE_FORMAT, data)
+        return (timestamp if timestamp > 0 else None), forward, turn
+
+    def close(self):
+        self.socket.close()
+
+
+class StreamMotionSensor(MotionSensor):
+    '''
+    Reads text lines from a file-like stream (a pipe, a FIFO or a serial
+    port). A line holds either "forward turn" or "timestamp forward turn",
+    separated by whitespace or commas.
+    '''
+
+    def __init__(self, stream, gain=(1., 1.), timeout=.1):
+        MotionSensor.__init__(self, gain)
+        self.stream = stream
+        self.timeout = timeout
+        '''Seconds between two checks of the stop flag while idle.'''
+
+        # Streams backed by a file descriptor are polled and read without
+        # blocking; a buffered readline would hold the stream's lock until
+        # a line arrives, and close would wait for it.
+        try:
+            self._fd = stream.fileno()
+        except (AttributeError, io.UnsupportedOperation):
+            self._fd = None
+        self._buffer = b''
+
+    def _readLine(self):
+        while b'\n' not in self._buffer:
+            ready = select.select([self._fd], [], [], self.timeout)[0]
+            if not ready:
+                raise socket.timeout()
+            data = os.read(self._fd, 4096)
+            if not data:
+                # End of stream, the last line may lack its newline.
+                line, self._buffer = self._buffer, b''
+                return line
+            self._buffer += data
+        line, self._buffer = self._buffer.split(b'\n', 1)
+        return line + b'\n'
+
+    def readSample(self):
+        if self._fd is not None:
+            line = self._readLine()
+        else:
+            line = self.stream.readline()
+        if not line:
+            return None
+        if isinstance(line, bytes):
+            line = line.decode('ascii', 'replace')
+        values = [float(v) for v in line.replace(',', ' ').split()]
+        if len(values) == 2:
+            return (None,) + tuple(values)
+        timestamp, forward, turn = values
+        return timestamp, forward, turn
+
+    def close(self):
+        self.stream.close()
+
+
+class SerialMotionSensor(StreamMotionSensor):
+    '''Reads text samples from a serial port. Requires pyserial.'''
+
+    def __init__(self, port, baudrate=115200, gain=(1., 1.)):
+        import serial
+        stream = serial.Serial(port, baudrate, timeout=.1)
+        StreamMotionSensor.__init__(self, stream, gain)
+
+
+class ReplayMotionSensor(StreamMotionSensor):
+    '''
+    Fake device replaying a recorded sample file ("timestamp forward turn"
+    per line) with its original timing, for testing without hardware. The
+    recorded timestamps are replaced by the time each sample is emitted.
+    '''
+
+    def __init__(self, fileName, gain=(1., 1.), speed=1.):
+        StreamMotionSensor.__init__(self, open(fileName), gain)
+        self.speed = speed
+        self._offset = None
+
+    def readSample(self):
+        sample = StreamMotionSensor.readSample(self)
+        if sample is None or sample[0] is None:
+            return sample
+        timestamp, forward, turn = sample
+        if self._offset is None:
+            self._offset = time.time() - timestamp / self.speed
+        delay = self._offset + timestamp / self.speed - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        return time.time(), forward, turn
+
+
+def replayToSocket(fileName, port, host='127.0.0.1', speed=1.):
+    '''
+    Fake UDP device. Sends the samples of a recorded file to a
+    UDPMotionSensor with their original timing and returns the number of
+    samples sent.
+    '''
+    device = ReplayMotionSensor(fileName, speed=speed)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    count = 0
+    try:
+        while True:
+            sample = device.readSample()
+            if sample is None:
+                return count
+            timestamp, forward, turn = sample
+            sender.sendto(struct.pack(SAMPLE_FORMAT, timestamp or 0., forward,
+                                      turn), (host, port))
+            count += 1
+    finally:
+        sender.close()
+        device.close()
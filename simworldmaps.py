@@ -0,0 +1,288 @@
+'''
+Precomputed raster maps of the world for SimWorldBase.
+
+The solid and goal geometry extracted for the spatial index is rasterized
+once into a grid over the floor plane:
+
+    occupancy  SOLID and GOAL bits per cell, walls from steep solid
+               triangles and filled areas from goal triangles
+    distance   signed distance in world units from the cell center to the
+               nearest solid cell, negative inside solid cells
+    labels     region of each cell, 1 based: the index of the named region
+               containing it or, without named regions, the connected
+               component of free space it belongs to; 0 elsewhere
+
+The maps are saved as .npy files under a directory keyed by a hash of the
+geometry and the options, and memory mapped when loaded, so later sessions
+with the same scene skip the rasterization. Lookups take arrays of
+positions and are answered with a few array operations.
+'''
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+from simworldspatial import extractTriangles
+from simworldspatial import trianglesToSegments
+from simworldspatial import GOAL
+from simworldspatial import SOLID
+
+
+_MAP_NAMES = ('occupancy', 'distance', 'labels')
+
+
+def _samplePoints(segments, step):
+    # Points along every segment no more than step apart.
+    d = segments[:,2:] - segments[:,:2]
+    counts = np.ceil(np.sqrt((d**2).sum(axis=1)) / step).astype(int) + 1
+    owner = np.repeat(np.arange(len(segments)), counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                counts)
+    t = local / np.maximum(counts[owner] - 1, 1).astype(np.float64)
+    return segments[owner,:2] + t[:,None] * d[owner], owner
+
+
+def _sampleTriangles(triangles, step):
+    # Points on a barycentric lattice covering every triangle.
+    edges = np.stack([triangles[:,1] - triangles[:,0],
+                      triangles[:,2] - triangles[:,0]], axis=1)
+    k = np.ceil(np.sqrt((edges**2).sum(axis=2)).max(axis=1) / step)
+    k = k.astype(int) + 1
+    counts = k * k
+    owner = np.repeat(np.arange(len(triangles)), counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                counts)
+    u = (local % k[owner]) / np.maximum(k[owner] - 1, 1).astype(np.float64)
+    v = (local // k[owner]) / np.maximum(k[owner] - 1, 1).astype(np.float64)
+    inside = u + v <= 1
+    owner, u, v = owner[inside], u[inside], v[inside]
+    return (triangles[owner,0] + u[:,None] * edges[owner,0] +
+            v[:,None] * edges[owner,1])
+
+
+def _distanceTransform(sources):
+    '''
+    Euclidean distance in cells from every cell to the nearest True cell of
+    sources, inf if there is none. Exact for cell centers: a sweep along
+    the second axis, then columns at growing offsets along the first axis
+    until the offset alone exceeds every distance found.
+    '''
+    nx, ny = sources.shape
+    g = np.full((nx, ny), np.inf)
+    last = np.full(nx, -np.inf)
+    for iy in range(ny):
+        last = np.where(sources[:,iy], iy, last)
+        g[:,iy] = iy - last
+    last = np.full(nx, np.inf)
+    for iy in range(ny - 1, -1, -1):
+        last = np.where(sources[:,iy], iy, last)
+        g[:,iy] = np.minimum(g[:,iy], last - iy)
+
+    g *= g
+    squared = g.copy()
+    for offset in range(1, nx):
+        if offset * offset >= squared.max():
+            break
+        np.minimum(squared[offset:], g[:-offset] + offset * offset,
+                   out=squared[offset:])
+        np.minimum(squared[:-offset], g[offset:] + offset * offset,
+                   out=squared[:-offset])
+    return np.sqrt(squared)
+
+
+def _labelComponents(free):
+    # Minimum label propagation over 4-neighbours with pointer jumping.
+    shape = free.shape
+    labels = np.where(free, np.arange(free.size).reshape(shape), -1)
+    flat = labels.reshape(-1)
+    while True:
+        previous = labels.copy()
+        for axis in (0, 1):
+            for shift in (1, -1):
+                neighbour = np.roll(labels, shift, axis=axis)
+                edge = [slice(None)] * 2
+                edge[axis] = 0 if shift == 1 else -1
+                neighbour[tuple(edge)] = -1
+                better = free & (neighbour >= 0) & (neighbour < labels)
+                labels[better] = neighbour[better]
+        flat[free.reshape(-1)] = flat[flat[free.reshape(-1)]]
+        if np.array_equal(labels, previous):
+            break
+    roots, result = np.unique(labels, return_inverse=True)
+    result = result.reshape(shape).astype(np.int32)
+    # Occupied cells (-1) sort first and take 0.
+    if roots[0] != -1:
+        result += 1
+    return result
+
+
+def buildMaps(segments, categories, goalTriangles, cellSize, regions=None):
+    '''
+    Rasterizes wall segments, goal triangles and named region rectangles
+    (left, right, bottom, top) into the occupancy, distance and labels
+    arrays. Returns the arrays and the grid metadata.
+    '''
+    walls = segments[(categories & SOLID) != 0]
+    goal_points = np.zeros((0, 2))
+    if len(goalTriangles):
+        goal_points = _sampleTriangles(goalTriangles[:,:,:2], cellSize / 2.)
+    wall_points = _samplePoints(walls, cellSize / 2.)[0]
+
+    points = np.concatenate((wall_points, goal_points))
+    if len(points):
+        low, high = points.min(axis=0), points.max(axis=0)
+    else:
+        low, high = np.zeros(2), np.ones(2)
+    origin = low - cellSize
+    shape = np.ceil((high - origin) / cellSize).astype(int) + 1
+
+    occupancy = np.zeros(shape, dtype=np.uint8)
+    for cell_points, bit in ((wall_points, SOLID), (goal_points, GOAL)):
+        cells = np.floor((cell_points - origin) / cellSize).astype(int)
+        occupancy[cells[:,0], cells[:,1]] |= bit
+
+    solid = (occupancy & SOLID) != 0
+    distance = _distanceTransform(solid) * cellSize
+    distance[solid] = -_distanceTransform(~solid)[solid] * cellSize
+
+    region_names = list(regions or {})
+    if region_names:
+        labels = np.zeros(shape, dtype=np.int32)
+        x = origin[0] + (np.arange(shape[0]) + .5) * cellSize
+        y = origin[1] + (np.arange(shape[1]) + .5) * cellSize
+        for i, name in enumerate(region_names):
+            left, right, bottom, top = regions[name]
+            inside = (((x >= left) & (x <= right))[:,None] &
+                      ((y >= bottom) & (y <= top))[None,:])
+            labels[inside & (labels == 0)] = i + 1
+    else:
+        labels = _labelComponents(~solid)
+
+    meta = {'origin':      origin.tolist(),
+            'cellSize':    cellSize,
+            'shape':       shape.tolist(),
+            'regionNames': region_names}
+    return {'occupancy': occupancy, 'distance': distance,
+            'labels': labels}, meta
+
+
+class WorldMaps(object):
+    '''
+    Occupancy, signed distance and region label maps of a scene loaded from
+    directory, see buildMaps. The arrays are indexed [ix, iy] with cell
+    (ix, iy) covering origin + (ix, iy) * cellSize to one cellSize more.
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+        self.origin = np.array(meta['origin'])
+        self.cellSize = meta['cellSize']
+        self.shape = np.array(meta['shape'])
+        self.regionNames = meta['regionNames']
+        for name in _MAP_NAMES:
+            setattr(self, name, np.load(os.path.join(directory,
+                                                     name + '.npy'),
+                                        mmap_mode='r'))
+
+    @classmethod
+    def fromScene(cls, root, cacheDir, cellSize=.25, regions=None,
+                  maxWallNormalZ=.5):
+        '''
+        Returns the maps of the solid and goal geometry under root, built
+        and saved in cacheDir unless an identical build is there already.
+        '''
+        triangles, masks = extractTriangles(root)
+        segments, categories = trianglesToSegments(triangles, masks,
+                                                   maxWallNormalZ)
+        goal_triangles = triangles[(masks & GOAL) != 0]
+
+        digest = hashlib.sha1()
+        for array in (segments, categories, goal_triangles):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        regions = regions or {}
+        digest.update(repr((cellSize, sorted((name, tuple(rect)) for name,
+                            rect in regions.items()))).encode('utf-8'))
+        directory = os.path.join(cacheDir,
+                                 'maps-{0}'.format(digest.hexdigest()[:16]))
+
+        if not os.path.isfile(os.path.join(directory, 'meta.json')):
+            maps, meta = buildMaps(segments, categories, goal_triangles,
+                                   cellSize, regions)
+            # Written aside and renamed, so that concurrent sessions never
+            # see a partial build.
+            temp_dir = '{0}.{1}.tmp'.format(directory, os.getpid())
+            os.makedirs(temp_dir)
+            for name in _MAP_NAMES:
+                np.save(os.path.join(temp_dir, name + '.npy'), maps[name])
+            with open(os.path.join(temp_dir, 'meta.json'), 'w') as f:
+                json.dump(meta, f, indent=2)
+            try:
+                os.rename(temp_dir, directory)
+            except OSError:
+                shutil.rmtree(temp_dir)
+        return cls(directory)
+
+    def getCells(self, points):
+        '''
+        Returns the (ix, iy) cells of an (n, 2) or (n, 3) array of points,
+        clipped to the grid, and whether each point lies on the grid.
+        '''
+        points = np.atleast_2d(np.asarray(points, dtype=np.float64))
+        cells = np.floor((points[:,:2] - self.origin) / self.cellSize)
+        cells = cells.astype(int)
+        inside = ((cells >= 0) & (cells < self.shape)).all(axis=1)
+        return np.clip(cells, 0, self.shape - 1), inside
+
+    def getOccupancy(self, points):
+        cells, inside = self.getCells(points)
+        return np.where(inside, self.occupancy[cells[:,0], cells[:,1]], 0)
+
+    def getDistance(self, points):
+        '''
+        Signed distance to the nearest wall, bilinearly interpolated between
+        cell centers.
+        '''
+        points = np.atleast_2d(np.asarray(points, dtype=np.float64))
+        f = (points[:,:2] - self.origin) / self.cellSize - .5
+        c0 = np.clip(np.floor(f).astype(int), 0, self.shape - 2)
+        t = np.clip(f - c0, 0, 1)
+        d = self.distance
+        x0, y0 = c0[:,0], c0[:,1]
+        return ((1 - t[:,0]) * (1 - t[:,1]) * d[x0, y0] +
+                t[:,0] * (1 - t[:,1]) * d[x0 + 1, y0] +
+                (1 - t[:,0]) * t[:,1] * d[x0, y0 + 1] +
+                t[:,0] * t[:,1] * d[x0 + 1, y0 + 1])
+
+    def getRegion(self, points):
+        '''Region label of each point, 0 off the grid or in no region.'''
+        cells, inside = self.getCells(points)
+        return np.where(inside, self.labels[cells[:,0], cells[:,1]], 0)
+
+    def getRegionName(self, label):
+        if 0 < label <= len(self.regionNames):
+            return self.regionNames[label - 1]
+        return None
+
+    def isVisible(self, origins, targets, mask=SOLID):
+        '''
+        Whether the straight lines from origins to targets (arrays of n
+        points) cross no cell with a mask bit, the end cells excepted.
+        '''
+        origins = np.asarray(origins, dtype=np.float64)[:, :2]
+        targets = np.asarray(targets, dtype=np.float64)[:, :2]
+        n = len(origins)
+        points, owner = _samplePoints(np.column_stack((origins, targets)),
+                                      self.cellSize / 2.)
+        cells, inside = self.getCells(points)
+        start, _ = self.getCells(origins)
+        end, _ = self.getCells(targets)
+        interior = ((cells != start[owner]).any(axis=1) &
+                    (cells != end[owner]).any(axis=1))
+        blocked = inside & interior & (
+            (self.occupancy[cells[:,0], cells[:,1]] & mask) != 0)
+        return np.bincount(owner[blocked], minlength=n) == 0
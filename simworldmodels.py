@@ -0,0 +1,96 @@
+'''
+Model cache for SimWorldBase.
+
+Egg models are converted to .bam the first time they are loaded and the
+converted file is keyed by a hash of the source, so later sessions skip the
+decompression and parsing of the egg text. Models loaded within a session
+are kept in memory and shared between actors through instancing.
+'''
+
+import hashlib
+import os
+
+from panda3d.core import Filename
+from panda3d.core import ModelNode
+from panda3d.core import NodePath
+
+
+class ModelCache(object):
+
+    extensions = ('', '.bam', '.egg', '.egg.pz', '.bam.pz')
+    '''Extensions tried, in order, when resolving a model name to a file.'''
+
+    def __init__(self, loader, modelDir, cacheDir=None):
+        self.loader = loader
+
+        self.modelDir = modelDir
+        '''Directory holding the source models.'''
+
+        self.cacheDir = cacheDir or os.path.join(modelDir, '.cache')
+        '''Directory holding the converted .bam files.'''
+
+        self.models = {}
+        '''Dictionary of loaded model node paths keyed with the model name.'''
+
+    def getModelPath(self, name):
+        for extension in self.extensions:
+            path = os.path.join(self.modelDir, name + extension)
+            if os.path.isfile(path):
+                return path
+        raise IOError('Model [{0}] not found in {1}.'.format(name,
+                                                             self.modelDir))
+
+    def getBamPath(self, name):
+        path = self.getModelPath(name)
+        if path.endswith('.bam'):
+            return path
+
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        bam_name = '{0}-{1}.bam'.format(name, digest.hexdigest()[:16])
+        bam_path = os.path.join(self.cacheDir, bam_name)
+        if os.path.isfile(bam_path):
+            return bam_path
+
+        # Convert through a temporary file so that concurrent sessions never
+        # see a partially written cache entry.
+        if not os.path.isdir(self.cacheDir):
+            try:
+                os.makedirs(self.cacheDir)
+            except OSError:
+                if not os.path.isdir(self.cacheDir):
+                    raise
+        model_np = self.loader.loadModel(Filename.fromOsSpecific(path))
+        temp_path = '{0}.{1}.tmp'.format(bam_path, os.getpid())
+        try:
+            if model_np.writeBamFile(Filename.fromOsSpecific(temp_path)):
+                os.rename(temp_path, bam_path)
+                return bam_path
+        finally:
+            # Left over after a failed write or rename.
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return path
+
+    def load(self, name, instance=True):
+        '''
+        Returns the named model. With instance, the model is loaded once per
+        session and each call returns a new node holding an instance of it,
+        so transforms may be set on the returned node without affecting the
+        other instances. Otherwise a private copy is loaded, which is what
+        callers that modify the model's geometry want.
+        '''
+        if not instance:
+            return self._loadFile(name)
+
+        if name not in self.models:
+            self.models[name] = self._loadFile(name)
+        holder_np = NodePath(ModelNode(name))
+        self.models[name].instanceTo(holder_np)
+        return holder_np
+
+    def _loadFile(self, name):
+        path = Filename.fromOsSpecific(self.getBamPath(name))
+        return self.loader.loadModel(path)
@@ -0,0 +1,234 @@
+'''
+Paging of large world models for SimWorldBase.
+
+A world model is split once into square tiles of the XY plane, each saved
+as its own .bam file next to the model cache together with an index. At run
+time WorldPager keeps only the tiles near the actor of interest in the scene
+graph: tiles within loadRadius are loaded asynchronously by the Panda3D
+loader threads, tiles beyond unloadRadius are removed, and the total size of
+the loaded tiles is kept within a memory budget by dropping the farthest
+ones. Objects larger than a tile (e.g. a terrain or an outer wall) go to a
+base tile that is always loaded.
+'''
+
+import json
+import math
+import os
+
+from panda3d.core import BoundingSphere
+from panda3d.core import Filename
+from panda3d.core import NodePath
+
+
+def _tileKey(x, y, tileSize):
+    return int(math.floor(x / tileSize)), int(math.floor(y / tileSize))
+
+
+def _copyTo(nodePath, root, tileNP):
+    # Keep the transform and render state inherited from the model.
+    copy_np = nodePath.copyTo(tileNP)
+    copy_np.setTransform(nodePath.getTransform(root))
+    copy_np.setState(nodePath.getNetState())
+    return copy_np
+
+
+def splitIntoTiles(root, tileSize, directory):
+    '''
+    Splits the GeomNodes and CollisionNodes below root into tiles written to
+    directory and returns the index, which is also saved as index.json.
+    '''
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    tiles = {}
+    base_np = NodePath('base')
+    for node_np in root.findAllMatches('**/+GeomNode'):
+        _assign(node_np, root, tileSize, tiles, base_np)
+    for node_np in root.findAllMatches('**/+CollisionNode'):
+        _assign(node_np, root, tileSize, tiles, base_np)
+
+    index = {'tileSize': tileSize, 'tiles': {}}
+    for key, tile_np in list(tiles.items()) + [(None, base_np)]:
+        file_name = 'base.bam' if key is None else \
+                    'tile_{0}_{1}.bam'.format(*key)
+        path = os.path.join(directory, file_name)
+        tile_np.writeBamFile(Filename.fromOsSpecific(path))
+        entry = {'file': file_name, 'bytes': os.path.getsize(path)}
+        if key is None:
+            index['base'] = entry
+        else:
+            index['tiles']['{0},{1}'.format(*key)] = entry
+
+    with open(os.path.join(directory, 'index.json'), 'w') as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+    return index
+
+
+def _getExtent(nodePath, root):
+    # CollisionNodes have no tight bounds, so use the bounding volume.
+    bounds = nodePath.getBounds().makeCopy()
+    if bounds.isEmpty() or bounds.isInfinite():
+        return None
+    bounds.xform(nodePath.getMat(root))
+    if bounds.isOfType(BoundingSphere.getClassType()):
+        radius = bounds.getRadius()
+        return bounds.getCenter(), radius * 2., radius * 2.
+    low, high = bounds.getMin(), bounds.getMax()
+    return (low + high) / 2., high[0] - low[0], high[1] - low[1]
+
+
+def _assign(nodePath, root, tileSize, tiles, baseNP):
+    extent = _getExtent(nodePath, root)
+    if extent is None:
+        return
+    center, width, depth = extent
+    if max(width, depth) > tileSize:
+        _copyTo(nodePath, root, baseNP)
+        return
+    key = _tileKey(center[0], center[1], tileSize)
+    if key not in tiles:
+        tiles[key] = NodePath('tile_{0}_{1}'.format(*key))
+    _copyTo(nodePath, root, tiles[key])
+
+
+class WorldPager(object):
+    '''
+    Keeps the tiles of the index in directory around a point loaded below
+    root. memoryBudget bounds the total .bam size of the loaded tiles in
+    bytes, a proxy for their memory use; None means no bound.
+    '''
+
+    def __init__(self, world, directory, root, loadRadius=100.,
+                 unloadRadius=None, memoryBudget=None):
+        self.world = world
+        self.directory = directory
+        self.root = root
+        self.loadRadius = loadRadius
+        self.unloadRadius = unloadRadius or 1.5 * loadRadius
+        self.memoryBudget = memoryBudget
+
+        with open(os.path.join(directory, 'index.json')) as f:
+            self.index = json.load(f)
+        self.tileSize = self.index['tileSize']
+        self.tiles = dict((tuple(int(v) for v in key.split(',')), entry)
+                          for key, entry in self.index['tiles'].items())
+
+        self.loaded = {}
+        '''Node paths of the loaded tiles keyed with the tile key.'''
+
+        self.pending = {}
+        '''Load requests of the tiles being loaded keyed with the tile key.'''
+
+        self.loadedBytes = self.index['base']['bytes']
+        '''Total .bam size of the loaded tiles, base tile included.'''
+
+        self.loadCount = 0
+        self._isPrimed = False
+        self.unloadCount = 0
+
+        # The base tile is always there.
+        self.baseNP = self._loadSync(self.index['base']['file'])
+        self.baseNP.reparentTo(root)
+        self.world.indexObject(self.baseNP)
+
+    def _getPath(self, fileName):
+        return Filename.fromOsSpecific(os.path.join(self.directory, fileName))
+
+    def _loadSync(self, fileName):
+        return self.world.loader.loadModel(self._getPath(fileName))
+
+    def _getDistance(self, key, x, y):
+        # Distance from the point to the tile square.
+        half = self.tileSize / 2.
+        cx = (key[0] + .5) * self.tileSize
+        cy = (key[1] + .5) * self.tileSize
+        dx = max(abs(x - cx) - half, 0.)
+        dy = max(abs(y - cy) - half, 0.)
+        return math.sqrt(dx * dx + dy * dy)
+
+    def getWantedTiles(self, x, y):
+        '''Tiles within loadRadius, nearest first, within the budget.'''
+        n = int(math.ceil(self.loadRadius / self.tileSize))
+        cx, cy = _tileKey(x, y, self.tileSize)
+        keys = [(i, j) for i in range(cx - n, cx + n + 1)
+                for j in range(cy - n, cy + n + 1)
+                if (i, j) in self.tiles and
+                self._getDistance((i, j), x, y) <= self.loadRadius]
+        keys.sort(key=lambda k: self._getDistance(k, x, y))
+        if self.memoryBudget is None:
+            return keys
+        wanted = []
+        total = self.index['base']['bytes']
+        for key in keys:
+            total += self.tiles[key]['bytes']
+            if total > self.memoryBudget:
+                break
+            wanted.append(key)
+        return wanted
+
+    def update(self, x, y):
+        # The tiles around the start point are loaded in place, later ones
+        # in the loader threads.
+        if not self._isPrimed:
+            self.loadAll(x, y)
+            self._isPrimed = True
+        wanted = self.getWantedTiles(x, y)
+        wanted_set = set(wanted)
+
+        # Farthest first, so that the budget drops the least useful tiles.
+        unwanted = sorted((key for key in self.loaded if key not in wanted_set),
+                          key=lambda k: -self._getDistance(k, x, y))
+        for key in unwanted:
+            over_budget = (self.memoryBudget is not None and
+                           self.loadedBytes > self.memoryBudget)
+            if over_budget or self._getDistance(key, x, y) > self.unloadRadius:
+                self._unload(key)
+
+        for key in list(self.pending):
+            if self._getDistance(key, x, y) > self.unloadRadius:
+                self.pending.pop(key).cancel()
+
+        for key in wanted:
+            if key not in self.loaded and key not in self.pending:
+                self.pending[key] = self.world.loader.loadModel(
+                    self._getPath(self.tiles[key]['file']),
+                    callback=self._onLoaded, extraArgs=[key])
+
+    def _onLoaded(self, tileNP, key):
+        # Runs on the main thread once the loader thread is done.
+        if key not in self.pending:
+            return
+        del self.pending[key]
+        if tileNP is None:
+            return
+        tileNP.reparentTo(self.root)
+        self.world.indexObject(tileNP)
+        # The tile comes with the model's masks, not the current ones.
+        self.world.applyObjectMasks(tileNP)
+        self.loaded[key] = tileNP
+        self.loadedBytes += self.tiles[key]['bytes']
+        self.loadCount += 1
+
+    def _unload(self, key):
+        tile_np = self.loaded.pop(key)
+        self.world.unindexObject(tile_np)
+        tile_np.removeNode()
+        self.loadedBytes -= self.tiles[key]['bytes']
+        self.unloadCount += 1
+
+    def loadAll(self, x, y):
+        '''Loads the tiles wanted around a point synchronously.'''
+        for key in self.getWantedTiles(x, y):
+            if key not in self.loaded:
+                self.pending[key] = None
+                self._onLoaded(self._loadSync(self.tiles[key]['file']), key)
+
+    def close(self):
+        for request in self.pending.values():
+            if request is not None:
+                request.cancel()
+        self.pending = {}
+        for key in list(self.loaded):
+            self._unload(key)
+        self.world.unindexObject(self.baseNP)
+        self.baseNP.removeNode()
@@ -0,0 +1,108 @@
+'''
+Vectorized kinematics for populations of simulated actors.
+
+The state of every actor (position, heading, speeds and movement directions)
+is held in NumPy arrays and integrated in one step per frame. Scene graph
+transforms are pushed in bulk afterwards, or not at all when the population
+has no node paths (e.g. when running without a graphics output).
+'''
+
+import numpy as np
+
+
+class ActorPopulation(object):
+    '''
+    Kinematic state of a population of actors. position (n x 3), heading
+    (degrees), moveSpeed (units per second), turnSpeed (degrees per second),
+    moveDir (forward 1, reverse -1, stop 0) and turnDir (left 1, right -1)
+    are views of length n into preallocated storage. They are replaced when
+    an actor is added, so do not hold on to them across calls to add().
+    '''
+
+    def __init__(self, capacity=64):
+        self.names = []
+        '''Actor names, in index order.'''
+
+        self.index = {}
+        '''Dictionary of actor indices keyed with the actor name.'''
+
+        self.nodePaths = []
+        '''Actor node paths in index order, None for actors without one.'''
+
+        self._position  = np.zeros((capacity, 3))
+        self._heading   = np.zeros(capacity)
+        self._moveSpeed = np.zeros(capacity)
+        self._turnSpeed = np.zeros(capacity)
+        self._moveDir   = np.zeros(capacity)
+        self._turnDir   = np.zeros(capacity)
+        self._updateViews()
+
+    def __len__(self):
+        return len(self.names)
+
+    def _updateViews(self):
+        n = len(self.names)
+        self.position  = self._position[:n]
+        self.heading   = self._heading[:n]
+        self.moveSpeed = self._moveSpeed[:n]
+        self.turnSpeed = self._turnSpeed[:n]
+        self.moveDir   = self._moveDir[:n]
+        self.turnDir   = self._turnDir[:n]
+
+    def _grow(self, capacity):
+        for field in ('_position', '_heading', '_moveSpeed', '_turnSpeed',
+                      '_moveDir', '_turnDir'):
+            old = getattr(self, field)
+            new = np.zeros((capacity,) + old.shape[1:])
+            new[:len(old)] = old
+            setattr(self, field, new)
+
+    def add(self, name, position=(0,0,0), heading=0, moveSpeed=0,
+            turnSpeed=0, nodePath=None):
+        n = len(self.names)
+        if n == len(self._heading):
+            self._grow(max(2 * n, 1))
+
+        self._position[n]  = position
+        self._heading[n]   = heading
+        self._moveSpeed[n] = moveSpeed
+        self._turnSpeed[n] = turnSpeed
+        self._moveDir[n]   = 0
+        self._turnDir[n]   = 0
+
+        self.names.append(name)
+        self.nodePaths.append(nodePath)
+        self.index[name] = n
+        self._updateViews()
+        return n
+
+    def integrate(self, dt):
+        # Same order as SimWorldBase.actorOIControlTask: turn first, then
+        # move along the new heading (+Y rotated by the heading about +Z).
+        self.heading += self.turnSpeed * self.turnDir * dt
+        step = self.moveSpeed * self.moveDir * dt
+        rad = np.radians(self.heading)
+        self.position[:,0] -= step * np.sin(rad)
+        self.position[:,1] += step * np.cos(rad)
+
+    def push(self, position=None, heading=None):
+        # Other poses than the current state may be pushed, e.g. poses
+        # interpolated for rendering.
+        if position is None:
+            position = self.position
+        if heading is None:
+            heading = self.heading
+
+        # Converting to lists once avoids creating a NumPy scalar per call.
+        for node_path, (x, y, z), h in zip(self.nodePaths,
+                                           position.tolist(),
+                                           heading.tolist()):
+            if node_path is not None:
+                node_path.setPos(x, y, z)
+                node_path.setH(h)
+
+    def pull(self):
+        for i, node_path in enumerate(self.nodePaths):
+            if node_path is not None:
+                self.position[i] = node_path.getPos()
+                self.heading[i]  = node_path.getH()
@@ -0,0 +1,126 @@
+'''
+Frame-time and task-level profiling for SimWorldBase.
+
+Per-task run times are read from the task manager, which measures them
+natively, so profiling adds no wrapper around the tasks themselves. Frame
+intervals are measured on the real time clock, which keeps the numbers
+meaningful when the simulation runs with a fixed time step.
+'''
+
+import json
+import math
+
+import numpy as np
+
+
+class Histogram(object):
+    '''Log-spaced histogram of durations in seconds.'''
+
+    def __init__(self, low=1e-6, high=10., binsPerDecade=20):
+        self.low = low
+        self.binsPerDecade = binsPerDecade
+        self.numBins = int(math.ceil(math.log10(high / low) * binsPerDecade))
+        self.counts = np.zeros(self.numBins + 1, dtype=np.int64)
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, value):
+        if value > self.low:
+            i = int(math.log10(value / self.low) * self.binsPerDecade) + 1
+            self.counts[min(i, self.numBins)] += 1
+        else:
+            self.counts[0] += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def getCount(self):
+        return int(self.counts.sum())
+
+    def percentile(self, q):
+        # Upper edge of the bin holding the q-th percentile.
+        count = self.getCount()
+        if count == 0:
+            return 0.
+        i = int(np.searchsorted(np.cumsum(self.counts), q / 100. * count))
+        return min(self.low * 10**(i / float(self.binsPerDecade)), self.max)
+
+    def summary(self):
+        count = self.getCount()
+        return {'count': count,
+                'mean':  self.total / count if count else 0.,
+                'max':   self.max,
+                'p50':   self.percentile(50),
+                'p90':   self.percentile(90),
+                'p99':   self.percentile(99)}
+
+
+class FrameProfiler(object):
+    '''
+    Accumulates per-task run times, frame intervals, frame interval jitter
+    (deviation from the expected interval) and dropped frames (intervals
+    longer than dropFactor expected intervals). sample() is meant to run
+    once per frame, after all the tasks of interest.
+    '''
+
+    def __init__(self, taskMgr, clock, frameRate=60., dropFactor=1.5):
+        self.taskMgr = taskMgr
+        self.clock = clock
+        self.frameRate = frameRate
+        self.dropFactor = dropFactor
+        self.reset()
+
+    def reset(self):
+        self.taskTime = {}
+        '''Dictionary of task run time histograms keyed with the task name.'''
+
+        self.frameInterval = Histogram()
+        self.frameJitter = Histogram()
+        self.droppedFrames = 0
+        self.lastTime = None
+
+    def sample(self):
+        now = self.clock.getRealTime()
+        if self.lastTime is not None:
+            interval = now - self.lastTime
+            expected = 1. / self.frameRate
+            self.frameInterval.add(interval)
+            self.frameJitter.add(abs(interval - expected))
+            if interval > self.dropFactor * expected:
+                self.droppedFrames += 1
+        self.lastTime = now
+
+        for task in self.taskMgr.mgr.getActiveTasks():
+            name = task.getName()
+            if name not in self.taskTime:
+                self.taskTime[name] = Histogram()
+            self.taskTime[name].add(task.getDt())
+
+    def getProfile(self):
+        return {'frameRate':     self.frameRate,
+                'frameInterval': self.frameInterval.summary(),
+                'frameJitter':   self.frameJitter.summary(),
+                'droppedFrames': self.droppedFrames,
+                'tasks':         dict((name, histogram.summary())
+                                      for name, histogram
+                                      in self.taskTime.items())}
+
+    def dump(self, fileName):
+        with open(fileName, 'w') as f:
+            json.dump(self.getProfile(), f, indent=2, sort_keys=True)
+
+    def formatProfile(self):
+        interval = self.frameInterval.summary()
+        jitter = self.frameJitter.summary()
+        lines = ['frame {0:7.2f} ms  p99 {1:7.2f} ms'.format(
+                     interval['mean'] * 1e3, interval['p99'] * 1e3),
+                 'jitter{0:7.2f} ms  p99 {1:7.2f} ms'.format(
+                     jitter['mean'] * 1e3, jitter['p99'] * 1e3),
+                 'dropped {0}'.format(self.droppedFrames),
+                 '']
+        tasks = sorted(self.taskTime.items(), key=lambda item: -item[1].total)
+        for name, histogram in tasks:
+            summary = histogram.summary()
+            lines.append('{0:<20.20} {1:6.2f} ms  p99 {2:6.2f} ms'.format(
+                name, summary['mean'] * 1e3, summary['p99'] * 1e3))
+        return '\n'.join(lines)
@@ -0,0 +1,229 @@
+'''
+Streaming trace export for SimWorldBase.
+
+TracePublisher pushes every trace record to the analysis processes that
+subscribed to it over a local Unix datagram socket. The render thread only
+queues the record; a background thread packs the queued records into
+datagrams and sends them without blocking, so a slow or stalled subscriber
+loses records (counted, and visible to it as a sequence gap) instead of
+slowing the frame rate.
+
+A datagram starts with a HEADER: the MAGIC bytes, the message kind, the
+number of records and the sequence number of the first record. RECORDS
+messages carry that many records in the layout given by the SCHEMA message
+sent to each new subscriber, whose payload is the NumPy descr of the dtype.
+Subscribers send SUBSCRIBE and UNSUBSCRIBE messages (count and sequence 0)
+to the publisher's address. TraceSubscriber implements that side.
+'''
+
+import ast
+import collections
+import os
+import socket
+import threading
+
+import numpy as np
+
+from simworldtrace import TRACE_DTYPE
+
+
+MAGIC = b'SWTP'
+
+HEADER = np.dtype([('magic',    'S4'),
+                   ('kind',     '<u1'),
+                   ('count',    '<u2'),
+                   ('sequence', '<u8')])
+'''Layout of the header starting every datagram.'''
+
+RECORDS     = 0
+SCHEMA      = 1
+SUBSCRIBE   = 2
+UNSUBSCRIBE = 3
+
+
+def _makeHeader(kind, count=0, sequence=0):
+    return np.array((MAGIC, kind, count, sequence), dtype=HEADER).tobytes()
+
+
+def _readHeader(data):
+    if len(data) < HEADER.itemsize:
+        return None
+    header = np.frombuffer(data[:HEADER.itemsize], dtype=HEADER)[0]
+    if header['magic'] != MAGIC:
+        return None
+    return int(header['kind']), int(header['count']), int(header['sequence'])
+
+
+class TracePublisher(object):
+    '''
+    Publishes trace records on the Unix datagram socket at address. Has the
+    append(record) and close() methods of the trace writers. At most
+    queueSize records wait for the sender thread; records beyond that are
+    dropped and counted in dropCount.
+    '''
+
+    def __init__(self, address, dtype=TRACE_DTYPE, queueSize=1024,
+                 maxBatch=256):
+        self.address = address
+        self.dtype = np.dtype(dtype)
+        self.queueSize = queueSize
+        self.maxBatch = maxBatch
+
+        self.sequence = 0
+        '''Sequence number of the next record.'''
+
+        self.dropCount = 0
+        '''Number of records dropped because the sender fell behind.'''
+
+        self.sentCount = 0
+        '''Number of records sent, counted once per subscriber.'''
+
+        self.subscribers = {}
+        '''Records lost per subscriber keyed with the subscriber address.'''
+
+        if os.path.exists(address):
+            os.unlink(address)
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.socket.bind(address)
+        self.socket.setblocking(False)
+
+        self._queue = collections.deque()
+        self._wake = threading.Event()
+        self._isClosing = False
+        self._thread = threading.Thread(target=self._sendLoop,
+                                        name='TracePublisher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __len__(self):
+        return self.sequence
+
+    def append(self, record):
+        # deque.append is atomic; the sender thread pops from the other end.
+        if len(self._queue) >= self.queueSize:
+            self.dropCount += 1
+        else:
+            self._queue.append((self.sequence, record))
+            self._wake.set()
+        self.sequence += 1
+
+    def close(self):
+        self._isClosing = True
+        self._wake.set()
+        self._thread.join()
+        self.socket.close()
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+
+    def _receiveControl(self):
+        while True:
+            try:
+                data, address = self.socket.recvfrom(64)
+            except (BlockingIOError, InterruptedError):
+                return
+            header = _readHeader(data)
+            if header is None or not address:
+                continue
+            if header[0] == SUBSCRIBE:
+                self.subscribers.setdefault(address, 0)
+                descr = repr(np.lib.format.dtype_to_descr(self.dtype))
+                self._send(address, _makeHeader(SCHEMA) +
+                           descr.encode('ascii'), 0)
+            elif header[0] == UNSUBSCRIBE:
+                self.subscribers.pop(address, None)
+
+    def _send(self, address, data, count):
+        try:
+            self.socket.sendto(data, address)
+            self.sentCount += count
+        except (BlockingIOError, InterruptedError):
+            # The subscriber's receive buffer is full.
+            self.subscribers[address] += count
+        except (ConnectionRefusedError, FileNotFoundError):
+            del self.subscribers[address]
+
+    def _popBatch(self):
+        # Records dropped in between split the batch, so that each datagram
+        # holds consecutive sequence numbers.
+        first, record = self._queue.popleft()
+        records = [record]
+        while (self._queue and len(records) < self.maxBatch and
+               self._queue[0][0] == first + len(records)):
+            records.append(self._queue.popleft()[1])
+        return first, records
+
+    def _sendLoop(self):
+        while True:
+            self._wake.wait(.1)
+            self._wake.clear()
+            self._receiveControl()
+            while self._queue:
+                first, records = self._popBatch()
+                if not self.subscribers:
+                    continue
+                data = (_makeHeader(RECORDS, len(records), first) +
+                        np.array(records, dtype=self.dtype).tobytes())
+                for address in list(self.subscribers):
+                    self._send(address, data, len(records))
+            if self._isClosing:
+                break
+
+
+class TraceSubscriber(object):
+    '''
+    Receives the records of the TracePublisher at address. lostCount counts
+    the records missed because of drops on either side.
+    '''
+
+    def __init__(self, address):
+        self.address = address
+        self.dtype = None
+        self.nextSequence = None
+        self.lostCount = 0
+
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        # Let the kernel pick an address in the abstract namespace.
+        self.socket.bind('')
+        self.subscribe()
+
+    def subscribe(self):
+        try:
+            self.socket.sendto(_makeHeader(SUBSCRIBE), self.address)
+        except (ConnectionRefusedError, FileNotFoundError):
+            # Not up yet, receive subscribes again on timeout.
+            pass
+
+    def receive(self, timeout=None):
+        '''
+        Returns the records of the next datagram as a structured array, or
+        None if nothing arrived within timeout seconds.
+        '''
+        self.socket.settimeout(timeout)
+        while True:
+            try:
+                data = self.socket.recv(1 << 20)
+            except socket.timeout:
+                if self.dtype is None:
+                    # The publisher may have started after us.
+                    self.subscribe()
+                return None
+            header = _readHeader(data)
+            if header is None:
+                continue
+            kind, count, sequence = header
+            payload = data[HEADER.itemsize:]
+            if kind == SCHEMA:
+                descr = ast.literal_eval(payload.decode('ascii'))
+                self.dtype = np.lib.format.descr_to_dtype(descr)
+            elif kind == RECORDS and self.dtype is not None:
+                if self.nextSequence is not None:
+                    self.lostCount += max(sequence - self.nextSequence, 0)
+                self.nextSequence = sequence + count
+                return np.frombuffer(payload, dtype=self.dtype, count=count)
+
+    def close(self):
+        try:
+            self.socket.sendto(_makeHeader(UNSUBSCRIBE), self.address)
+        except (ConnectionRefusedError, FileNotFoundError):
+            pass
+        self.socket.close()
@@ -0,0 +1,152 @@
+'''
+Session record and replay for SimWorldBase.
+
+The recorder logs, for every frame of the actor of interest control task,
+the frame dt, the move/turn directions and the translation and rotation
+that were applied, plus every actor enter/exit collision event. Both logs
+are binary .npy files written through TraceWriter; the node names of the
+events are kept in a table next to them, so names of any length fit in
+fixed size records. Replay drives a world
+built the same way as the recorded one from the log: each frame gets the
+recorded dt on a non-real-time clock and the recorded displacement through
+the motion sensor path of the control task, so the trajectory is
+reproduced bit for bit while the world runs as fast as it can.
+'''
+
+import json
+import os
+
+import numpy as np
+
+from panda3d.core import ClockObject
+
+from simworldtrace import TraceWriter
+from simworldtrace import readTrace
+
+
+FRAME_DTYPE = np.dtype([('dt',          '<f8'),
+                        ('moveDir',     '<i1'),
+                        ('turnDir',     '<i1'),
+                        ('translation', '<f8'),
+                        ('rotation',    '<f8')])
+'''Record layout of the per-frame input log.'''
+
+EVENT_DTYPE = np.dtype([('frame',    '<i8'),
+                        ('kind',     '<u1'),
+                        ('fromName', '<i4'),
+                        ('intoName', '<i4')])
+'''
+Record layout of the event log. kind holds the TRACE_EVENT_ENTER or
+TRACE_EVENT_EXIT flag, frame the index of the last recorded frame and the
+names are indices into the session's name table.
+'''
+
+
+def getSessionFileNames(fileName):
+    return (fileName + '.frames.npy', fileName + '.events.npy',
+            fileName + '.names.json')
+
+
+class SessionRecorder(object):
+
+    def __init__(self, fileName):
+        frames_name, events_name, self.namesFileName = \
+            getSessionFileNames(fileName)
+        self.frames = TraceWriter(frames_name, FRAME_DTYPE)
+        self.events = TraceWriter(events_name, EVENT_DTYPE, capacity=4096,
+                                  flushSize=256)
+        self.names = []
+        self._nameIds = {}
+        self._writeNames()
+
+    def recordFrame(self, dt, moveDir, turnDir, translation, rotation):
+        self.frames.append((dt, moveDir, turnDir, translation, rotation))
+
+    def recordEvent(self, kind, collisionEntry):
+        self.events.append((len(self.frames), kind,
+                            self._getNameId(collisionEntry.getFromNodePath()),
+                            self._getNameId(collisionEntry.getIntoNodePath())))
+
+    def _getNameId(self, nodePath):
+        name = nodePath.getName()
+        name_id = self._nameIds.get(name)
+        if name_id is None:
+            name_id = self._nameIds[name] = len(self.names)
+            self.names.append(name)
+            # New names are rare, the table is rewritten so that it is
+            # complete even if the session does not shut down cleanly.
+            self._writeNames()
+        return name_id
+
+    def _writeNames(self):
+        temp_name = self.namesFileName + '.tmp'
+        with open(temp_name, 'w') as f:
+            json.dump(self.names, f)
+        os.replace(temp_name, self.namesFileName)
+
+    def close(self):
+        self.frames.close()
+        self.events.close()
+
+
+def readSession(fileName):
+    '''
+    Memory maps the frame and event logs of a recorded session. Returns
+    them with the name table the event names index.
+    '''
+    frames_name, events_name, names_name = getSessionFileNames(fileName)
+    with open(names_name) as f:
+        names = json.load(f)
+    return readTrace(frames_name), readTrace(events_name), names
+
+
+class ReplayInput(object):
+    '''
+    Stands in for the motion sensor of a world during replay and hands the
+    control task the recorded displacement of each frame.
+    '''
+
+    def __init__(self, frames):
+        self.frames = frames
+        self.index = 0
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def consume(self):
+        frame = self.frames[self.index]
+        self.index += 1
+        return float(frame['translation']), float(frame['rotation'])
+
+
+def replaySession(world, fileName, onFrame=None):
+    '''
+    Replays a recorded session through world, which must have been set up
+    like the recorded one (scene, actors, collision objects) with the actor
+    of interest control active. onFrame(world, index) is called after each
+    replayed frame. Returns the number of frames replayed.
+    '''
+    frames, events, names = readSession(fileName)
+    dts = frames['dt'].tolist()
+    move_dirs = frames['moveDir'].tolist()
+    turn_dirs = frames['turnDir'].tolist()
+
+    sensor = world.motionSensor
+    world.motionSensor = ReplayInput(frames)
+    mode, dt = world.clock.getMode(), world.clock.getDt()
+    world.clock.setMode(ClockObject.MNonRealTime)
+    try:
+        for i in range(len(frames)):
+            # The recorded dt applies to the frame about to run.
+            world.clock.setDt(dts[i])
+            world.step(1, (move_dirs[i], turn_dirs[i]))
+            if onFrame is not None:
+                onFrame(world, i)
+    finally:
+        world.motionSensor = sensor
+        world.clock.setMode(mode)
+        world.clock.setDt(dt)
+    return len(frames)
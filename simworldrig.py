@@ -0,0 +1,146 @@
+'''
+Multi-view camera rigs for SimWorldBase.
+
+A rig is a set of cameras attached to one node (usually the actor of
+interest), built from a description: one dictionary per view giving its
+heading and pitch relative to the rig, its horizontal field of view and the
+region (left, right, bottom, top) of the output it is drawn into. Lenses are
+set up once with the aspect ratio of their region, so switching views costs
+nothing per frame.
+
+Panda3D culls each display region on its own and has no way of sharing a
+cull result between cameras. The cost per view is kept down instead by
+tiling the panorama with adjacent, non overlapping frustums (an object is
+drawn twice only when it straddles a seam) and by a common far plane. The
+cull of one view can further overlap the draw of the previous one with the
+pipelined threading model, see the threadingModel argument of SimWorldBase.
+With wideBuffer all views render into one offscreen buffer, which is then
+shown in the window as a single textured card; the whole panorama is then a
+single render target, e.g. for capture or projector warping.
+'''
+
+from panda3d.core import Camera
+from panda3d.core import CardMaker
+from panda3d.core import PerspectiveLens
+from panda3d.core import Texture
+from panda3d.core import TextureStage
+
+from simworldcapture import getBufferSize
+
+
+def makePanorama(count, fov=360., pitch=0., near=.1, far=1000.):
+    '''
+    Describes count views tiling fov degrees horizontally, centered on the
+    rig's forward direction and laid out from left to right.
+    '''
+    width = float(fov) / count
+    views = []
+    for i in range(count):
+        views.append({'name':    'view{0}'.format(i),
+                      'heading': fov / 2. - width * (i + .5),
+                      'pitch':   pitch,
+                      'fov':     width,
+                      'region':  (float(i) / count, float(i + 1) / count, 0, 1),
+                      'near':    near,
+                      'far':     far})
+    return views
+
+
+class CameraRig(object):
+    '''
+    Cameras of the views described by views, attached to parent and drawn
+    into the display regions of output, or of a wide offscreen buffer of
+    size pixels when wideBuffer is set. A view may give 'vfov' to fix the
+    vertical field of view instead of deriving it from its region.
+    '''
+
+    def __init__(self, world, name, parent, views, wideBuffer=False,
+                 size=None, sort=99):
+        self.world = world
+        self.name = name
+        self.rigNP = parent.attachNewNode(name)
+
+        self.buffer = None
+        self.cardNP = None
+        self.scale = (1., 1.)
+        output = world.win
+        if wideBuffer:
+            if size is None:
+                size = (output.getXSize(), output.getYSize())
+            # The views use the lower left part of a larger buffer.
+            buffer_size = getBufferSize(output, size)
+            self.scale = (float(size[0]) / buffer_size[0],
+                          float(size[1]) / buffer_size[1])
+            self.texture = Texture(name)
+            self.buffer = output.makeTextureBuffer(name, buffer_size[0],
+                                                   buffer_size[1],
+                                                   self.texture)
+            self.buffer.setSort(-50)
+            self.buffer.setClearColor(output.getClearColor())
+            self.buffer.setActive(False)
+
+            card_maker = CardMaker(name)
+            card_maker.setFrameFullscreenQuad()
+            self.cardNP = world.render2d.attachNewNode(card_maker.generate())
+            self.cardNP.setTexture(self.texture)
+            self.cardNP.setTexScale(TextureStage.getDefault(), *self.scale)
+            self.cardNP.setBin('background', 0)
+            self.cardNP.setDepthWrite(False)
+            self.cardNP.hide()
+            output = self.buffer
+
+        self.cameraNP = {}
+        '''Dictionary of camera node paths keyed with the view name.'''
+
+        self.displayRegion = {}
+        '''Dictionary of display regions keyed with the view name.'''
+
+        for view in views:
+            left, right, bottom, top = view['region']
+            dr = output.makeDisplayRegion(left * self.scale[0],
+                                          right * self.scale[0],
+                                          bottom * self.scale[1],
+                                          top * self.scale[1])
+            dr.setSort(sort)
+            dr.setActive(False)
+
+            lens = PerspectiveLens()
+            if 'vfov' in view:
+                lens.setFov(view['fov'], view['vfov'])
+            else:
+                # Setting the aspect ratio keeps the horizontal field of view.
+                lens.setFov(view['fov'])
+                lens.setAspectRatio(float(dr.getPixelWidth()) /
+                                    dr.getPixelHeight())
+            lens.setNearFar(view.get('near', .1), view.get('far', 1000.))
+
+            camera_np = self.rigNP.attachNewNode(Camera(view['name'], lens))
+            camera_np.setHpr(view.get('heading', 0), view.get('pitch', 0),
+                             view.get('roll', 0))
+            dr.setCamera(camera_np)
+
+            self.cameraNP[view['name']] = camera_np
+            self.displayRegion[view['name']] = dr
+
+        self.isActive = False
+
+    def activate(self, flag=True):
+        for dr in self.displayRegion.values():
+            dr.setActive(flag)
+        if self.buffer is not None:
+            self.buffer.setActive(flag)
+            if flag:
+                self.cardNP.show()
+            else:
+                self.cardNP.hide()
+        self.isActive = flag
+
+    def destroy(self):
+        self.activate(False)
+        for dr in self.displayRegion.values():
+            dr.getWindow().removeDisplayRegion(dr)
+        if self.buffer is not None:
+            self.cardNP.removeNode()
+            self.world.graphicsEngine.removeWindow(self.buffer)
+            self.buffer = None
+        self.rigNP.removeNode()
@@ -0,0 +1,227 @@
+'''
+Parallel runner for parameter sweeps over headless SimWorldBase sessions.
+
+Every configuration runs in its own worker process (Panda3D allows one
+ShowBase per process) with its own seed. Workers write their trace records
+into a shared memory block, which they allocate once their world is built
+and its trace layout (world.traceSchema) is known, and announce to the
+parent. The parent attaches to each block, streams the new records to an
+optional callback while the sweep runs, aggregates a summary per run when
+it is done and releases the blocks.
+'''
+
+import ast
+import multiprocessing
+import queue
+import random
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from simworldtrace import ArrayTraceWriter
+from simworldtrace import TRACE_EVENT_ENTER
+from simworldtrace import TRACE_EVENT_EXIT
+
+
+_COUNTER_SIZE = np.dtype(np.int64).itemsize
+
+_announcements = None
+'''Queue of the worker processes to the parent, see _initWorker.'''
+
+
+def makeWorld(config, seed):
+    '''
+    Default world factory. Builds a headless SimWorldBase with a scene and an
+    actor of interest from the configuration:
+
+        scene, optimize, paging, actor, position, orientation, scale,
+        collisionSphere, fixedDt
+
+    paging is a dictionary of setupPagedScene options, e.g. {'loadRadius':
+    50.}, to page the scene in tiles instead of loading it whole.
+
+    Any other key must name an existing attribute of the world, e.g.
+    actorOIMoveSpeed or actorOITurnSpeed, and is assigned after set up.
+    '''
+    from simworldbase import SimWorldBase
+
+    config = dict(config)
+    world = SimWorldBase(width=config.pop('width', 320),
+                         height=config.pop('height', 240),
+                         isFullscreen=False, title='SimWorld',
+                         windowType=config.pop('windowType', 'none'),
+                         fixedDt=config.pop('fixedDt', 1/60.))
+    scene = config.pop('scene', 'world')
+    paging = config.pop('paging', None)
+    optimize = config.pop('optimize', None)
+    if paging is not None:
+        world.setupPagedScene(scene, **paging)
+    else:
+        world.setupScene(scene, optimize=optimize)
+    world.addActor(config.pop('actor', 'ball'),
+                   position=config.pop('position', (0,0,0)),
+                   orientation=config.pop('orientation', (0,0,0)),
+                   scale=config.pop('scale', (1,1,1)),
+                   collisionSphere=config.pop('collisionSphere', (0,0,0,1)))
+
+    for name, value in config.items():
+        if not hasattr(world, name):
+            raise ValueError('Unknown configuration key [{0}].'.format(name))
+        setattr(world, name, value)
+
+    world.activateActorOIControl(True)
+    return world
+
+
+def summarizeTrace(records):
+    '''Aggregates the trace records of one run into a dictionary.'''
+    if len(records) == 0:
+        return {'frames': 0}
+
+    xyz = np.column_stack((records['x'], records['y'], records['z']))
+    steps = np.sqrt((np.diff(xyz, axis=0)**2).sum(axis=1))
+    duration = float(records['time'][-1] - records['time'][0])
+    events = records['events']
+    return {'frames':        len(records),
+            'duration':      duration,
+            'pathLength':    float(steps.sum()),
+            'meanSpeed':     float(steps.sum() / duration) if duration else 0.,
+            'finalPosition': xyz[-1].tolist(),
+            'finalHeading':  float(records['heading'][-1]),
+            'enterEvents':   int(np.count_nonzero(events & TRACE_EVENT_ENTER)),
+            'exitEvents':    int(np.count_nonzero(events & TRACE_EVENT_EXIT))}
+
+
+def _initWorker(announcements):
+    global _announcements
+    _announcements = announcements
+
+
+def _getBlockViews(shm, dtype, steps):
+    counter = np.ndarray(1, dtype=np.int64, buffer=shm.buf)
+    records = np.ndarray(steps, dtype=dtype, buffer=shm.buf,
+                         offset=_COUNTER_SIZE)
+    return counter, records
+
+
+def _runJob(job):
+    factory, config, seed, steps, index = job
+
+    random.seed(seed)
+    np.random.seed(seed)
+
+    config = dict(config)
+    actions = config.pop('actions', None)
+    if actions is None:
+        # Seeded random walk over the (moveDir, turnDir) action space.
+        actions = np.random.randint(-1, 2, size=(steps, 2))
+    world = factory(config, seed)
+
+    # Sized from the world's channels, known only now. The parent unlinks
+    # the block when it is done with it.
+    dtype = world.traceSchema.getDtype()
+    shm = shared_memory.SharedMemory(
+        create=True, size=_COUNTER_SIZE + steps * dtype.itemsize)
+    counter, records = _getBlockViews(shm, dtype, steps)
+    counter[0] = 0
+    _announcements.put((index, shm.name,
+                        repr(np.lib.format.dtype_to_descr(dtype))))
+    try:
+        world.setTracing(None, backend=ArrayTraceWriter(records, counter))
+        world.step(steps, actions)
+        world.setTracing(None, False)
+        return int(counter[0])
+    finally:
+        del counter, records
+        shm.close()
+
+
+def runSweep(configs, steps, processes=None, seed=0, factory=makeWorld,
+             onRecords=None, pollInterval=.05):
+    '''
+    Runs every configuration for the given number of steps in a pool of
+    worker processes and returns one result dictionary per configuration
+    with its config, seed, trace records and summary.
+
+    A configuration may carry its own 'seed' and an 'actions' array of shape
+    (steps, 2) with per-frame (moveDir, turnDir); otherwise the seed is the
+    base seed plus the configuration index and the actor does a seeded
+    random walk. factory(config, seed) must return a ready headless world
+    and, like the configurations, be picklable. onRecords(index, records) is
+    called with each new batch of records as they arrive from the workers;
+    the records are a view into shared memory, valid during the call only.
+    '''
+    jobs = []
+    for i, config in enumerate(configs):
+        config = dict(config)
+        job_seed = config.pop('seed', seed + i)
+        jobs.append((factory, config, job_seed, steps, i))
+
+    blocks = [None] * len(jobs)
+    counters = [None] * len(jobs)
+    traces = [None] * len(jobs)
+    streamed = [0] * len(jobs)
+
+    def attach(timeout=None):
+        # Attaches to the blocks announced so far, waiting up to timeout
+        # seconds for the next one, and returns whether one came.
+        try:
+            index, name, descr = announcements.get(timeout is not None,
+                                                   timeout)
+        except queue.Empty:
+            return False
+        dtype = np.lib.format.descr_to_dtype(ast.literal_eval(descr))
+        blocks[index] = shared_memory.SharedMemory(name=name)
+        counters[index], traces[index] = _getBlockViews(blocks[index], dtype,
+                                                        steps)
+        return True
+
+    # One process per run, as Panda3D allows a single ShowBase each.
+    context = multiprocessing.get_context('spawn')
+    announcements = context.Queue()
+    try:
+        pool = context.Pool(processes, initializer=_initWorker,
+                            initargs=(announcements,), maxtasksperchild=1)
+        try:
+            pending = [pool.apply_async(_runJob, (job,)) for job in jobs]
+            while True:
+                is_done = all(p.ready() for p in pending)
+                while attach():
+                    pass
+                if onRecords is not None:
+                    for i, counter in enumerate(counters):
+                        count = int(counter[0]) if counter is not None else 0
+                        if count > streamed[i]:
+                            onRecords(i, traces[i][streamed[i]:count])
+                            streamed[i] = count
+                if is_done:
+                    break
+                time.sleep(pollInterval)
+            counts = [p.get() for p in pending]
+            # Announcements of the last runs may still be in the pipe.
+            while any(block is None for block in blocks):
+                if not attach(timeout=10.):
+                    raise IOError('A worker did not announce its trace.')
+        finally:
+            pool.close()
+            pool.join()
+
+        results = []
+        for job, count, trace in zip(jobs, counts, traces):
+            records = trace[:count].copy()
+            results.append({'config':  dict(job[1]),
+                            'seed':    job[2],
+                            'trace':   records,
+                            'summary': summarizeTrace(records)})
+        return results
+    finally:
+        # Blocks of failed runs are released too.
+        while attach():
+            pass
+        # Views into the blocks must be released before they are closed.
+        counters = traces = None
+        for shm in blocks:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
@@ -0,0 +1,149 @@
+'''
+Load time scene optimization for SimWorldBase.
+
+Models exported from modelling tools hold one Geom per object, each with
+its own node, so the renderer issues one draw call per object. Flattening
+merges the vertices of nodes sharing a render state into a few large Geoms
+while named objects the simulation refers to (collision nodes, start points,
+goals) are kept as separate nodes. Geometry that is never drawn can be
+dropped, and LOD nodes can make objects disappear beyond a distance.
+'''
+
+import fnmatch
+
+from panda3d.core import LODNode
+from panda3d.core import NodePath
+
+
+DEFAULT_OPTIONS = {'flatten':         'strong',
+                   'preserve':        (),
+                   'clearModelNodes': True,
+                   'removeHidden':    True,
+                   'lod':             {},
+                   'cellSize':        None}
+'''
+Options of optimizeScene. flatten is 'strong', 'medium', 'light' or None;
+preserve lists names or glob patterns of nodes to keep; lod maps names or
+glob patterns to the distance beyond which the matching nodes are not drawn.
+With cellSize, geometry is only merged within square cells of that size, so
+that the parts of the scene out of view can still be culled.
+'''
+
+
+def getSceneStats(root):
+    '''Counts the nodes, GeomNodes and Geoms below root.'''
+    geom_nps = root.findAllMatches('**/+GeomNode')
+    return {'nodes':     root.findAllMatches('**').getNumPaths(),
+            'geomNodes': geom_nps.getNumPaths(),
+            'geoms':     sum(geom_np.node().getNumGeoms()
+                             for geom_np in geom_nps)}
+
+
+def _matches(nodePath, patterns):
+    name = nodePath.getName()
+    return any(fnmatch.fnmatchcase(name, p) for p in patterns)
+
+
+def _findOutermost(nodePath, isMatch):
+    # Matches below a match belong to it and are handled with it.
+    found = []
+    for child_np in nodePath.getChildren():
+        if isMatch(child_np):
+            found.append(child_np)
+        else:
+            found.extend(_findOutermost(child_np, isMatch))
+    return found
+
+
+def _addLOD(nodePath, distance):
+    lod_np = nodePath.getParent().attachNewNode(LODNode('lod'))
+    nodePath.reparentTo(lod_np)
+    # Switch around the center of the object instead of its origin.
+    bounds = nodePath.getTightBounds(lod_np)
+    if bounds is not None:
+        lod_np.node().setCenter((bounds[0] + bounds[1]) / 2.)
+    lod_np.node().addSwitch(distance, 0)
+    return lod_np
+
+
+def _removeHidden(root):
+    count = 0
+    for geom_np in root.findAllMatches('**/+GeomNode;+s'):
+        if geom_np.isHidden() or geom_np.isStashed() or \
+           geom_np.node().getNumGeoms() == 0:
+            geom_np.removeNode()
+            count += 1
+    return count
+
+
+def _groupByCell(root, cellSize):
+    cells = {}
+    for geom_np in root.findAllMatches('**/+GeomNode'):
+        bounds = geom_np.getTightBounds(root)
+        if bounds is None:
+            continue
+        center = (bounds[0] + bounds[1]) / 2.
+        key = (int(center[0] // cellSize), int(center[1] // cellSize))
+        if key not in cells:
+            cells[key] = root.attachNewNode('cell')
+        geom_np.wrtReparentTo(cells[key])
+    return list(cells.values())
+
+
+def _flatten(root, method, isPreserved, cellSize=None):
+    # Preserved subtrees are taken out, flattened on their own and put back
+    # with their original transform relative to root.
+    preserved = []
+    for preserved_np in _findOutermost(root, isPreserved):
+        transform = preserved_np.getTransform(root)
+        preserved_np.detachNode()
+        preserved.append((preserved_np, transform))
+
+    # Flatten below root without touching root's own node and transform.
+    temp_np = NodePath('flatten')
+    root.getChildren().reparentTo(temp_np)
+    if cellSize:
+        for cell_np in _groupByCell(temp_np, cellSize):
+            getattr(cell_np, 'flatten' + method.capitalize())()
+    else:
+        getattr(temp_np, 'flatten' + method.capitalize())()
+    temp_np.getChildren().reparentTo(root)
+
+    for preserved_np, transform in preserved:
+        _flatten(preserved_np, method, isPreserved, cellSize)
+        preserved_np.reparentTo(root)
+        preserved_np.setTransform(transform)
+
+
+def optimizeScene(root, **options):
+    '''
+    Optimizes the scene below root in place, see DEFAULT_OPTIONS for the
+    options. Returns the node and Geom counts before and after.
+    '''
+    unknown = set(options) - set(DEFAULT_OPTIONS)
+    if unknown:
+        raise ValueError('Unknown scene options {0}.'.format(sorted(unknown)))
+    config = dict(DEFAULT_OPTIONS, **options)
+
+    report = {'before': getSceneStats(root), 'removed': 0}
+
+    if config['removeHidden']:
+        report['removed'] = _removeHidden(root)
+
+    for pattern, distance in config['lod'].items():
+        for node_np in _findOutermost(root, lambda n: _matches(n, [pattern])):
+            _addLOD(node_np, distance)
+
+    if config['clearModelNodes']:
+        root.clearModelNodes()
+
+    # LOD nodes are kept as well, whether added above or in the model.
+    def isPreserved(node_np):
+        return (node_np.node().isOfType(LODNode.getClassType()) or
+                _matches(node_np, config['preserve']))
+
+    if config['flatten']:
+        _flatten(root, config['flatten'], isPreserved, config['cellSize'])
+
+    report['after'] = getSceneStats(root)
+    return report
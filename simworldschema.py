@@ -0,0 +1,74 @@
+'''
+Declarative trace schema for SimWorldBase.
+
+A trace is a table with one row per frame and one typed column per channel.
+Channels are registered once, with a NumPy type and a getter called every
+frame; the getters' values go straight into the binary record, so nothing is
+formatted into strings while the session runs. A getter may also return
+several consecutive channels at once, e.g. the three coordinates of a
+position, to save calls.
+
+The default schema of SimWorldBase holds the channels of TRACE_DTYPE; a
+subclass adds its own with addTraceChannel before tracing starts.
+'''
+
+import numpy as np
+
+
+class TraceSchema(object):
+
+    def __init__(self):
+        self.fields = []
+        '''(name, type, shape) of every channel, in record order.'''
+
+        self._getters = []
+        self._dtype = None
+
+    def __len__(self):
+        return len(self.fields)
+
+    def getNames(self):
+        return [field[0] for field in self.fields]
+
+    def addChannel(self, name, dtype, getter, shape=()):
+        '''
+        Adds a channel sampled by calling getter(), which returns a scalar
+        of type dtype, or an array of the given shape.
+        '''
+        self.addChannels([(name, dtype, shape)], getter, isGroup=False)
+
+    def addChannels(self, fields, getter, isGroup=True):
+        '''
+        Adds consecutive channels, a list of (name, dtype) or (name, dtype,
+        shape), all sampled by one call to getter(), which returns one value
+        per channel.
+        '''
+        names = self.getNames()
+        fields = [tuple(field) + ((),) * (3 - len(field)) for field in fields]
+        for name, dtype, shape in fields:
+            if name in names:
+                raise ValueError('Trace channel [{0}] already exists.'
+                                 .format(name))
+            names.append(name)
+        self.fields.extend((name, np.dtype(dtype).str, tuple(shape))
+                           for name, dtype, shape in fields)
+        self._getters.append((getter, isGroup))
+        self._dtype = None
+
+    def getDtype(self):
+        '''Record layout of the channels, cached until one is added.'''
+        if self._dtype is None:
+            self._dtype = np.dtype([(name, dtype, shape) if shape else
+                                    (name, dtype)
+                                    for name, dtype, shape in self.fields])
+        return self._dtype
+
+    def sample(self):
+        '''Returns the current values of all channels as a record tuple.'''
+        values = []
+        for getter, isGroup in self._getters:
+            if isGroup:
+                values.extend(getter())
+            else:
+                values.append(getter())
+        return tuple(values)
@@ -0,0 +1,440 @@
+'''
+Static 2D spatial index of the world's collision geometry.
+
+Solid and goal geometry, as marked by SimWorldBase.setObjectSolid and
+setObjectGoal, is extracted from the scene once and projected onto the floor
+plane as line segments: steep solid triangles become wall segments, goal
+triangles contribute their outline. The segments are bucketed in a uniform
+grid which answers sphere and ray queries for arrays of actors at once.
+'''
+
+import numpy as np
+
+from panda3d.core import CollisionPolygon
+from panda3d.core import GeomEnums
+
+
+SOLID = 0x001
+'''Collide mask bit of objects marked with SimWorldBase.setObjectSolid.'''
+
+GOAL = 0x002
+'''Collide mask bit of objects marked with SimWorldBase.setObjectGoal.'''
+
+CONTACT_DTYPE = np.dtype([('hit',      '?'),
+                          ('segment',  '<i4'),
+                          ('category', '<u4'),
+                          ('distance', '<f8'),
+                          ('px',       '<f8'),
+                          ('py',       '<f8'),
+                          ('nx',       '<f8'),
+                          ('ny',       '<f8'),
+                          ('angle',    '<f8')])
+'''
+Result of a batch query, one record per actor or ray. p is the contact point
+on the segment, n the unit contact normal pointing away from the segment
+towards the actor (or against the ray) and angle the collision angle in
+degrees between the actor heading and -n, as traced by SimWorldBase.
+'''
+
+_NUMERIC_TYPES = {GeomEnums.NTFloat32: '<f4', GeomEnums.NTFloat64: '<f8'}
+
+
+def _readVertices(vdata):
+    # Reads the vertex column straight from the array buffer instead of
+    # going through a GeomVertexReader one row at a time.
+    fmt = vdata.getFormat()
+    array_index = fmt.getArrayWith('vertex')
+    column = fmt.getColumn('vertex')
+    stride = fmt.getArray(array_index).getStride()
+    dtype = np.dtype(_NUMERIC_TYPES[column.getNumericType()])
+    raw = np.frombuffer(bytes(memoryview(vdata.getArray(array_index))),
+                        dtype=np.uint8).reshape(-1, stride)
+    start = column.getStart()
+    raw = raw[:, start:start + 3 * dtype.itemsize].copy()
+    return raw.view(dtype).reshape(-1, 3).astype(np.float64)
+
+
+def _transform(points, mat):
+    m = np.array([[mat.getCell(i, j) for j in range(4)] for i in range(4)])
+    return points.dot(m[:3,:3]) + m[3,:3]
+
+
+def extractTriangles(root, mask=SOLID|GOAL):
+    '''
+    Returns the triangles of all geometry and collision polygons under root
+    whose into collide mask intersects mask, as a (k, 3, 3) array in root's
+    coordinate space, and the matching collide mask bits per triangle.
+    '''
+    triangles = []
+    masks = []
+
+    for node_np in root.findAllMatches('**/+GeomNode'):
+        node = node_np.node()
+        bits = node.getIntoCollideMask().getWord() & mask
+        if not bits:
+            continue
+        mat = node_np.getMat(root)
+        for geom in node.getGeoms():
+            vertices = _transform(_readVertices(geom.getVertexData()), mat)
+            for i in range(geom.getNumPrimitives()):
+                primitive = geom.getPrimitive(i).decompose()
+                if primitive.getNumVerticesPerPrimitive() != 3:
+                    continue
+                indices = np.array(primitive.getVertexList(), dtype=np.int64)
+                triangles.append(vertices[indices].reshape(-1, 3, 3))
+                masks.append(np.full(len(indices) // 3, bits, np.uint32))
+
+    for node_np in root.findAllMatches('**/+CollisionNode'):
+        node = node_np.node()
+        bits = node.getIntoCollideMask().getWord() & mask
+        if not bits:
+            continue
+        mat = node_np.getMat(root)
+        fan = []
+        for solid in node.getSolids():
+            if not isinstance(solid, CollisionPolygon):
+                continue
+            points = [tuple(p) for p in solid.getPoints()]
+            for j in range(1, len(points) - 1):
+                fan.append((points[0], points[j], points[j + 1]))
+        if fan:
+            points = _transform(np.array(fan).reshape(-1, 3), mat)
+            triangles.append(points.reshape(-1, 3, 3))
+            masks.append(np.full(len(fan), bits, np.uint32))
+
+    if not triangles:
+        return np.zeros((0, 3, 3)), np.zeros(0, np.uint32)
+    return np.concatenate(triangles), np.concatenate(masks)
+
+
+def _uniqueSegments(segments, categories):
+    # Orient every segment the same way and drop duplicates, e.g. the two
+    # triangles of a wall quad project onto the same segment.
+    swap = ((segments[:,0] > segments[:,2]) |
+            ((segments[:,0] == segments[:,2]) &
+             (segments[:,1] > segments[:,3])))
+    segments = segments.copy()
+    segments[swap] = segments[swap][:, [2, 3, 0, 1]]
+    keys = np.column_stack((np.round(segments, 6), categories))
+    keys, index, counts = np.unique(keys, axis=0, return_index=True,
+                                    return_counts=True)
+    return segments[index], categories[index], counts
+
+
+def trianglesToSegments(triangles, masks, maxWallNormalZ=.5):
+    '''
+    Projects triangles onto the floor plane. Solid triangles steeper than
+    maxWallNormalZ (the z component of their unit normal) become one wall
+    segment each; goal triangles contribute the edges of their outline.
+    '''
+    normals = np.cross(triangles[:,1] - triangles[:,0],
+                       triangles[:,2] - triangles[:,0])
+    lengths = np.sqrt((normals**2).sum(axis=1))
+    valid = lengths > 0
+    nz = np.zeros(len(triangles))
+    nz[valid] = np.abs(normals[valid, 2]) / lengths[valid]
+    flat = triangles[:, :, :2]
+
+    # A near vertical triangle projects onto its longest 2D edge.
+    edges = np.array([(0, 1), (0, 2), (1, 2)])
+    edge_lengths = np.stack([((flat[:,a] - flat[:,b])**2).sum(axis=1)
+                             for a, b in edges], axis=1)
+    longest = edges[np.argmax(edge_lengths, axis=1)]
+    rows = np.arange(len(triangles))
+    walls = valid & (nz < maxWallNormalZ) & ((masks & SOLID) != 0)
+    wall_segments = np.concatenate((flat[rows, longest[:,0]],
+                                    flat[rows, longest[:,1]]), axis=1)[walls]
+    wall_categories = np.full(len(wall_segments), SOLID, np.uint32)
+    wall_segments, wall_categories, counts = _uniqueSegments(wall_segments,
+                                                             wall_categories)
+
+    # Only outline edges of a goal mesh are kept; inner edges are shared by
+    # two triangles.
+    goals = valid & ((masks & GOAL) != 0)
+    goal_segments = np.concatenate([np.concatenate((flat[goals, a],
+                                                    flat[goals, b]), axis=1)
+                                    for a, b in edges])
+    goal_categories = np.full(len(goal_segments), GOAL, np.uint32)
+    goal_segments, goal_categories, counts = _uniqueSegments(goal_segments,
+                                                             goal_categories)
+    outline = counts == 1
+    goal_segments = goal_segments[outline]
+    goal_categories = goal_categories[outline]
+
+    segments = np.concatenate((wall_segments, goal_segments))
+    categories = np.concatenate((wall_categories, goal_categories))
+    keep = ((segments[:,:2] - segments[:,2:])**2).sum(axis=1) > 1e-12
+    return segments[keep], categories[keep]
+
+
+class SpatialIndex(object):
+    '''
+    Uniform grid over 2D segments (x0, y0, x1, y1) with a category bit per
+    segment. Cell contents are stored in compressed row form so that the
+    candidates of many cells are gathered with a few array operations.
+    '''
+
+    RAY_ROUND_CELLS = 4
+    '''Cells walked by every ray between two hit tests in queryRays.'''
+
+    def __init__(self, segments, categories, cellSize=None):
+        self.segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4)
+        self.categories = np.asarray(categories, dtype=np.uint32)
+
+        lo = np.minimum(self.segments[:,:2], self.segments[:,2:])
+        hi = np.maximum(self.segments[:,:2], self.segments[:,2:])
+        if len(self.segments):
+            self.origin = lo.min(axis=0)
+            extent = hi.max(axis=0) - self.origin
+        else:
+            self.origin = np.zeros(2)
+            extent = np.ones(2)
+
+        if cellSize is None:
+            # Aim for a few segments per cell on average.
+            area = max(extent[0] * extent[1], 1e-6)
+            cellSize = np.sqrt(4 * area / max(len(self.segments), 1))
+        self.cellSize = float(cellSize)
+        self.shape = np.maximum(np.ceil(extent / self.cellSize), 1).astype(int)
+
+        # Bucket every segment into each cell its bounding box overlaps.
+        c0 = self._cell(lo)
+        c1 = self._cell(hi)
+        spans = c1 - c0 + 1
+        counts = spans[:,0] * spans[:,1]
+        owner = np.repeat(np.arange(len(self.segments)), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                    counts)
+        cx = c0[owner, 0] + local % spans[owner, 0]
+        cy = c0[owner, 1] + local // spans[owner, 0]
+        cells = cx * self.shape[1] + cy
+
+        order = np.argsort(cells, kind='stable')
+        self.cellItems = owner[order]
+        self.cellStart = np.searchsorted(cells[order],
+                                         np.arange(self.shape.prod() + 1))
+
+    @classmethod
+    def fromScene(cls, root, cellSize=None, maxWallNormalZ=.5):
+        triangles, masks = extractTriangles(root)
+        segments, categories = trianglesToSegments(triangles, masks,
+                                                   maxWallNormalZ)
+        return cls(segments, categories, cellSize)
+
+    def _cell(self, points):
+        cell = np.floor((points - self.origin) / self.cellSize).astype(int)
+        return np.clip(cell, 0, self.shape - 1)
+
+    def _gather(self, owners, cells):
+        # Expands (owner, cell) pairs into (owner, segment) candidate pairs.
+        start = self.cellStart[cells]
+        counts = self.cellStart[cells + 1] - start
+        pair_owner = np.repeat(owners, counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts)-counts,
+                                                      counts)
+        pair_segment = self.cellItems[np.repeat(start, counts) + offsets]
+        return pair_owner, pair_segment
+
+    def _nearest(self, owners, values):
+        # Index into owners/values of the smallest value for each owner.
+        order = np.lexsort((values, owners))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = owners[order][1:] != owners[order][:-1]
+        best = order[first]
+        return owners[best], best
+
+    def _intersectRays(self, origins, directions, maxDistance, categories,
+                       owners, cells, bestT, bestSegment):
+        # Ray against segment intersection of the candidates in cells, kept
+        # in bestT and bestSegment when nearer than the hits found before.
+        owners, segments = self._gather(owners, cells)
+        mask = (self.categories[segments] & categories) != 0
+        owners, segments = owners[mask], segments[mask]
+
+        a = self.segments[segments, :2]
+        d = self.segments[segments, 2:] - a
+        o = origins[owners]
+        r = directions[owners]
+        denominator = r[:,0] * d[:,1] - r[:,1] * d[:,0]
+        w = a - o
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = (w[:,0] * d[:,1] - w[:,1] * d[:,0]) / denominator
+            u = (w[:,0] * r[:,1] - w[:,1] * r[:,0]) / denominator
+        hit = ((denominator != 0) & (t >= 0) & (t <= maxDistance) &
+               (u >= 0) & (u <= 1))
+        owners, segments, t = owners[hit], segments[hit], t[hit]
+        if len(owners) == 0:
+            return
+        rays, best = self._nearest(owners, t)
+        nearer = t[best] < bestT[rays]
+        rays, best = rays[nearer], best[nearer]
+        bestT[rays] = t[best]
+        bestSegment[rays] = segments[best]
+
+    def _result(self, n):
+        result = np.zeros(n, dtype=CONTACT_DTYPE)
+        result['segment'] = -1
+        result['distance'] = np.inf
+        result['angle'] = np.nan
+        return result
+
+    def _setAngles(self, result, headings):
+        if headings is None:
+            return
+        rad = np.radians(np.asarray(headings, dtype=np.float64))
+        forward = np.column_stack((-np.sin(rad), np.cos(rad)))
+        hit = result['hit']
+        cosine = -(forward[hit,0] * result['nx'][hit] +
+                   forward[hit,1] * result['ny'][hit])
+        result['angle'][hit] = np.degrees(np.arccos(np.clip(cosine, -1, 1)))
+
+    def querySpheres(self, centers, radii, headings=None,
+                     categories=SOLID|GOAL):
+        '''
+        Finds the nearest segment of the given categories touching each
+        sphere (projected to a circle on the floor plane). centers is an
+        (n, 2) or (n, 3) array, radii a scalar or an array of n, and headings
+        the actor headings in degrees used for the collision angle.
+        '''
+        centers = np.asarray(centers, dtype=np.float64)[:, :2]
+        n = len(centers)
+        radii = np.broadcast_to(np.asarray(radii, dtype=np.float64), (n,))
+        result = self._result(n)
+        if n == 0 or len(self.segments) == 0:
+            return result
+
+        # Every cell overlapped by the bounding box of each circle.
+        c0 = self._cell(centers - radii[:,None])
+        c1 = self._cell(centers + radii[:,None])
+        spans = c1 - c0 + 1
+        counts = spans[:,0] * spans[:,1]
+        owners = np.repeat(np.arange(n), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                    counts)
+        cells = ((c0[owners,0] + local % spans[owners,0]) * self.shape[1] +
+                 c0[owners,1] + local // spans[owners,0])
+        owners, segments = self._gather(owners, cells)
+
+        mask = (self.categories[segments] & categories) != 0
+        owners, segments = owners[mask], segments[mask]
+
+        # Closest point on each candidate segment.
+        a = self.segments[segments, :2]
+        d = self.segments[segments, 2:] - a
+        p = centers[owners]
+        t = np.clip(((p - a) * d).sum(axis=1) / (d**2).sum(axis=1), 0, 1)
+        closest = a + t[:,None] * d
+        offset = p - closest
+        distance = np.sqrt((offset**2).sum(axis=1))
+
+        touching = distance <= radii[owners]
+        owners, segments = owners[touching], segments[touching]
+        closest, offset = closest[touching], offset[touching]
+        distance = distance[touching]
+        if len(owners) == 0:
+            return result
+
+        actors, best = self._nearest(owners, distance)
+        normal = offset[best]
+        length = distance[best]
+        # Centers exactly on a segment take the segment's perpendicular.
+        on_segment = length == 0
+        d = (self.segments[segments[best], 2:] -
+             self.segments[segments[best], :2])
+        normal[on_segment] = np.column_stack((-d[:,1], d[:,0]))[on_segment]
+        length = np.sqrt((normal**2).sum(axis=1))
+
+        result['hit'][actors] = True
+        result['segment'][actors] = segments[best]
+        result['category'][actors] = self.categories[segments[best]]
+        result['distance'][actors] = distance[best]
+        result['px'][actors] = closest[best, 0]
+        result['py'][actors] = closest[best, 1]
+        result['nx'][actors] = normal[:,0] / length
+        result['ny'][actors] = normal[:,1] / length
+        self._setAngles(result, headings)
+        return result
+
+    def queryRays(self, origins, directions, maxDistance,
+                  categories=SOLID|GOAL):
+        '''
+        Casts rays on the floor plane and returns the first segment of the
+        given categories hit by each ray within maxDistance. Origins are
+        expected inside the indexed area and directions need not be
+        normalized; distance is reported in world units.
+        '''
+        origins = np.asarray(origins, dtype=np.float64)[:, :2]
+        directions = np.asarray(directions, dtype=np.float64)[:, :2]
+        n = len(origins)
+        result = self._result(n)
+        if n == 0 or len(self.segments) == 0:
+            return result
+        directions = directions / np.sqrt((directions**2).sum(axis=1))[:,None]
+
+        # Walk the grid cells along all rays in lockstep (Amanatides & Woo),
+        # a few cells per round. After each round the candidates met so far
+        # are tested, and rays whose nearest hit lies within the cells they
+        # already covered stop walking, so that the cost follows the
+        # distance to the first hit rather than maxDistance.
+        cell = self._cell(origins)
+        step = np.where(directions >= 0, 1, -1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            boundary = self.origin + (cell + (step > 0)) * self.cellSize
+            t_max = np.where(directions != 0,
+                             (boundary - origins) / directions, np.inf)
+            t_delta = np.where(directions != 0,
+                               self.cellSize / np.abs(directions), np.inf)
+
+        best_t = np.full(n, np.inf)
+        best_segment = np.full(n, -1, dtype=np.int64)
+        rows = np.arange(n)
+        owners = [rows]
+        cells = [cell[:,0] * self.shape[1] + cell[:,1]]
+        while True:
+            walking = rows
+            for i in range(self.RAY_ROUND_CELLS):
+                covered = np.minimum(t_max[walking,0], t_max[walking,1])
+                walking = walking[covered <= maxDistance]
+                if len(walking) == 0:
+                    break
+                axis = np.argmin(t_max[walking], axis=1)
+                cell[walking, axis] += step[walking, axis]
+                t_max[walking, axis] += t_delta[walking, axis]
+                inside = ((cell[walking] >= 0) &
+                          (cell[walking] < self.shape)).all(axis=1)
+                walking = walking[inside]
+                owners.append(walking)
+                cells.append(cell[walking,0] * self.shape[1] +
+                             cell[walking,1])
+
+            if owners:
+                self._intersectRays(origins, directions, maxDistance,
+                                    categories, np.concatenate(owners),
+                                    np.concatenate(cells), best_t,
+                                    best_segment)
+            covered = np.minimum(t_max[walking,0], t_max[walking,1])
+            rows = walking[best_t[walking] > covered]
+            if len(rows) == 0:
+                break
+            owners, cells = [], []
+
+        rays = np.nonzero(best_segment >= 0)[0]
+        if len(rays) == 0:
+            return result
+        segments, t = best_segment[rays], best_t[rays]
+        d = self.segments[segments, 2:] - self.segments[segments, :2]
+        normal = np.column_stack((-d[:,1], d[:,0]))
+        normal /= np.sqrt((normal**2).sum(axis=1))[:,None]
+        facing = (normal * directions[rays]).sum(axis=1) > 0
+        normal[facing] *= -1
+        point = origins[rays] + t[:,None] * directions[rays]
+
+        result['hit'][rays] = True
+        result['segment'][rays] = segments
+        result['category'][rays] = self.categories[segments]
+        result['distance'][rays] = t
+        result['px'][rays] = point[:,0]
+        result['py'][rays] = point[:,1]
+        result['nx'][rays] = normal[:,0]
+        result['ny'][rays] = normal[:,1]
+        return result
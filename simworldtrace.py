@@ -0,0 +1,201 @@
+'''
+Binary trace backend for SimWorldBase.
+
+Trace records are accumulated in a preallocated NumPy structured ring buffer
+on the render thread and flushed in bulk to disk from a background thread.
+The file is a plain .npy array whose header is rewritten with the final record
+count on close, so it can be memory mapped with readTrace (or numpy.load) even
+if the session did not shut down cleanly.
+'''
+
+import os
+import struct
+import threading
+
+import numpy as np
+
+
+TRACE_EVENT_ENTER = 0x01
+'''Trace event flag set when an actor entered a collision volume.'''
+
+TRACE_EVENT_EXIT = 0x02
+'''Trace event flag set when an actor exited a collision volume.'''
+
+TRACE_DTYPE = np.dtype([('time',           '<f8'),
+                        ('frame',          '<i8'),
+                        ('x',              '<f4'),
+                        ('y',              '<f4'),
+                        ('z',              '<f4'),
+                        ('heading',        '<f4'),
+                        ('vx',             '<f4'),
+                        ('vy',             '<f4'),
+                        ('vz',             '<f4'),
+                        ('moveDir',        '<i1'),
+                        ('turnDir',        '<i1'),
+                        ('events',         '<u1'),
+                        ('collisionAngle', '<f4')])
+'''Record layout of the default actor of interest trace.'''
+
+_NPY_MAGIC = b'\x93NUMPY\x01\x00'
+
+
+def _makeHeader(dtype, count):
+    # The header is padded to a size that does not depend on the record
+    # count, so it can be rewritten in place when the file is closed.
+    descr = np.lib.format.dtype_to_descr(dtype)
+    text = "{{'descr': {0!r}, 'fortran_order': False, 'shape': ({1},), }}"
+    size = len(text.format(descr, 2**63)) + len(_NPY_MAGIC) + 2 + 1
+    size = (size + 63) // 64 * 64
+    text = text.format(descr, count).ljust(size - len(_NPY_MAGIC) - 2 - 1)
+    text = (text + '\n').encode('latin1')
+    return _NPY_MAGIC + struct.pack('<H', len(text)) + text
+
+
+class TraceWriter(object):
+    '''
+    Writes fixed size trace records to a binary .npy file. append() only copies
+    the record into the ring buffer; disk I/O happens on a background thread
+    whenever flushSize records are pending or flushInterval seconds passed.
+    '''
+
+    def __init__(self, fileName, dtype=TRACE_DTYPE, capacity=65536,
+                 flushSize=1024, flushInterval=1.0):
+        self.fileName = fileName
+        self.dtype = np.dtype(dtype)
+        self.capacity = capacity
+        self.flushSize = min(flushSize, capacity)
+        self.flushInterval = flushInterval
+
+        self.stallCount = 0
+        '''Number of appends that had to wait for the flush thread.'''
+
+        self._buffer = np.zeros(capacity, dtype=self.dtype)
+        self._head = 0
+        self._tail = 0
+        self._isClosing = False
+        self._isWaking = False
+        self._condition = threading.Condition()
+
+        self._file = open(fileName, 'wb')
+        self._file.write(_makeHeader(self.dtype, 0))
+
+        self._thread = threading.Thread(target=self._flushLoop,
+                                        name='TraceWriter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __len__(self):
+        return self._head
+
+    def append(self, record):
+        head = self._head
+        if head - self._tail >= self.capacity:
+            with self._condition:
+                self.stallCount += 1
+                self._condition.notify_all()
+                while self._head - self._tail >= self.capacity:
+                    self._condition.wait()
+
+        self._buffer[head % self.capacity] = record
+        self._head = head + 1
+
+        if self._head - self._tail >= self.flushSize and not self._isWaking:
+            with self._condition:
+                self._isWaking = True
+                self._condition.notify_all()
+
+    def flush(self):
+        with self._condition:
+            head = self._head
+            self._condition.notify_all()
+            while self._tail < head:
+                self._condition.wait()
+
+    def close(self):
+        if self._file is None:
+            return
+        with self._condition:
+            self._isClosing = True
+            self._condition.notify_all()
+        self._thread.join()
+
+        self._file.seek(0)
+        self._file.write(_makeHeader(self.dtype, self._tail))
+        self._file.close()
+        self._file = None
+
+    def _flushLoop(self):
+        while True:
+            with self._condition:
+                if (self._head - self._tail < self.flushSize and
+                    not self._isClosing):
+                    self._condition.wait(self.flushInterval)
+                isClosing = self._isClosing
+                self._isWaking = False
+
+            head = self._head
+            tail = self._tail
+            while tail < head:
+                start = tail % self.capacity
+                stop = min(start + head - tail, self.capacity)
+                self._file.write(self._buffer[start:stop].data)
+                tail += stop - start
+            self._file.flush()
+
+            with self._condition:
+                self._tail = tail
+                self._condition.notify_all()
+
+            if isClosing and self._tail == self._head:
+                break
+
+
+class ArrayTraceWriter(object):
+    '''
+    Writes trace records into a preallocated array, e.g. one backed by shared
+    memory. The number of records written is mirrored into counter[0] when a
+    counter array is given so that other processes can follow the progress.
+    Records that do not fit are counted in dropCount.
+    '''
+
+    def __init__(self, array, counter=None):
+        self.array = array
+        self.counter = counter
+        self.dropCount = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, record):
+        if self._count == len(self.array):
+            self.dropCount += 1
+            return
+        self.array[self._count] = record
+        self._count += 1
+        if self.counter is not None:
+            self.counter[0] = self._count
+
+    def close(self):
+        pass
+
+
+def readTrace(fileName):
+    '''
+    Memory maps a trace written by TraceWriter. The record count is derived
+    from the file size so traces of crashed sessions are readable as well.
+    '''
+    with open(fileName, 'rb') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            header = np.lib.format.read_array_header_1_0(f)
+        else:
+            header = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+
+    dtype = header[2]
+    count = (os.path.getsize(fileName) - offset) // dtype.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(fileName, dtype=dtype, mode='r', offset=offset,
+                     shape=(count,))
@@ -0,0 +1,199 @@
+'''
+Trial scheduler for SimWorldBase.
+
+A session is a sequence of trials run in one world. A trial is described by
+a dictionary:
+
+    name         label reported with the result
+    position     start position of the actor of interest
+    orientation  start orientation (heading, pitch, roll)
+    goals        names or glob patterns of the goal objects of the trial;
+                 no other object of the scene stays a goal, None keeps
+                 the goals as they are
+    lights       dictionary of light name to on/off flag
+    camera       name of the camera to activate
+    timeLimit    seconds after which the trial ends, None for no limit
+    interval     seconds of inter-trial interval before the trial
+    endOnGoal    end the trial when the actor of interest reaches a goal
+
+Missing keys keep the scheduler defaults. Nothing is reloaded between
+trials: the actor is moved back in place, and the goal objects and camera
+are switched on the existing scene graph. The object lookups and collide
+mask changes of the next trial are prepared when the interval starts, so
+the transition itself only applies them.
+'''
+
+from panda3d.core import NodePathCollection
+
+from simworldspatial import GOAL
+from simworldtrace import TRACE_EVENT_ENTER
+
+
+DEFAULT_TRIAL = {'name':        None,
+                 'position':    None,
+                 'orientation': None,
+                 'goals':       None,
+                 'lights':      {},
+                 'camera':      None,
+                 'timeLimit':   None,
+                 'interval':    0.,
+                 'endOnGoal':   True}
+'''Default trial description, see the module documentation.'''
+
+
+class TrialScheduler(object):
+    '''
+    Runs trials one after the other in world. onTrialStart(index, trial) and
+    onTrialEnd(result) are called at the transitions and onDone(results)
+    after the last trial. The actor of interest control is off during the
+    inter-trial intervals when freezeDuringInterval is set.
+    '''
+
+    def __init__(self, world, trials, onTrialStart=None, onTrialEnd=None,
+                 onDone=None, freezeDuringInterval=True):
+        self.world = world
+        self.trials = [dict(DEFAULT_TRIAL, **trial) for trial in trials]
+        self.onTrialStart = onTrialStart
+        self.onTrialEnd = onTrialEnd
+        self.onDone = onDone
+        self.freezeDuringInterval = freezeDuringInterval
+
+        self.results = []
+        '''One result dictionary per finished trial.'''
+
+        self.index = -1
+        '''Index of the current or upcoming trial.'''
+
+        self.state = 'idle'
+        '''One of 'idle', 'interval', 'running' and 'done'.'''
+
+        self.startTime = None
+        self.startFrame = None
+        self.transitionTime = None
+        self.goalNPs = NodePathCollection()
+        self._staged = None
+        self._intervalEnd = None
+
+    def start(self):
+        self._beginInterval()
+        self.world.taskMgr.add(self.trialTask, 'trialScheduler', sort=32)
+
+    def stop(self):
+        self.world.taskMgr.remove('trialScheduler')
+        self.state = 'done'
+
+    def isDone(self):
+        return self.state == 'done'
+
+    def run(self, maxFrames=None):
+        '''Steps a headless world until all trials are done.'''
+        self.start()
+        frame = 0
+        while not self.isDone() and (maxFrames is None or frame < maxFrames):
+            self.world.step()
+            frame += 1
+        return self.results
+
+    def stage(self, trial):
+        '''
+        Resolves everything the trial needs from the scene graph ahead of
+        time and returns it for apply().
+        '''
+        world = self.world
+        goal_nps = NodePathCollection()
+        if trial['goals'] is not None:
+            goal_nps = world.getObject(trial['goals'])
+        lights = [(world.lightNP[name], flag)
+                  for name, flag in trial['lights'].items()]
+        return {'trial':  trial,
+                'goals':  goal_nps,
+                'lights': lights}
+
+    def apply(self, staged):
+        world = self.world
+        trial = staged['trial']
+
+        if trial['goals'] is not None:
+            world.clearObjectGoals()
+            world.setObjectGoal(trial['goals'], True, staged['goals'])
+            self.goalNPs = staged['goals']
+
+        for light_np, flag in staged['lights']:
+            if flag:
+                world.render.setLight(light_np)
+            else:
+                world.render.setLightOff(light_np)
+
+        if trial['camera'] is not None:
+            world.activateCamera(trial['camera'])
+
+        world.resetActorOI(trial['position'], trial['orientation'])
+
+    def trialTask(self, task):
+        now = self.world.clock.getFrameTime()
+        if self.state == 'interval' and now >= self._intervalEnd:
+            self._beginTrial()
+        elif self.state == 'running':
+            trial = self.trials[self.index]
+            goal = self._getGoalReached() if trial['endOnGoal'] else None
+            if goal is not None:
+                self._endTrial('goal', goal)
+            elif (trial['timeLimit'] is not None and
+                  now - self.startTime >= trial['timeLimit']):
+                self._endTrial('timeout')
+        if self.state == 'done':
+            return task.done
+        return task.cont
+
+    def _getGoalReached(self):
+        world = self.world
+        events = world.getActorOIEvents(TRACE_EVENT_ENTER)
+        reached = events[events['category'] & GOAL != 0]
+        if len(reached) == 0:
+            return None
+        return world.collisionBatcher.objectNames[reached[0]['object']]
+
+    def _beginInterval(self):
+        self.index += 1
+        if self.index >= len(self.trials):
+            self.state = 'done'
+            if self.onDone is not None:
+                self.onDone(self.results)
+            return
+        trial = self.trials[self.index]
+        self._staged = self.stage(trial)
+        self._intervalEnd = (self.world.clock.getFrameTime() +
+                             trial['interval'])
+        if self.freezeDuringInterval:
+            self.world.activateActorOIControl(False)
+            self.world.actorOIMoveDir = self.world.actorOITurnDir = 0
+        self.state = 'interval'
+
+    def _beginTrial(self):
+        clock = self.world.clock
+        start = clock.getRealTime()
+        self.apply(self._staged)
+        self._staged = None
+        if self.freezeDuringInterval:
+            self.world.activateActorOIControl(True)
+        self.transitionTime = clock.getRealTime() - start
+        self.startTime = clock.getFrameTime()
+        self.startFrame = clock.getFrameCount()
+        self.state = 'running'
+        if self.onTrialStart is not None:
+            self.onTrialStart(self.index, self.trials[self.index])
+
+    def _endTrial(self, outcome, goal=None):
+        clock = self.world.clock
+        trial = self.trials[self.index]
+        result = {'index':          self.index,
+                  'name':           trial['name'],
+                  'outcome':        outcome,
+                  'goal':           goal,
+                  'duration':       clock.getFrameTime() - self.startTime,
+                  'frames':         clock.getFrameCount() - self.startFrame,
+                  'transitionTime': self.transitionTime}
+        self.results.append(result)
+        if self.onTrialEnd is not None:
+            self.onTrialEnd(result)
+        self._beginInterval()